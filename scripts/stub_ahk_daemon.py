@@ -0,0 +1,55 @@
+"""
+Stand-in for src/ahk_daemon.ahk speaking the same stdin/stdout protocol, to run the bot's command path on Linux.
+
+Usage: python stub_ahk_daemon.py <console hwnd> [--log FILE] [--crash-after N] [--lose-window-after N] [--delay S]
+
+Acknowledged commands are appended to FILE (stderr by default). --crash-after exits without answering the Nth
+command, --lose-window-after answers 'nowindow' from the Nth command on, --delay waits before every answer.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('console')
+    parser.add_argument('--log')
+    parser.add_argument('--crash-after', type=int)
+    parser.add_argument('--lose-window-after', type=int)
+    parser.add_argument('--delay', type=float, default=0)
+    args = parser.parse_args()
+
+    log = open(args.log, 'a') if args.log else sys.stderr
+
+    def reply(text):
+        sys.stdout.write(text + '\n')
+        sys.stdout.flush()
+
+    reply(f"ready {os.getpid()}")
+    count = 0
+
+    for line in sys.stdin:
+        seq, _, cmd = line.rstrip('\r\n').partition(' ')
+        count += 1
+
+        if args.crash_after and count >= args.crash_after:
+            sys.exit(1)
+
+        if args.delay:
+            time.sleep(args.delay)
+
+        if args.lose_window_after and count >= args.lose_window_after:
+            reply(f"err {seq} nowindow")
+            continue
+
+        if cmd:
+            log.write(f"{args.console} {cmd}\n")
+            log.flush()
+        reply(f"ack {seq}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Persistent console command helper.
+
+Instead of starting a new AutoHotkey interpreter for every console line, one helper process (ahk_daemon.ahk) is
+kept running and fed over its stdin. The protocol is line based so it can be spoken by any helper, e.g. the stub in
+scripts/stub_ahk_daemon.py on Linux:
+
+    helper -> bot   ready <pid>              once, when the helper is listening
+    bot -> helper   <seq> <command>          type <command> in the console and press enter ('' is a heartbeat)
+    helper -> bot   ack <seq>                done
+    helper -> bot   err <seq> <reason>       failed, 'nowindow' when the console window is gone
+
+A helper that exits, closes its stdout or doesn't acknowledge in time is considered crashed: the commands waiting
+on it fail with DaemonError and the next command restarts it (at most once per RESTART_BACKOFF seconds).
+"""
+
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+READY_TIMEOUT = 5  # Seconds the helper gets to start listening
+ACK_TIMEOUT = 3  # Seconds the helper gets to acknowledge a command
+RESTART_BACKOFF = 5  # Min seconds between two helper starts
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ahk_daemon.ahk')
+
+
+class DaemonError(Exception):
+    pass
+
+
+class WindowLostError(DaemonError):
+    pass
+
+
+class CommandDaemon:
+    def __init__(self, argv, name='ahk-daemon', ack_timeout=ACK_TIMEOUT):
+        """`argv(target)` returns the command line of the helper for the console `target` (a window handle)"""
+        self.argv = argv
+        self.name = name
+        self.ack_timeout = ack_timeout
+
+        self.target = None
+        self.process = None
+        self.started_at = None
+        self.last_start_attempt = 0
+
+        self._seq = itertools.count(1)
+        self._pending = {}  # seq -> Future, of the current helper process
+        self._lock = threading.Lock()  # Serializes writes to the helper and (re)starts
+        self._ready = None
+
+        self.starts = 0
+        self.crashes = 0
+        self.acks = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, target):
+        """Start the helper for `target`, restarting it if it's dead or bound to another window"""
+        with self._lock:
+            if self.alive and target == self.target:
+                return
+            self._start(target)
+
+    def _start(self, target):
+        self._stop()
+
+        self.target = target
+        self.last_start_attempt = time.time()
+        self._ready = Future()
+        self._pending = {}
+
+        try:
+            process = subprocess.Popen(self.argv(target), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, bufsize=1, universal_newlines=True)
+        except OSError as e:
+            raise DaemonError(f"{self.name} couldn't be started: {e}")
+        self.process = process
+        threading.Thread(target=self._reader, args=(process, self._ready, self._pending), daemon=True).start()
+
+        try:
+            pid = self._ready.result(READY_TIMEOUT)
+        except FutureTimeoutError:
+            self._kill(process)
+            raise DaemonError(f"{self.name} didn't start listening within {READY_TIMEOUT}s")
+        except DaemonError:
+            self._kill(process)
+            raise
+
+        self.starts += 1
+        self.started_at = time.time()
+        logging.info(f"[{self.name}] Started (pid {pid}) for console {target}")
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+
+        try:
+            process.stdin.close()  # The helper exits at the end of its input
+            process.wait(1)
+        except Exception:
+            self._kill(process)
+
+    def _kill(self, process):
+        try:
+            process.kill()
+        except Exception:
+            pass
+
+    def _reader(self, process, ready, pending):
+        """Resolve the futures of the acknowledged commands until the helper's stdout closes"""
+        try:
+            for line in process.stdout:
+                parts = line.strip().split(' ', 2)
+                if not parts[0]:
+                    continue
+
+                if parts[0] == 'ready':
+                    if not ready.done():
+                        ready.set_result(parts[1] if len(parts) > 1 else None)
+                    continue
+
+                if len(parts) < 2 or parts[0] not in ('ack', 'err'):
+                    logging.debug(f"[{self.name}] Ignored line: {line.strip()}")
+                    continue
+
+                future = pending.pop(parts[1], None)
+                if future is None:
+                    continue
+
+                if parts[0] == 'ack':
+                    self.acks += 1
+                    future.set_result(True)
+                else:
+                    self.errors += 1
+                    reason = parts[2] if len(parts) > 2 else 'unknown'
+                    error = WindowLostError if reason == 'nowindow' else DaemonError
+                    future.set_exception(error(f"{self.name} failed: {reason}"))
+        except Exception as e:
+            logging.debug(f"[{self.name}] Reader stopped: {e}")
+
+        if process is self.process:
+            self.crashes += 1
+            logging.warning(f"[{self.name}] Helper exited (code {process.poll()})")
+            self._kill(process)
+
+        error = DaemonError(f"{self.name} exited")
+        if not ready.done():
+            ready.set_exception(error)
+        for seq in list(pending):
+            future = pending.pop(seq, None)
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+    def send(self, line, timeout=None):
+        """
+        Type `line` in the console through the helper and wait for it to be acknowledged. Restarts a dead helper
+        first. Raises WindowLostError if the console window is gone and DaemonError if the helper failed.
+        """
+        if '\n' in line or '\r' in line:
+            line = line.replace('\r', ' ').replace('\n', ' ')
+
+        with self._lock:
+            if not self.alive:
+                if self.target is None:
+                    raise DaemonError(f"{self.name} was never started")
+                if time.time() - self.last_start_attempt < RESTART_BACKOFF:
+                    raise DaemonError(f"{self.name} is down, restarting in a few seconds")
+                logging.info(f"[{self.name}] Restarting helper")
+                self._start(self.target)
+
+            process = self.process
+            seq = str(next(self._seq))
+            future = self._pending[seq] = Future()
+            try:
+                process.stdin.write(f"{seq} {line}\n")
+                process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self._pending.pop(seq, None)
+                self._kill(process)
+                raise DaemonError(f"{self.name} pipe broken: {e}")
+
+        try:
+            return future.result(timeout or self.ack_timeout)
+        except FutureTimeoutError:
+            # A helper stuck in ControlSend (e.g. on a hung game) is of no use anymore, the next command restarts it
+            self._pending.pop(seq, None)
+            self.timeouts += 1
+            self._kill(process)
+            raise DaemonError(f"{self.name} didn't acknowledge '{line}' within {timeout or self.ack_timeout}s")
+
+    def ping(self, timeout=None):
+        """Heartbeat: checks that the helper is responsive and the console window still exists"""
+        return self.send('', timeout)
+
+    def stats(self):
+        return {
+            'alive': self.alive,
+            'target': self.target,
+            'pid': self.process.pid if self.alive else None,
+            'uptime': time.time() - self.started_at if self.alive and self.started_at else None,
+            'starts': self.starts,
+            'crashes': self.crashes,
+            'acks': self.acks,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'pending': len(self._pending),
+        }
@@ -1,85 +1,320 @@
-import os
 import time
-from env import environ
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, Future
 import logging
 
-from ahk import AHK
-
 import config
+import cvars
+import metrics
+import scheduler
+import transport
+
 
+TRANSPORT = transport.create()  # How commands reach the engine, see transport.py
+WindowNotFoundError = transport.WindowNotFoundError
 
-# AHK = AHK()
-AHK = AHK(executable_path='C:\\Program Files\\AutoHotkey\\AutoHotkey.exe')
-CONSOLEWINDOW = "TwitchBot Console"
-ENGINEWINDOW = "TwitchBot Engine"
+# Commands issued within COMMAND_WINDOW seconds of each other are sent as one ';'-joined console line, so a burst
+# (display message, hud cvar, follow, say...) costs one transport round trip instead of one per command
+COMMAND_WINDOW = 0.03
+MAX_LINE_LENGTH = 250  # The console input line holds 256 characters
+# Commands that reload/leave the map or touch files, anything after them in the same line would run in the wrong context
+BARRIER_COMMANDS = {'connect', 'reconnect', 'disconnect', 'map', 'devmap', 'vid_restart', 'snd_restart', 'quit',
+                    'writeconfig', 'exec'}
+LEAVE_COMMANDS = {'connect', 'reconnect', 'disconnect', 'map', 'devmap'}
+COMMAND_HISTORY = 200  # Latency samples kept for the stats
 
-# delay between sounds, used to prevent overlapping sounds
-# could be set to zero if u don't care about sound overlapping
-# (maybe viewer should be able to spam holy or 4ity or whatever)
-SOUND_DELAY = 1
-SOUND_TIMER = 0.0
+# Priority classes, highest first. Control commands go out as soon as possible, HUD and chat traffic are paced by
+# token buckets and dropped once they're too old to matter
+CONTROL = 'control'
+HUD = 'hud'
+CHAT = 'chat'
+PRIORITIES = (CONTROL, HUD, CHAT)
+CHAT_COMMANDS = {'say', 'say_team', 'tell', 'vote', 'callvote'}  # Client commands counted by the server's flood protection
+HUD_COMMANDS = {'displaymessage', 'cg_centertime'}
+HUD_CVAR_PREFIXES = ('df_hud', 'df_chs', 'cg_draw', 'mdd_')
+# (commands per second, burst). Servers with sv_floodProtect ignore client commands sent within a second of the
+# previous one, chat is kept well under that
+CLASS_LIMITS = {HUD: (5, 10), CHAT: (0.5, 1)}
+CLASS_EXPIRY = {HUD: 5, CHAT: 30}  # Seconds a queued command stays relevant
 
+COMMAND_QUEUES = {priority: deque() for priority in PRIORITIES}  # PendingCommand, oldest first
+BUCKETS = {priority: scheduler.TokenBucket(*limits) for priority, limits in CLASS_LIMITS.items()}
+COMMAND_COND = threading.Condition()
+COMMAND_STATS = {'commands': 0, 'lines': 0, 'barriers': 0, 'failures': 0, 'deduplicated': 0}
+CLASS_STATS = {priority: {'sent': 0, 'expired': 0} for priority in PRIORITIES}
+QUEUE_LATENCY = deque(maxlen=COMMAND_HISTORY)  # Seconds from exec_command to the line being sent
+SEND_DURATION = deque(maxlen=COMMAND_HISTORY)  # Seconds typing one line took
+FLUSHER_THREAD = None
 
-class WindowNotFoundError(Exception):
-    pass
+class CommandDroppedError(Exception):
+    """A command waited on with exec_command(wait=True) expired or was dropped before it could be sent"""
 
 
 def api_init():
-    """Grab both engine and console windows with better error handling"""
-    global CONSOLE
-    global WINDOW
-
-    try:
-        # Existing console setup code...
-        if environ["DEVELOPMENT"]:
-            CONSOLE = AHK.run_script("WinShow," + CONSOLEWINDOW +
-                       "\nControlGet, console, Hwnd ,, Edit1, " + CONSOLEWINDOW +
-                       "\nFileAppend, %console%, * ;", blocking=True)
+    """Find the engine and make sure commands can be sent to it. Raises WindowNotFoundError"""
+    TRANSPORT.init()
+
+
+class PendingCommand:
+    __slots__ = ('cmd', 'future', 'queued_at', 'alone', 'priority', 'cost', 'expires_at')
+
+    def __init__(self, cmd, priority=None, expires=None):
+        self.cmd = cmd.strip().rstrip(';').strip()
+        self.future = Future()
+        self.queued_at = time.time()
+        self.alone = is_barrier(self.cmd) or len(self.cmd) > MAX_LINE_LENGTH
+        self.priority = priority or classify(self.cmd)
+        self.cost = max(1, count_chat_commands(self.cmd))
+        expires = expires if expires is not None else CLASS_EXPIRY.get(self.priority)
+        self.expires_at = self.queued_at + expires if expires else None
+
+
+def command_words(cmd):
+    """First word of every ';'-separated command, lower cased ('varcommand say' counts as 'say')"""
+    for part in cmd.split(';'):
+        words = part.split()
+        if words and words[0].lower() == 'varcommand':
+            words = words[1:]
+        if words:
+            yield [word.lower() for word in words[:2]]
+
+
+def leaves_server(cmd):
+    return any(words[0] in LEAVE_COMMANDS for words in command_words(cmd))
+
+
+def count_chat_commands(cmd):
+    """Client commands counted by the server's flood protection: chat and the mod's '!' commands (!top, !rank...)"""
+    return sum(1 for words in command_words(cmd) if words[0] in CHAT_COMMANDS or words[0].startswith('!'))
+
+
+def classify(cmd):
+    """Priority class of a command: chat if it sends anything to the server's chat, HUD if it only draws"""
+    if count_chat_commands(cmd):
+        return CHAT
+
+    for words in command_words(cmd):
+        name = words[1] if words[0] in ('set', 'seta') and len(words) > 1 else words[0]
+        if name not in HUD_COMMANDS and not name.startswith(HUD_CVAR_PREFIXES):
+            return CONTROL
+    return HUD
+
+
+def is_barrier(cmd):
+    """Commands that must not share a console line with other commands"""
+    if cmd.count('"') % 2:  # An unbalanced quote would swallow the ';' of the commands after it
+        return True
+    for part in cmd.split(';'):
+        words = part.split()
+        if words and words[0].lower() in BARRIER_COMMANDS:
+            return True
+    return False
+
+
+def send_line(line):
+    """Run one console line. Blocks until the transport is done"""
+    TRANSPORT.send_line(line)
+
+
+def flush_commands(batch):
+    """Send the batch as few console lines as possible, in order, and resolve the commands' futures"""
+    lines = []
+    for pending in batch:
+        if pending.alone or not lines or lines[-1][0].alone \
+                or sum(len(p.cmd) + 1 for p in lines[-1]) + len(pending.cmd) > MAX_LINE_LENGTH:
+            lines.append([pending])
         else:
-            CONSOLE = AHK.run_script("WinShow," + CONSOLEWINDOW + \
-                        "\nControlGet, console, Hwnd ,, Edit1, " + CONSOLEWINDOW +
-                        "\nWinHide," + CONSOLEWINDOW +
-                        "\nFileAppend, %console%, * ;", blocking=True)
-        
-        WINDOW = AHK.find_window(title="TwitchBot Engine")
-        
-        # Better validation
-        if CONSOLE is None:
-            raise WindowNotFoundError("Console window not found")
-        if WINDOW is None:
-            raise WindowNotFoundError("Engine window not found") 
-        if not WINDOW.exists:
-            raise WindowNotFoundError("Engine window exists but is not accessible")
-            
-    except Exception as e:
-        logging.error(f"Window initialization failed: {e}")
-        raise WindowNotFoundError(f"Could not initialize windows: {e}")
-
-
-def exec_command(cmd, verbose=True):
-    if verbose:
-        logging.info(f"Execing command {cmd}")
-    # send the text to the console window, escape commas (must be `, to show up in chat)
-    AHK.run_script("ControlSetText, , " + cmd.replace(',', '`,') + ", ahk_id " + CONSOLE +
-                "\nControlSend, , {Enter}, ahk_id " + CONSOLE, blocking=True)
-
-
-def play_sound(sound):
-    if not os.path.exists(environ['DF_DIR'] + f"music\\common\\{sound}"):
-        logging.info(f"Sound file {environ['DF_DIR']}music/common/{sound} not found.")
-        return
-
-    global SOUND_DELAY
-    global SOUND_TIMER
-
-    # If the sound is already playing, wait for SOUND_DELAY seconds
-    # unless it's a worldrecord sound, then play it immediatly
-    if time.time() >= SOUND_TIMER + SOUND_DELAY or sound == 'worldrecord.wav':
-        exec_command(f"play music/common/{sound}")
-        SOUND_TIMER = time.time()
-        return
-
-    logging.info(f"Sound is already playing, cancelling current request !")
+            lines[-1].append(pending)
+
+    for group in lines:
+        line = ";".join(pending.cmd for pending in group)
+        start = time.time()
+        try:
+            send_line(line)
+        except Exception as e:
+            COMMAND_STATS['failures'] += 1
+            logging.error(f"Failed to send console line '{line}': {e}")
+            for pending in group:
+                pending.future.set_exception(e)
+            continue
+        finally:
+            COMMAND_STATS['lines'] += 1
+            SEND_DURATION.append(time.time() - start)
+
+        if group[0].alone:
+            COMMAND_STATS['barriers'] += 1
+        for pending in group:
+            QUEUE_LATENCY.append(start - pending.queued_at)
+            pending.future.set_result(True)
+
+
+def _drop(pending, priority):
+    CLASS_STATS[priority]['expired'] += 1
+    logging.info(f"Dropped command '{pending.cmd}', it waited {time.time() - pending.queued_at:.1f}s")
+    pending.future.cancel()
+
+
+def next_batch(now, take=True):
+    """
+    The queued commands that can be sent now, in the order they were queued, and the seconds until the next rate
+    limited one can go (None if none is waiting). Higher classes get their turn first when tokens are short.
+    Expired commands are dropped, and so are the chat/HUD commands still waiting behind a command leaving the
+    server, they would go to the wrong server. Call with COMMAND_COND held.
+    """
+    batch = []
+    wait = None
+
+    for priority in PRIORITIES:
+        queue = COMMAND_QUEUES[priority]
+        bucket = BUCKETS.get(priority)
+        if bucket is not None:
+            bucket.refill(now)
+            tokens = bucket.tokens
+
+        for pending in list(queue):
+            if pending.expires_at is not None and now > pending.expires_at:
+                queue.remove(pending)
+                _drop(pending, priority)
+                continue
+
+            if bucket is not None:
+                cost = min(pending.cost, bucket.burst)
+                if tokens < cost:
+                    delay = (cost - tokens) / bucket.rate
+                    wait = delay if wait is None else min(wait, delay)
+                    break
+                tokens -= cost
+
+            batch.append(pending)
+            if take:
+                queue.remove(pending)
+                CLASS_STATS[priority]['sent'] += 1
+
+        if take and bucket is not None:
+            bucket.tokens = tokens
+
+    batch.sort(key=lambda pending: pending.queued_at)
+
+    if take:
+        leaving = [pending.queued_at for pending in batch if pending.alone and leaves_server(pending.cmd)]
+        if leaving:
+            for priority in (HUD, CHAT):
+                queue = COMMAND_QUEUES[priority]
+                for pending in [pending for pending in queue if pending.queued_at < leaving[-1]]:
+                    queue.remove(pending)
+                    _drop(pending, priority)
+
+    return batch, wait
+
+
+def command_flusher(window=COMMAND_WINDOW):
+    """Send the queued commands, gathering the ones issued within `window` seconds of the first sendable one"""
+    while True:
+        with COMMAND_COND:
+            COMMAND_COND.wait_for(lambda: any(COMMAND_QUEUES.values()))
+            sendable, wait = next_batch(time.time(), take=False)
+            if not sendable:
+                COMMAND_COND.wait(wait)  # Woken up early by new commands
+                continue
+            first = min(pending.queued_at for pending in sendable)
+
+        time.sleep(max(0, first + window - time.time()))
+
+        with COMMAND_COND:
+            batch, _ = next_batch(time.time())
+
+        try:
+            flush_commands(batch)
+        except Exception as e:
+            logging.error(f"Command flusher failed: {e}")
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+
+
+def start_command_flusher():
+    global FLUSHER_THREAD
+
+    with COMMAND_COND:
+        if FLUSHER_THREAD is None:
+            FLUSHER_THREAD = threading.Thread(target=command_flusher, daemon=True)
+            FLUSHER_THREAD.start()
+
+
+def _forget_unsent(future, cvar_names):
+    if future.cancelled() or future.exception() is not None:
+        cvars.forget(cvar_names)
+
+
+def exec_command(cmd, verbose=True, wait=False, priority=None, expires=None):
+    """
+    Queue a console command and return right away. Returns a Future resolved once the command was sent (set with
+    the exception if sending failed, cancelled if it expired before it could go out), or waits for it when `wait`
+    is true.
+
+    `priority` is CONTROL, HUD or CHAT, guessed from the command when not given. Commands of the same class are
+    sent in the order they were queued, chat and HUD commands are rate limited (CLASS_LIMITS) and dropped after
+    `expires` seconds (CLASS_EXPIRY by default). Queuing a command identical to the last one still waiting in the
+    same class returns the waiting command's future. An identical command further back isn't merged, that would
+    reorder it with the commands queued in between ('follow 3;follow 5;follow 3'). A command waited on that can't
+    be sent raises CommandDroppedError if it was dropped, the sending error if it failed.
+
+    Cvar sets the engine already has are removed from the command (see cvars.py), a command left empty resolves
+    right away.
+    """
+    if FLUSHER_THREAD is None:
+        start_command_flusher()
+
+    cmd, cvar_names = cvars.filter_command(cmd)
+    if not cmd:
+        future = Future()
+        future.set_result(True)
+        return future
+
+    pending = PendingCommand(cmd, priority, expires)
+
+    with COMMAND_COND:
+        COMMAND_STATS['commands'] += 1
+        queue = COMMAND_QUEUES[pending.priority]
+        if queue and queue[-1].cmd == pending.cmd:
+            COMMAND_STATS['deduplicated'] += 1
+            pending = queue[-1]
+        else:
+            if verbose:
+                logging.info(f"Execing command {cmd}")
+            queue.append(pending)
+            COMMAND_COND.notify()
+
+    if cvar_names:
+        pending.future.add_done_callback(lambda future: _forget_unsent(future, cvar_names))
+
+    if wait:
+        try:
+            pending.future.result()
+        except CancelledError:
+            # CancelledError is a BaseException the callers' `except Exception` wouldn't catch
+            raise CommandDroppedError(f"Command '{pending.cmd}' was dropped before it could be sent")
+    return pending.future
+
+
+def command_stats():
+    latency = sorted(QUEUE_LATENCY)
+    durations = sorted(SEND_DURATION)
+    commands = COMMAND_STATS['commands']
+
+    return {
+        **COMMAND_STATS,
+        'queued': {priority: len(queue) for priority, queue in COMMAND_QUEUES.items()},
+        'classes': {priority: dict(stats) for priority, stats in CLASS_STATS.items()},
+        'commands_per_line': round(commands / COMMAND_STATS['lines'], 2) if COMMAND_STATS['lines'] else None,
+        'window': COMMAND_WINDOW,
+        'queue_latency': {'p50': metrics.percentile(latency, 0.5), 'p95': metrics.percentile(latency, 0.95),
+                          'max': latency[-1] if latency else None},
+        'transport': TRANSPORT.stats(),
+        'send_duration': {'p50': metrics.percentile(durations, 0.5), 'p95': metrics.percentile(durations, 0.95),
+                          'max': durations[-1] if durations else None},
+    }
 
 
 #def press_key(key, verbose=True):
@@ -3,11 +3,18 @@ import os  # for importing env vars for the bot to use
 from twitchio.ext import commands
 import config
 import api
-import subprocess
 import servers
+import prober
+import mapindex
+import inputs
+import probe
+import metrics
+import sounds
 import time
 import console
 import serverstate
+import connection
+from connection import CONNECTION
 import websocket_console
 from env import environ
 import threading
@@ -19,14 +26,11 @@ import sys
 import twitch_commands
 import filters
 import psutil
-import ctypes
 
 def is_game_hung():
-    """Check if the game window is hung (Not Responding) via Windows API"""
+    """Check if the game is running but Not Responding (see transport.EngineTransport.is_hung)"""
     try:
-        user32 = ctypes.windll.user32
-        hwnd = user32.FindWindowW(None, "TwitchBot Engine")
-        return bool(hwnd and user32.IsHungAppWindow(hwnd))
+        return api.TRANSPORT.is_hung()
     except Exception:
         return False
 
@@ -172,7 +176,6 @@ async def event_message(ctx):
 
         api.exec_command(f"say ^{author_color_char}{author} ^2{message}")
         logging.info("Chat message sent")
-        time.sleep(debounce)
 
     elif message.startswith("**"):  # team chat bridge
         message = message.lstrip('**')
@@ -192,19 +195,16 @@ async def event_message(ctx):
 
         api.exec_command(f"say_team ^{author_color_char}{author} ^5{message}")
         logging.info("Chat message sent")
-        time.sleep(debounce)
 
     elif message.startswith("!"):  # proxy mod commands (!top, !rank, etc.)
         logging.info("proxy command received")
         api.exec_command(message)
-        time.sleep(debounce)
 
     elif message.startswith("$"):  # viewer sound commands
         for sound_cmd in SOUND_CMDS:
             if message.startswith(sound_cmd):
                 logging.info(f"Sound command received ({sound_cmd})")
-                api.play_sound(sound_cmd.replace('$', '') + '.wav') # .wav format only
-                time.sleep(debounce)
+                sounds.play_sound(sound_cmd.replace('$', '') + '.wav') # .wav format only
     return
 
 
@@ -214,13 +214,28 @@ def launch():
     else:
         launch_ip = servers.get_most_popular_server()
 
-    if not os.path.isfile(config.DF_EXE_PATH):
+    if api.TRANSPORT.needs_executable and not os.path.isfile(config.DF_EXE_PATH):
         logging.info("Could not find engine or it was not provided. You will have to start the engine and the bot manually. ")
         return None
 
     # Make sure to set proper CWD when using subprocess.Popen from another directory
     # iDFe will automatically take focus when launching
-    subprocess.Popen(args=[config.DF_EXE_PATH, "+cl_title", "TwitchBot Engine", "+con_title", "TwitchBot Console", "+connect", launch_ip], cwd=os.path.dirname(config.DF_EXE_PATH))
+    api.TRANSPORT.launch([config.DF_EXE_PATH, "+cl_title", "TwitchBot Engine", "+con_title", "TwitchBot Console", "+connect", launch_ip],
+                         cwd=os.path.dirname(config.DF_EXE_PATH))
+
+
+def start_engine():
+    """
+    Launch the engine. Transports that talk to the engine through its stdin must launch it from this process,
+    the others launch it from a separate one. Returns something with is_alive()
+    """
+    if api.TRANSPORT.launches_engine:
+        launch()
+        return api.TRANSPORT
+
+    df_process = Process(target=launch)
+    df_process.start()
+    return df_process
 
 
 if __name__ == "__main__":
@@ -247,13 +262,12 @@ if __name__ == "__main__":
         logging.info("Found defrag window.")
     except Exception as e:
         logging.info(f"Defrag not running, starting... Error: {e}")
-        df_process = Process(target=launch)
-        df_process.start()
+        df_process = start_engine()
         time.sleep(15)
 
-    from multiprocessing import Process
+    sounds.refresh_index()  # Before the chat bridge takes sound commands
 
-    logfile_path = config.DF_DIR + '\\qconsole.log'
+    logfile_path = os.path.join(config.DF_DIR, 'qconsole.log')
     con_thread = threading.Thread(target=console.read, args=(logfile_path,), daemon=True)
     con_thread.start()
 
@@ -286,6 +300,32 @@ if __name__ == "__main__":
     bot_thread = threading.Thread(target=bot.run, daemon=True)
     bot_thread.start()
 
+    twitch_status_thread = threading.Thread(target=serverstate.twitch_status_refresher, daemon=True)
+    twitch_status_thread.start()
+
+    prober_thread = threading.Thread(target=prober.run, args=(servers.get_probe_targets, servers.update_probe_results), daemon=True)
+    prober_thread.start()
+
+    mapindex_thread = threading.Thread(target=mapindex.run, args=(servers.get_wanted_maps,), daemon=True)
+    mapindex_thread.start()
+
+    inputs_thread = threading.Thread(target=inputs.sampler, args=(console.WS_Q, serverstate.get_sampled_player), daemon=True)
+    inputs_thread.start()
+
+    metrics_thread = threading.Thread(target=metrics.reporter, daemon=True)
+    metrics_thread.start()
+
+    probe_recovery = lambda: threading.Thread(target=serverstate.smart_connection_recovery,
+                                              args=("Engine not responding",), daemon=True).start()
+    probe_thread = threading.Thread(target=probe.run, args=(probe_recovery, kill_game_processes), daemon=True)
+    probe_thread.start()
+
+    state_writer_thread = threading.Thread(target=serverstate.state_writer, daemon=True)
+    state_writer_thread.start()
+
+    sounds_thread = threading.Thread(target=sounds.run, daemon=True)
+    sounds_thread.start()
+
     def add_periodic_health_check():
         last_api_success = time.time()
         pause_watchdog_start = None  # Independent pause tracking
@@ -355,40 +395,37 @@ if __name__ == "__main__":
                         logging.critical(f"HEALTH CHECK: Recovery deadlock detected ({recovery_stuck_time:.0f}s)")
                         try:
                             serverstate.reset_recovery_state()
-                            serverstate.PAUSE_STATE = False
-                            api.exec_command("map st1")
+                            CONNECTION.transition(connection.STANDBY, "watchdog recovery deadlock")
+                            api.exec_command("map st1", wait=True)
                             logging.critical("HEALTH CHECK: Forced emergency reset")
                         except Exception as e:
                             logging.critical(f"HEALTH CHECK: Emergency reset failed: {e}")
 
                 # Check for general pause deadlock (independent watchdog)
-                if hasattr(serverstate, 'PAUSE_STATE') and serverstate.PAUSE_STATE:
-                    if pause_watchdog_start is None:
-                        pause_watchdog_start = current_time
-                        logging.info(f"WATCHDOG: Pause detected, starting timer")
-                    else:
-                        pause_duration = current_time - pause_watchdog_start
-                        if pause_duration > 120:  # 2 minutes
-                            logging.critical(f"WATCHDOG: Pause timeout ({pause_duration:.0f}s) - forcing recovery")
-                            try:
-                                serverstate.PAUSE_STATE = False
-                                serverstate.CONNECTING = False
-                                serverstate.CONNECTION_START_TIME = None
-                                if hasattr(serverstate, 'RECOVERY_IN_PROGRESS') and serverstate.RECOVERY_IN_PROGRESS:
-                                    serverstate.reset_recovery_state()
-                                api.exec_command("map st1")
-                                logging.critical("WATCHDOG: Forced pause reset via map st1")
-                                pause_watchdog_start = None
-                                # Start standby mode to search for new servers
-                                standby_thread = threading.Thread(target=serverstate.standby_mode_started, daemon=True)
-                                standby_thread.start()
-                                logging.critical("WATCHDOG: Started standby mode to find new server")
-                            except Exception as e:
-                                logging.critical(f"WATCHDOG: Pause reset failed: {e}")
-                else:
-                    if pause_watchdog_start is not None:
-                        logging.info(f"WATCHDOG: Pause ended, timer reset")
-                        pause_watchdog_start = None
+                paused_since = CONNECTION.paused_since
+                if CONNECTION.paused and paused_since is not None:
+                    if pause_watchdog_start != paused_since:
+                        pause_watchdog_start = paused_since
+                        logging.info(f"WATCHDOG: Pause detected ({CONNECTION.phase})")
+                    pause_duration = current_time - paused_since
+                    if pause_duration > 120:  # 2 minutes
+                        logging.critical(f"WATCHDOG: Pause timeout ({pause_duration:.0f}s) - forcing recovery")
+                        try:
+                            if serverstate.RECOVERY_IN_PROGRESS:
+                                serverstate.reset_recovery_state()
+                            CONNECTION.transition(connection.STANDBY, "watchdog pause timeout")
+                            api.exec_command("map st1", wait=True)
+                            logging.critical("WATCHDOG: Forced pause reset via map st1")
+                            pause_watchdog_start = None
+                            # Start standby mode to search for new servers
+                            standby_thread = threading.Thread(target=serverstate.standby_mode_started, daemon=True)
+                            standby_thread.start()
+                            logging.critical("WATCHDOG: Started standby mode to find new server")
+                        except Exception as e:
+                            logging.critical(f"WATCHDOG: Pause reset failed: {e}")
+                elif pause_watchdog_start is not None:
+                    logging.info(f"WATCHDOG: Pause ended, timer reset")
+                    pause_watchdog_start = None
 
         health_thread = threading.Thread(target=health_check_worker, daemon=True)
         health_thread.start()
@@ -412,7 +449,7 @@ if __name__ == "__main__":
             if not window_flag:
                 logging.info("Found defrag window.")
                 window_flag = True
-                serverstate.PAUSE_STATE = False
+                CONNECTION.resume("game window found")
                 
                 # NEW: Handle settings sync after unexpected crash recovery
                 def handle_crash_recovery():
@@ -443,8 +480,7 @@ if __name__ == "__main__":
                 window_flag = False
                 if not df_process or not df_process.is_alive():
                     logging.info("Defrag not running, starting...")
-                    df_process = Process(target=launch)
-                    df_process.start()
+                    df_process = start_engine()
                     console.STOP_CONSOLE = True
                     time.sleep(20)
                 else:
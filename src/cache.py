@@ -0,0 +1,148 @@
+"""
+Thread-safe TTL/LRU cache shared by the bot's lookups (Twitch status, failed follows, spectate cooldowns, servers feed).
+
+Expired entries are not dropped right away: they can still be read with `get(key, stale=True)` (stale-while-
+revalidate) until they are evicted. The cache never holds more than `maxsize` entries, the least recently used ones
+are evicted first.
+
+Negative caching: `set_negative` records a failed lookup. The entry stays cached for `negative_ttl`, doubling with
+every consecutive failure up to `max_negative_ttl`, so a key that keeps failing is retried less and less often.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHES = []  # Every cache created, for stats reporting
+
+
+class CacheEntry:
+    __slots__ = ('value', 'stored_at', 'expires_at', 'failures')
+
+    def __init__(self, value, stored_at, expires_at, failures=0):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.failures = failures
+
+
+class TTLCache:
+    def __init__(self, name, ttl, maxsize=1024, negative_ttl=None, max_negative_ttl=300, jitter=0.0):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.max_negative_ttl = max_negative_ttl
+        self.jitter = jitter  # Spread expiries by +-jitter (fraction) so entries stored together don't expire together
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        CACHES.append(self)
+
+    def _expiry(self, now, ttl):
+        if self.jitter:
+            ttl *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return now + ttl
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value, ttl=None):
+        """Store a value, resetting the failure count of the key"""
+        now = time.time()
+        with self._lock:
+            self._store(key, CacheEntry(value, now, self._expiry(now, self.ttl if ttl is None else ttl)))
+
+    def set_negative(self, key, default=None):
+        """
+        Record a failed lookup for `key`. The last known value is kept (`default` is stored if there is none) and the
+        key stays fresh for an exponentially growing backoff. Returns the number of consecutive failures.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            value = entry.value if entry is not None else default
+            failures = (entry.failures if entry is not None else 0) + 1
+            ttl = min(self.max_negative_ttl, self.negative_ttl * (2 ** (failures - 1)))
+            self._store(key, CacheEntry(value, now, self._expiry(now, ttl), failures))
+            return failures
+
+    def get(self, key, default=None, stale=False):
+        """Returns the cached value if it is fresh (or any cached value when `stale` is set), `default` otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (not stale and entry.expires_at <= time.time()):
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def __contains__(self, key):
+        """True if the key has a fresh entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires_at > time.time()
+
+    def failures(self, key):
+        """Number of consecutive failures recorded for the key, 0 if it has none or isn't cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.failures if entry is not None else 0
+
+    def remaining(self, key):
+        """Seconds until the key's entry expires, 0 if it is expired or not cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return max(0, entry.expires_at - time.time()) if entry is not None else 0
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry.value if entry is not None else default
+
+    def purge(self):
+        """Drop all expired entries (including stale values and failure counts)"""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+                del self._entries[key]
+
+    def keys(self, stale=False):
+        now = time.time()
+        with self._lock:
+            return [key for key, entry in self._entries.items() if stale or entry.expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def cache_stats():
+    return [c.stats() for c in CACHES]
@@ -0,0 +1,213 @@
+"""
+Connection lifecycle state machine.
+
+The bot is always in exactly one phase:
+
+    idle          nothing happened yet (startup)
+    connecting    a connect was sent, waiting for the game to load the server's map
+    loading       the game is loading a map or restarting on the current server (map change, vote, crash restart)
+    restarting    a vid_restart is in progress
+    initializing  the game is loaded, the state loop still has to identify the bot
+    spectating    the state is initialized and the bot is spectating/looking for players
+    standby       no server to go to, the bot waits on a local map
+    recovering    the recovery system is deciding what to do after a failure
+
+Transitions are checked against TRANSITIONS and timestamped. Threads waiting on a phase change (the state loop,
+the connection monitor, the recovery timeout...) are woken through a condition variable as soon as a transition
+happens instead of polling the old global flags. The flags in serverstate (PAUSE_STATE, CONNECTING, ...) are kept
+as read-only mirrors of this machine for the code that only reads them.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+
+IDLE = 'idle'
+CONNECTING = 'connecting'
+LOADING = 'loading'
+RESTARTING = 'restarting'
+INITIALIZING = 'initializing'
+SPECTATING = 'spectating'
+STANDBY = 'standby'
+RECOVERING = 'recovering'
+
+PAUSED_PHASES = {CONNECTING, LOADING, RESTARTING}  # The state loop doesn't poll the game in these
+ACTIVE_PHASES = {IDLE, INITIALIZING, SPECTATING, STANDBY, RECOVERING}  # The state loop keeps running while recovering
+
+TRANSITIONS = {
+    IDLE: {CONNECTING, LOADING, RESTARTING, INITIALIZING, SPECTATING, STANDBY, RECOVERING},
+    CONNECTING: {CONNECTING, RESTARTING, INITIALIZING, SPECTATING, STANDBY, RECOVERING},
+    LOADING: {CONNECTING, RESTARTING, INITIALIZING, SPECTATING, STANDBY, RECOVERING},
+    RESTARTING: {CONNECTING, INITIALIZING, SPECTATING, STANDBY, RECOVERING},
+    INITIALIZING: {CONNECTING, LOADING, RESTARTING, SPECTATING, STANDBY, RECOVERING},
+    SPECTATING: {CONNECTING, LOADING, RESTARTING, INITIALIZING, STANDBY, RECOVERING},
+    STANDBY: {CONNECTING, LOADING, RESTARTING, INITIALIZING, RECOVERING},
+    RECOVERING: {CONNECTING, INITIALIZING, SPECTATING, STANDBY, RECOVERING},
+}
+
+HISTORY_SIZE = 50
+
+
+class ConnectionState:
+    def __init__(self):
+        self.phase = IDLE
+        self.reason = None
+        self.since = time.time()  # When the current phase was entered
+        self.target = None  # Server ip of the current/last connect
+        self.paused_since = None  # When the machine last entered a paused phase from an active one
+        self.resume_phase = IDLE  # Active phase to go back to once a load/vid_restart completes
+
+        self.initialized = False  # The bot was identified on the current server
+        self.recovering = False  # A recovery is in progress (spans the connects it makes)
+        self.recovery_since = None
+
+        self.history = deque(maxlen=HISTORY_SIZE)  # (time, from phase, to phase, reason)
+        self.counts = {}  # phase -> times entered
+
+        self._cond = threading.Condition(threading.RLock())
+        self._listeners = []
+
+    @property
+    def paused(self):
+        return self.phase in PAUSED_PHASES
+
+    @property
+    def connecting(self):
+        return self.phase == CONNECTING
+
+    @property
+    def restarting(self):
+        return self.phase == RESTARTING
+
+    def time_in_phase(self):
+        return time.time() - self.since
+
+    def subscribe(self, callback):
+        """
+        Call callback(connection, old_phase, new_phase, reason) after every change. Callbacks run in the thread that
+        made the change with the machine locked, so they must be quick and must not wait on the machine.
+        """
+        with self._cond:
+            self._listeners.append(callback)
+            callback(self, self.phase, self.phase, None)
+
+    def _changed(self, old_phase, reason):
+        for callback in self._listeners:
+            try:
+                callback(self, old_phase, self.phase, reason)
+            except Exception as e:
+                logging.error(f"Connection listener failed: {e}")
+        self._cond.notify_all()
+
+    def transition(self, phase, reason=None, expect=None, target=None):
+        """
+        Move to `phase`. Does nothing and returns False if the current phase isn't in `expect` (when given) or if
+        the transition isn't allowed. Connecting again to the same target keeps the original timestamp, so
+        retries can't extend the connection timeout.
+        """
+        with self._cond:
+            old_phase = self.phase
+
+            if expect is not None and old_phase not in expect:
+                return False
+
+            if phase == old_phase and (phase != CONNECTING or target == self.target):
+                return True
+
+            if phase not in TRANSITIONS[old_phase]:
+                logging.warning(f"[CONNECTION] Rejected transition {old_phase} -> {phase} ({reason})")
+                return False
+
+            now = time.time()
+            if old_phase not in PAUSED_PHASES and phase in PAUSED_PHASES:
+                self.paused_since = now
+                self.resume_phase = old_phase
+            elif phase not in PAUSED_PHASES:
+                self.paused_since = None
+
+            if phase == CONNECTING:
+                self.target = target
+                self.initialized = False
+                self.resume_phase = INITIALIZING
+
+            self.phase = phase
+            self.reason = reason
+            self.since = now
+            self.history.append((now, old_phase, phase, reason))
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+            logging.info(f"[CONNECTION] {old_phase} -> {phase}" + (f" ({reason})" if reason else ""))
+            self._changed(old_phase, reason)
+            return True
+
+    def resume(self, reason=None):
+        """
+        The game finished loading (or a pause was cleared): go back to the phase the bot was in before it was
+        paused, or to initializing/spectating after a connect. Does nothing if the machine isn't paused.
+        """
+        with self._cond:
+            if not self.paused:
+                return False
+
+            if self.resume_phase in (STANDBY, IDLE):
+                phase = self.resume_phase
+            else:
+                phase = SPECTATING if self.initialized else INITIALIZING
+
+            if phase == IDLE:
+                phase = INITIALIZING
+            return self.transition(phase, reason)
+
+    def set_initialized(self, reason=None):
+        """The state loop identified the bot on the current server"""
+        with self._cond:
+            self.initialized = True
+            if not self.transition(SPECTATING, reason, expect=(IDLE, INITIALIZING)):
+                self._changed(self.phase, reason)
+
+    def begin_recovery(self, reason=None):
+        with self._cond:
+            if not self.recovering:
+                self.recovering = True
+                self.recovery_since = time.time()
+            if not self.transition(RECOVERING, reason):
+                self._changed(self.phase, reason)
+
+    def end_recovery(self, reason=None):
+        with self._cond:
+            if self.recovering:
+                self.recovering = False
+                self.recovery_since = None
+                self._changed(self.phase, reason)
+
+    def wait_for(self, predicate, timeout=None):
+        """Block until predicate(connection) is true or the timeout expires. Returns the predicate's last value"""
+        with self._cond:
+            return self._cond.wait_for(lambda: predicate(self), timeout)
+
+    def wait_until_active(self, timeout=None):
+        return self.wait_for(lambda connection: not connection.paused, timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'phase': self.phase,
+                'reason': self.reason,
+                'since': self.since,
+                'time_in_phase': self.time_in_phase(),
+                'target': self.target,
+                'paused_since': self.paused_since,
+                'initialized': self.initialized,
+                'recovering': self.recovering,
+                'recovery_since': self.recovery_since,
+                'counts': dict(self.counts),
+                'history': [
+                    {'time': t, 'from': old, 'to': new, 'reason': reason}
+                    for t, old, new, reason in self.history
+                ],
+            }
+
+
+CONNECTION = ConnectionState()
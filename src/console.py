@@ -17,7 +17,14 @@ import threading
 import dfcommands as cmd
 import filters
 import serverstate
+import connection
+from connection import CONNECTION
 import servers
+import metrics
+import mapindex
+import cvars
+import inputs
+import probe
 import websocket_console
 
 LOG = []
@@ -36,6 +43,7 @@ WEBSOCKET_LAST_HEALTHY = time.time()  # Track websocket health
 UNKNOWN_CMD_COUNT = 0  # Track consecutive "Unknown command" lines (crashed cgame)
 UNKNOWN_CMD_RECOVERY_TRIGGERED = False  # Prevent multiple recovery triggers
 CONNECTION_HANDLED_TIME = 0  # Timestamp of last connection completion handling (prevent duplicates)
+ABSOLUTE_TIMEOUT_CONNECTION = None  # Start time of the connection attempt the absolute timeout last fired for
 
 ERROR_FILTERS = {
     "ERROR: CL_ParseServerMessage:": "RECONNECT",
@@ -47,6 +55,8 @@ ERROR_FILTERS = {
     "ERROR: CM_LoadMap: couldn't load maps/": "MAP_ERROR",
     "Server connection timed out": "RECONNECT"
 }
+# Errors that are the server's fault, the others are client side crashes that say nothing about the server
+SERVER_FAILURES = ("ERROR: CM_LoadMap: couldn't load maps/", "was kicked", "Server connection timed out")
 
 # System message patterns that should be filtered out completely
 SYSTEM_MESSAGE_PATTERNS = [
@@ -165,19 +175,13 @@ def handle_map_error_with_countdown(map_name=None):
                 logging.info("Map error countdown complete. Running vid_restart to refresh map list...")
                 MAP_ERROR_VID_RESTARTED_FOR = map_name
 
-                serverstate.VID_RESTARTING = True
-                serverstate.PAUSE_STATE = True
-                api.exec_command("vid_restart")
+                CONNECTION.transition(connection.RESTARTING, "vid_restart for missing map")
+                api.exec_command("vid_restart", wait=True)
 
-                # Wait for vid_restart to complete (console.py clears VID_RESTARTING flag)
-                vid_wait_start = time.time()
-                while serverstate.VID_RESTARTING and time.time() - vid_wait_start < 30:
-                    time.sleep(1)
-
-                if serverstate.VID_RESTARTING:
+                # Wait for vid_restart to complete (console.py resumes the connection state when it's done)
+                if not CONNECTION.wait_for(lambda c: not c.restarting, timeout=30):
                     logging.warning("vid_restart did not complete within 30s, forcing continuation")
-                    serverstate.VID_RESTARTING = False
-                    serverstate.PAUSE_STATE = False
+                    CONNECTION.resume("vid_restart timeout")
 
                 # Now reconnect - map list should be refreshed
                 time.sleep(2)
@@ -250,11 +254,17 @@ def handle_error_with_delay(error_line, error_action):
     Handle error detection with appropriate delays and actions
     """
     global LAST_ERROR_TIME
+
+    # Rank the server lower for a while so recovery doesn't pick it again straight away
+    if any(failure in error_line for failure in SERVER_FAILURES):
+        failed_ip = serverstate.CURRENT_IP or getattr(serverstate.STATE, 'ip', None)
+        servers.record_failure(failed_ip, reason=error_line.strip()[:60])
     
     if error_action == "MAP_ERROR":
         logging.info(f"Map loading error detected: {error_line}")
         map_name_match = re.search(r"couldn't load maps/(.+?)\.bsp", error_line)
         failed_map = map_name_match.group(1) if map_name_match else None
+        mapindex.record_failure(failed_map)
         handle_map_error_with_countdown(map_name=failed_map)
         return
         
@@ -398,6 +408,17 @@ def read(file_path: str):
                 if filter in line:
                     continue
 
+            # Input samples (and the echo of the command that requested them) never go to the chat log
+            if inputs.parse_sample_line(line.strip()) or inputs.is_sample_echo(line.strip()):
+                continue
+
+            # Probe answers and their echoes, a chat line merely containing the marker goes on
+            if probe.parse_line(line.strip()) or probe.is_probe_echo(line.strip()):
+                continue
+
+            if line.rstrip().endswith(cvars.REJECTIONS):
+                cvars.parse_line(line.strip())
+
             line_data = process_line(line)
 
             # ADD NULL CHECK HERE - CRITICAL FIX
@@ -509,11 +530,12 @@ def process_line(line):
         logging.info("Pause timer started")
     
     # Check for absolute timeout if connection tracking exists
-    if hasattr(serverstate, 'CONNECTION_START_TIME') and serverstate.CONNECTION_START_TIME:
-        total_stuck_time = time.time() - serverstate.CONNECTION_START_TIME
+    global ABSOLUTE_TIMEOUT_CONNECTION
+    if CONNECTION.connecting and ABSOLUTE_TIMEOUT_CONNECTION != CONNECTION.since:
+        total_stuck_time = CONNECTION.time_in_phase()
         if total_stuck_time > 120:  # 2 minutes absolute timeout
-            # Reset CONNECTION_START_TIME immediately to prevent firing on every console line
-            serverstate.CONNECTION_START_TIME = None
+            # Remember this connection attempt to prevent firing on every console line
+            ABSOLUTE_TIMEOUT_CONNECTION = CONNECTION.since
             logging.error(f"ABSOLUTE TIMEOUT: Bot stuck for {total_stuck_time:.0f}s - triggering recovery")
             try:
                 serverstate.force_connection_recovery("Absolute timeout exceeded")
@@ -543,7 +565,7 @@ def process_line(line):
                 logging.error(f"Smart recovery failed: {e}")
                 # Emergency fallback
                 logging.critical("EMERGENCY FALLBACK: Direct standby mode")
-                serverstate.PAUSE_STATE = False
+                CONNECTION.transition(connection.STANDBY, "pause timeout")
                 api.exec_command("map st1")
 
     line_data = {
@@ -601,25 +623,20 @@ def process_line(line):
             logging.warning(f"Follow command failed for player {player_id} - player not active yet")
             # Track this failed attempt to prevent retry loops
             if hasattr(serverstate, 'FAILED_FOLLOW_ATTEMPTS'):
-                if player_id not in serverstate.FAILED_FOLLOW_ATTEMPTS:
-                    serverstate.FAILED_FOLLOW_ATTEMPTS[player_id] = {'timestamp': time.time(), 'count': 1}
+                failure_count = serverstate.FAILED_FOLLOW_ATTEMPTS.set_negative(player_id)
+                if failure_count == 1:
                     logging.info(f"Added player {player_id} to failed follow cooldown list (attempt 1)")
                 else:
-                    # Increment failure count
-                    serverstate.FAILED_FOLLOW_ATTEMPTS[player_id]['count'] += 1
-                    serverstate.FAILED_FOLLOW_ATTEMPTS[player_id]['timestamp'] = time.time()
-                    failure_count = serverstate.FAILED_FOLLOW_ATTEMPTS[player_id]['count']
                     logging.warning(f"Player {player_id} follow failed again (attempt {failure_count})")
 
                     # After MAX_FOLLOW_FAILURES, permanently exclude this player
                     if failure_count >= serverstate.MAX_FOLLOW_FAILURES:
                         serverstate.PERMANENTLY_EXCLUDED.add(player_id)
                         logging.error(f"Player {player_id} failed {failure_count} times - permanently excluded from spectating")
-                        del serverstate.FAILED_FOLLOW_ATTEMPTS[player_id]
+                        serverstate.FAILED_FOLLOW_ATTEMPTS.pop(player_id)
 
         if line in {"VoteVote passed.", "RE_Shutdown( 0 )"}:
-            if not serverstate.PAUSE_STATE:
-                serverstate.PAUSE_STATE = True
+            if CONNECTION.transition(connection.LOADING, line, expect=connection.ACTIVE_PHASES):
                 logging.info("Game is loading. Pausing state.")
                 # Reset the timer when pause state is set
                 PAUSE_STATE_START_TIME = None
@@ -627,6 +644,7 @@ def process_line(line):
         # Check for specific error patterns first
         for error_pattern, error_action in ERROR_FILTERS.items():
             if error_pattern in line:
+                metrics.increment('error_filter', error_pattern, server=serverstate.CURRENT_IP or getattr(serverstate.STATE, 'ip', None))
                 if LAST_ERROR_TIME is None or time.time() - LAST_ERROR_TIME >= 10:
                     LAST_ERROR_TIME = time.time()
                     logging.info(f"Previous line: {PREVIOUS_LINE}")
@@ -670,8 +688,7 @@ def process_line(line):
                 
             except Exception as e:
                 logging.error(f"Error parsing server record message: {e}")
-                # Fallback - still play sound and trigger celebration without specific details
-                api.play_sound("worldrecord.wav")
+                # Fallback - still trigger celebration (and its sound) without specific details
                 serverstate.handle_world_record_event()
 
         if 'called a vote:' in line and is_server_msg(line, 'called a vote:'):
@@ -758,7 +775,7 @@ def process_line(line):
                 if serverstate.PAUSE_STATE and not serverstate.CONNECTING and not serverstate.VID_RESTARTING:
                     # This is likely a map change completion during a burst - just unpause
                     time.sleep(1)
-                    serverstate.PAUSE_STATE = False
+                    CONNECTION.resume("game loaded during burst")
                     PAUSE_STATE_START_TIME = None
                     logging.info("Game loaded (during burst). Continuing state.")
                 # Skip spawning any threads for duplicate detections
@@ -767,8 +784,7 @@ def process_line(line):
                 # VID_RESTART completion - HIGHEST PRIORITY
                 time.sleep(2)
                 logging.info("vid_restart done.")
-                serverstate.PAUSE_STATE = False
-                serverstate.VID_RESTARTING = False
+                CONNECTION.resume("vid_restart done")
                 PAUSE_STATE_START_TIME = None
                 
                 if hasattr(serverstate, 'RECOVERY_IN_PROGRESS') and serverstate.RECOVERY_IN_PROGRESS:
@@ -802,9 +818,7 @@ def process_line(line):
                 # Connection completion - SECOND PRIORITY
                 CONNECTION_HANDLED_TIME = time.time()  # Mark this connection as handled
                 time.sleep(2)
-                serverstate.CONNECTING = False
-                serverstate.PAUSE_STATE = False
-                serverstate.CONNECTION_START_TIME = None
+                CONNECTION.resume("connection complete")
                 MAP_ERROR_VID_RESTARTED_FOR = None  # Reset map error tracking on successful connection
                 logging.info("Connection complete. Continuing state.")
 
@@ -842,11 +856,8 @@ def process_line(line):
                 def delayed_state_init():
                     import time
                     time.sleep(5)  # Longer delay - wait for game to fully stabilize
-                    # Wait for map loading to finish (PAUSE_STATE clears when game loaded)
-                    wait_start = time.time()
-                    while (serverstate.PAUSE_STATE or serverstate.CONNECTING) and time.time() - wait_start < 30:
-                        time.sleep(1)
-                    if serverstate.PAUSE_STATE or serverstate.CONNECTING:
+                    # Wait for map loading to finish (the connection state resumes when game loaded)
+                    if not CONNECTION.wait_until_active(timeout=30):
                         logging.warning("Delayed state init: timed out waiting for game to load (30s)")
                         return
                     logging.info("Forcing state initialization after connection")
@@ -875,7 +886,7 @@ def process_line(line):
                     # Don't unpause, let the crash handler deal with it
                     return
 
-                serverstate.PAUSE_STATE = False
+                CONNECTION.resume("game loaded")
                 logging.info("Game loaded. Continuing state.")
                 serverstate.STATE.say_connect_msg()
                 PAUSE_STATE_START_TIME = None
@@ -924,7 +935,7 @@ def process_line(line):
                 time.sleep(2)  # Brief delay to let map fully load
                 api.exec_command("team s;svinfo_report serverstate.txt;svinfo_report initialstate.txt")
                 serverstate.initialize_state(True)
-                serverstate.PAUSE_STATE = False
+                CONNECTION.resume("map change detected via player entry")
                 # Reset timer when pause state is cleared
                 PAUSE_STATE_START_TIME = None
 
@@ -939,10 +950,9 @@ def process_line(line):
                 try:
                     if serverstate.VID_RESTARTING:
                         logging.info("Force clearing vid_restart state due to timeout")
-                        serverstate.VID_RESTARTING = False
-                    api.exec_command("team s;svinfo_report serverstate.txt;svinfo_report initialstate.txt")
+                    api.exec_command("team s;svinfo_report serverstate.txt;svinfo_report initialstate.txt", wait=True)
                     serverstate.initialize_state(True)
-                    serverstate.PAUSE_STATE = False
+                    CONNECTION.resume("pause timeout")
                     PAUSE_STATE_START_TIME = None
                 except Exception as e:
                     logging.error(f"Emergency unpause failed: {e}")
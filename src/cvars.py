@@ -0,0 +1,234 @@
+"""
+Shadow copy of the engine's cvars.
+
+Every cvar set going through api.exec_command ('set', 'seta', ... or a bare '<cvar> <value>') is recorded here, and
+sets that wouldn't change anything are removed from the command before it's queued. Reads are answered from memory.
+
+The shadow is only trusted while nothing but the bot changed the cvars. The engine resets the cheat protected cvars
+when it joins a server and a relaunched engine starts from its config, so every pause of the connection (connect,
+map load, vid_restart, recovery) marks the shadow stale: sets go out unconditionally, and once the connection is
+active again the shadow is reconciled with the engine through one 'writeconfig' (see reconcile).
+"""
+
+import logging
+import os
+import shlex
+import threading
+import time
+
+import config
+import connection
+
+
+SHADOW_CONFIG = 'cvars-shadow.cfg'  # Written by the engine in DF_DIR when reconciling
+SHADOW_CONFIG_P = os.path.join(config.DF_DIR, SHADOW_CONFIG)
+RECONCILE_TIMEOUT = 5  # Seconds the engine gets to write the config
+SET_COMMANDS = {'set', 'seta', 'sets', 'setu'}
+CVAR_PREFIXES = ('df_', 'cg_', 'r_', 'mdd_', 'com_')  # Bare '<name> <value>' with these prefixes are cvar sets
+REJECTIONS = (' is cheat protected.', ' is read only.', ' is write protected.')  # Sets the engine refused
+
+CVARS_LOCK = threading.Lock()
+SHADOW = {}  # lowercased name -> value
+SET_AT = {}  # lowercased name -> time of the last set through the bot
+STALE = True
+PAUSES = 0  # Connection pauses so far, a reconcile overlapping one is discarded
+RECONCILE_THREAD = None
+LAST_RECONCILE_TIME = None
+STATS = {'sets': 0, 'redundant': 0, 'reads': 0, 'misses': 0, 'reconciles': 0, 'reconcile_failures': 0,
+         'rejected': 0}
+
+
+def parse_set(part):
+    """(name, value) if the console command `part` sets a cvar, else None"""
+    first = part.split(None, 1)[0].lower() if part else ''
+    if first not in SET_COMMANDS and not first.startswith(CVAR_PREFIXES) and first not in SHADOW:
+        return None
+
+    try:
+        words = shlex.split(part)
+    except ValueError:
+        return None  # Unbalanced quotes
+
+    if len(words) >= 3 and words[0].lower() in SET_COMMANDS:
+        return words[1], ' '.join(words[2:])
+
+    # '<cvar> <value>' only uses the first word of the value
+    if len(words) == 2 and (words[0].lower().startswith(CVAR_PREFIXES) or words[0].lower() in SHADOW):
+        return words[0], words[1]
+
+    return None
+
+
+def filter_command(cmd):
+    """
+    Record the cvar sets of the ';' separated command `cmd` and return it without the ones the engine already has
+    ('' if nothing is left), along with the names of the recorded cvars.
+    """
+    parts = []
+    names = []
+
+    with CVARS_LOCK:
+        for part in cmd.split(';'):
+            cvar = parse_set(part.strip())
+            if cvar is None:
+                parts.append(part)
+                continue
+
+            name, value = cvar[0].lower(), cvar[1]
+            STATS['sets'] += 1
+            if not STALE and SHADOW.get(name) == value:
+                STATS['redundant'] += 1
+                continue
+
+            SHADOW[name] = value
+            SET_AT[name] = time.time()
+            names.append(name)
+            parts.append(part)
+
+    return ';'.join(parts).strip(' ;'), names
+
+
+def forget(names):
+    """The engine may not have the recorded values of these cvars (the command setting them failed)"""
+    with CVARS_LOCK:
+        for name in names:
+            SHADOW.pop(name.lower(), None)
+
+
+def parse_line(line):
+    """Console line refusing a set, '<cvar> is cheat protected.'"""
+    for rejection in REJECTIONS:
+        if line.endswith(rejection):
+            STATS['rejected'] += 1
+            forget([line[:-len(rejection)].split()[-1]])
+            return True
+    return False
+
+
+def get(name, default=None):
+    """The value the engine has for `name`, from memory"""
+    with CVARS_LOCK:
+        STATS['reads'] += 1
+        value = SHADOW.get(name.lower())
+    if value is None:
+        STATS['misses'] += 1
+        return default
+    return value
+
+
+def fresh():
+    """The shadow was reconciled and nothing could have changed the cvars behind the bot's back since"""
+    return not STALE and LAST_RECONCILE_TIME is not None
+
+
+def read_config(path):
+    """lowercased name -> value of the 'seta' lines of a config written by the engine"""
+    values = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as cfg:
+        for line in cfg:
+            if not line.startswith('seta '):
+                continue
+            try:
+                words = shlex.split(line)
+            except ValueError:
+                continue
+            if len(words) >= 3:
+                values[words[1].lower()] = words[2]
+    return values
+
+
+def load(values, since, pauses=None):
+    """
+    Replace the shadow with what the engine reported, except the cvars the bot set after `since`. Ignored if the
+    connection paused again since the `pauses` count.
+    """
+    global STALE, LAST_RECONCILE_TIME
+
+    with CVARS_LOCK:
+        if pauses is not None and pauses != PAUSES:
+            return False
+        recent = {name: SHADOW[name] for name, set_at in SET_AT.items() if set_at > since and name in SHADOW}
+        SHADOW.clear()
+        SHADOW.update(values)
+        SHADOW.update(recent)
+        STALE = False
+        LAST_RECONCILE_TIME = time.time()
+    return True
+
+
+def reconcile():
+    """Ask the engine for all its archived cvars with 'writeconfig' and load them in the shadow"""
+    import api
+
+    since = time.time()
+    pauses = PAUSES
+    try:
+        previous_mtime = os.path.getmtime(SHADOW_CONFIG_P)
+    except OSError:
+        previous_mtime = None
+
+    try:
+        api.exec_command(f"writeconfig {SHADOW_CONFIG}", verbose=False, priority=api.CONTROL).result()
+
+        while True:
+            try:
+                if os.path.getmtime(SHADOW_CONFIG_P) != previous_mtime:
+                    break
+            except OSError:
+                pass
+            if time.time() - since > RECONCILE_TIMEOUT:
+                raise TimeoutError(f"{SHADOW_CONFIG} wasn't written within {RECONCILE_TIMEOUT}s")
+            time.sleep(0.1)
+
+        time.sleep(0.1)  # Let the engine finish writing
+        values = read_config(SHADOW_CONFIG_P)
+    except Exception as e:
+        STATS['reconcile_failures'] += 1
+        logging.error(f"[CVARS] Reconciling with the engine failed: {e}")
+        return False
+
+    if not load(values, since, pauses):
+        logging.info("[CVARS] Connection paused while reconciling, the shadow stays stale")
+        return False
+
+    STATS['reconciles'] += 1
+    logging.info(f"[CVARS] Reconciled {len(values)} cvars with the engine")
+    return True
+
+
+def _reconcile_when_active():
+    global RECONCILE_THREAD
+
+    done = False
+    while True:
+        with CVARS_LOCK:
+            # Decided under the lock, so a resume notified after this sees either the thread or no thread
+            if done or not STALE or connection.CONNECTION.paused:
+                RECONCILE_THREAD = None
+                return
+            pauses = PAUSES
+        done = reconcile() or PAUSES == pauses  # Done, or failed for another reason than a new pause
+
+
+def track_connection(connection_state, old_phase, new_phase, reason):
+    """Connection state machine listener (see connection.ConnectionState.subscribe) reconciling after pauses"""
+    global STALE, PAUSES, RECONCILE_THREAD
+
+    # Runs with the machine locked: nothing under CVARS_LOCK may wait on the connection
+    with CVARS_LOCK:
+        if connection_state.paused:
+            PAUSES += 1
+            STALE = True
+        elif STALE and RECONCILE_THREAD is None:
+            # The writeconfig round trip happens in its own thread
+            RECONCILE_THREAD = threading.Thread(target=_reconcile_when_active, daemon=True)
+            RECONCILE_THREAD.start()
+
+
+def stats():
+    return {
+        **STATS,
+        'known': len(SHADOW),
+        'stale': STALE,
+        'last_reconcile': LAST_RECONCILE_TIME,
+    }
@@ -2,6 +2,8 @@
 
 import api
 import requests
+import twitch_api
+from cache import TTLCache
 from env import environ
 import serverstate
 import logging
@@ -30,8 +32,8 @@ SPECTATE_REQUEST_MESSAGES = [
 ]
 
 # Track spectate requests per player to prevent spam
-SPECTATE_REQUESTS = {}  # player_name -> last_request_time
 SPECTATE_COOLDOWN = 30  # 30 seconds between requests per player
+SPECTATE_REQUESTS = TTLCache('spectate_requests', SPECTATE_COOLDOWN, maxsize=256)  # "<player>_<requester>" keys in cooldown
 
 
 def scan_for_command(message):
@@ -87,23 +89,7 @@ def handle_f2(line_data):
 
 
 def handle_howmany(line_data):
-    client_id = environ['TWITCH_API']['client_id']
-    client_secret = environ['TWITCH_API']['client_secret']
-    token_url = "https://id.twitch.tv/oauth2/token"
-    token_data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'grant_type': 'client_credentials'
-    }
-    r = requests.post(token_url, data=token_data, timeout=10)
-    r.raise_for_status()
-    token = r.json()['access_token']
-    stream_url = f"https://api.twitch.tv/helix/streams?user_login={'defraglive'}"
-    headers = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
-    r = requests.get(stream_url, headers=headers, timeout=10)
-    r.raise_for_status()
-    stream_data = r.json()['data']
-    viewer_count = stream_data[0]['viewer_count']
+    viewer_count = twitch_api.get_client().get_viewer_count('defraglive')
     reply_string = f"$chsinfo(117) ^7-- you are being watched by ^3{viewer_count} ^7viewer" + ("s" if viewer_count > 0 else "")
     api.exec_command(f"varcommand say {reply_string}")
     return None
@@ -182,14 +168,12 @@ def handle_spectate(line_data):
         # Check cooldown for this specific player (use clean name for cooldown key)
         cooldown_key = f"{clean_target_name}_{requester}"
         if cooldown_key in SPECTATE_REQUESTS:
-            time_since_last = current_time - SPECTATE_REQUESTS[cooldown_key]
-            if time_since_last < SPECTATE_COOLDOWN:
-                remaining_time = int(SPECTATE_COOLDOWN - time_since_last)
-                api.exec_command(f"say ^3{requester}^7, please wait ^3{remaining_time}s ^7before requesting again.")
-                return None
+            remaining_time = int(SPECTATE_REQUESTS.remaining(cooldown_key))
+            api.exec_command(f"say ^3{requester}^7, please wait ^3{remaining_time}s ^7before requesting again.")
+            return None
         
         # Update cooldown tracker
-        SPECTATE_REQUESTS[cooldown_key] = current_time
+        SPECTATE_REQUESTS.set(cooldown_key, current_time)
         
         # Select random message and replace placeholder with colored name
         message_template = random.choice(SPECTATE_REQUEST_MESSAGES)
@@ -200,9 +184,6 @@ def handle_spectate(line_data):
         # Log the request (use clean name for logging clarity)
         logging.info(f"Spectate request sent by {requester} to {clean_target_name}: {spectate_message}")
         
-        # Clean up old cooldown entries (prevent memory buildup)
-        cleanup_old_requests(current_time)
-        
     except Exception as e:
         logging.error(f"Error in handle_spectate: {e}")
         api.exec_command(f"say ^7Error processing spectate request. Try ^3?help ^7for available commands.")
@@ -240,16 +221,3 @@ def remove_color_codes(text):
     """Remove Quake 3 color codes from text for comparison"""
     import re
     return re.sub(r'\^.', '', text)
-
-
-def cleanup_old_requests(current_time):
-    """Clean up old spectate request entries to prevent memory buildup"""
-    global SPECTATE_REQUESTS, SPECTATE_COOLDOWN
-    
-    keys_to_remove = []
-    for key, timestamp in SPECTATE_REQUESTS.items():
-        if current_time - timestamp > SPECTATE_COOLDOWN * 2:  # Clean up entries older than 2x cooldown
-            keys_to_remove.append(key)
-    
-    for key in keys_to_remove:
-        del SPECTATE_REQUESTS[key]
\ No newline at end of file
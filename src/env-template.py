@@ -25,6 +25,16 @@ environ = {
         'host': ""
     },
     "DEVELOPMENT": False, # True if you're developing, False if you're using the production server
+    "MAP_PREDOWNLOAD": False, # Download missing maps of the best ranked servers in the background
+    "MAP_DOWNLOAD_URL": "", # Map download URL for MAP_PREDOWNLOAD, "{}" is replaced by the map name (must serve the map's pk3)
+    "ENGINE_TRANSPORT": "ahk", # "ahk" for the Windows client, "pipe" for a client reading commands from its stdin
+    "ENGINE_PIPE": "", # pipe transport: named pipe the client reads, empty to use the stdin of the client the bot launches
+    "SIMULATOR": { # "simulator" transport: fake engine writing to DIR (DF_DIR if empty), see simulator.SCENARIOS
+        "DIR": "",
+        "SCENARIO": "basic",
+        "SPEED": 1
+    },
+    "AHK_DAEMON": True, # Type console commands through one long-lived AutoHotkey helper instead of a script per command
     "MAP_DATA": {
         "STORAGE_PATH": "",
         "MAPDATA_TABLE": ""
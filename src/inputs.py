@@ -0,0 +1,176 @@
+"""
+Input sampling for the spectated player.
+
+The keys the spectated player is pressing ($chsinfo(152)) are sampled several times per second by echoing them to
+the console with a marker, on top of the sample that comes with every svinfo_report (color2). Each sample is stored
+as a bitmask in a fixed-size ring buffer, which is used for time-based AFK detection and sent to the extension as a
+live input history.
+"""
+
+import json
+import logging
+import threading
+import time
+from array import array
+
+import api
+
+
+SAMPLE_MARKER = '#inputs#'  # Prefix of the echoed sample lines in the console log
+SAMPLE_COMMAND = f"varcommand echo {SAMPLE_MARKER}"  # Followed by the sampled player's id and $chsinfo(152)
+SAMPLE_INTERVAL = 0.25  # Seconds between two samples, each one is two qconsole.log lines (see probe.py)
+DEGRADED_SAMPLE_INTERVAL = 2  # Seconds between two samples while the transport is degraded (one script per command)
+HISTORY_SIZE = 600  # Samples kept in the ring buffer (2.5 minutes at 4 samples per second)
+PUBLISH_INTERVAL = 1  # Seconds between two input history messages to the extension
+OTHER_KEYS_BIT = 7  # Keys that didn't get their own bit share the last one
+
+KEY_BITS = {}  # key character -> bit number, assigned in the order keys are first seen
+SAMPLES = array('B', bytes(HISTORY_SIZE))  # Input bitmasks
+TIMES = array('d', bytes(8 * HISTORY_SIZE))  # Timestamps of the samples
+HEAD = 0  # Index the next sample is written to
+COUNT = 0
+PLAYER_ID = None  # Player the samples belong to, the buffer is cleared when we spectate someone else
+LAST_ACTIVE_TIME = None  # Time of the last sample with any key pressed
+LAST_SAMPLE_TIME = None
+HISTORY_LOCK = threading.Lock()
+
+
+def keys_to_mask(keys):
+    mask = 0
+    for key in keys:
+        if key.isspace():
+            continue
+        if key not in KEY_BITS and len(KEY_BITS) < OTHER_KEYS_BIT:
+            KEY_BITS[key] = len(KEY_BITS)
+        mask |= 1 << KEY_BITS.get(key, OTHER_KEYS_BIT)
+    return mask
+
+
+def reset(player_id=None):
+    global HEAD, COUNT, PLAYER_ID, LAST_ACTIVE_TIME, LAST_SAMPLE_TIME
+
+    with HISTORY_LOCK:
+        HEAD = 0
+        COUNT = 0
+        PLAYER_ID = player_id
+        LAST_ACTIVE_TIME = None
+        LAST_SAMPLE_TIME = None
+
+
+def record(keys, player_id=None, timestamp=None):
+    """Store one sample of the keys pressed by `player_id` (None means the currently sampled player)"""
+    global HEAD, COUNT, LAST_ACTIVE_TIME, LAST_SAMPLE_TIME
+
+    if player_id is not None and player_id != PLAYER_ID:
+        reset(player_id)
+
+    timestamp = timestamp or time.time()
+    mask = keys_to_mask(keys)
+
+    with HISTORY_LOCK:
+        SAMPLES[HEAD] = mask
+        TIMES[HEAD] = timestamp
+        HEAD = (HEAD + 1) % HISTORY_SIZE
+        COUNT = min(COUNT + 1, HISTORY_SIZE)
+        LAST_SAMPLE_TIME = timestamp
+        if mask:
+            LAST_ACTIVE_TIME = timestamp
+
+
+def parse_sample_line(line):
+    """
+    Console lines '<SAMPLE_MARKER> <player id> <keys>' written by the sampler. Returns True if the line is a sample.
+    Samples of another player than the sampled one (echoed around a follow switch) are ignored.
+    """
+    if not line.startswith(SAMPLE_MARKER):
+        return False
+
+    parts = line[len(SAMPLE_MARKER):].strip().split(None, 1)
+    if not parts or not parts[0].isdigit():
+        return False
+
+    if PLAYER_ID is not None and parts[0] == str(PLAYER_ID):  # Ids are strings or ints depending on their source
+        record(parts[1] if len(parts) > 1 else '')
+    return True
+
+
+def is_sample_echo(line):
+    """The console's echo of the sampler's command"""
+    return line.startswith(']' + SAMPLE_COMMAND)
+
+
+def idle_seconds(player_id, now=None):
+    """
+    Seconds since `player_id` last pressed a key, counted from the first sample if they haven't pressed anything
+    yet. None if there are no samples for this player.
+    """
+    now = now or time.time()
+
+    with HISTORY_LOCK:
+        if player_id != PLAYER_ID or COUNT == 0:
+            return None
+
+        if LAST_ACTIVE_TIME is not None:
+            return now - LAST_ACTIVE_TIME
+
+        oldest = TIMES[(HEAD - COUNT) % HISTORY_SIZE]
+        return now - oldest
+
+
+def history(seconds=None, since=None):
+    """Returns [(timestamp, mask)] oldest first, for the last `seconds` or for samples newer than `since`"""
+    now = time.time()
+    if seconds is not None:
+        since = now - seconds
+
+    with HISTORY_LOCK:
+        samples = []
+        for i in range(COUNT):
+            index = (HEAD - COUNT + i) % HISTORY_SIZE
+            if since is None or TIMES[index] > since:
+                samples.append((TIMES[index], SAMPLES[index]))
+        return samples
+
+
+def history_message(since=None):
+    """Compact input history for the extension: times are ms offsets from `start`"""
+    samples = history(since=since)
+    start = samples[0][0] if samples else time.time()
+
+    return {
+        'player_id': PLAYER_ID,
+        'start': start,
+        'samples': [[int((t - start) * 1000), mask] for t, mask in samples],
+        'keys': {key: bit for key, bit in KEY_BITS.items()},
+    }
+
+
+def sampler(ws_q, should_sample, interval=SAMPLE_INTERVAL):
+    """
+    Echo the spectated player's keys to the console every `interval` seconds while should_sample() returns the
+    id of the player being spectated (None pauses sampling), and publish the new samples to the extension. Samples
+    are spaced DEGRADED_SAMPLE_INTERVAL apart while the transport is degraded, so they don't crowd out the commands
+    that matter.
+    """
+    last_publish = 0
+    logging.info("Input sampler started")
+
+    while True:
+        try:
+            player_id = should_sample()
+            if player_id is not None:
+                if player_id != PLAYER_ID:
+                    reset(player_id)
+
+                api.exec_command(f"{SAMPLE_COMMAND} {player_id} $chsinfo(152)", verbose=False)
+
+                now = time.time()
+                if now - last_publish >= PUBLISH_INTERVAL:
+                    message = history_message(since=last_publish)
+                    if message['samples']:
+                        ws_q.put(json.dumps({'action': 'input_history', 'message': message}, separators=(',', ':')))
+                    last_publish = now
+        except Exception as e:
+            logging.error(f"Input sampler failed: {e}")
+
+        time.sleep(max(interval, DEGRADED_SAMPLE_INTERVAL) if api.TRANSPORT.degraded else interval)
@@ -9,6 +9,8 @@ import sqlite3
 import os.path
 import json
 import serverstate
+import connection
+from connection import CONNECTION
 import time
 import api
 import logging
@@ -164,8 +166,7 @@ def mapdataHook():
                 for key, value in SAVED_CMDS.items():
                     cmd += ";" + SAVED_CMDS[key]['cmd'] + " " + str(SAVED_CMDS[key]['default'])
 
-            serverstate.VID_RESTARTING = True
-            serverstate.PAUSE_STATE = True
+            CONNECTION.transition(connection.RESTARTING, "map settings vid_restart")
             api.exec_command(cmd + "; vid_restart")
 
         time.sleep(4)
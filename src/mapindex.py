@@ -0,0 +1,246 @@
+"""
+Index of the maps the game can load locally, so server selection can avoid servers running maps we don't have
+(or maps that already failed to load) instead of finding out after a full connect and a CM_LoadMap error.
+
+Maps are collected from the pk3 archives in DF_DIR and baseq3 (only the zip central directory is read) and from
+loose .bsp files in DF_DIR/maps. Archives are only re-read when their mtime or size changed, the index is kept in
+storage/mapindex.json between runs.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+
+import requests
+
+import config
+from env import environ
+
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'mapindex.json')
+SEARCH_DIRS = [config.DF_DIR, os.path.join(config.DF_DIR, os.pardir, 'baseq3')]
+MAPS_DIR = os.path.join(config.DF_DIR, 'maps')
+MAP_DOWNLOAD_URL = environ.get('MAP_DOWNLOAD_URL', '')  # '{}' is replaced by the map name, empty disables downloads
+MAX_DOWNLOAD_SIZE = 100 * 1024 * 1024
+
+FAILED_MAP_EXPIRY = 3600  # Give a map that failed to load another chance after an hour
+REFRESH_INTERVAL = 300
+PREDOWNLOAD_COUNT = 5  # How many of the best ranked servers to pre-download maps for
+
+INDEX_LOCK = threading.RLock()
+ARCHIVES = {}  # pk3 path -> {'mtime': float, 'size': int, 'maps': [map names]}
+MAPS = set()  # Lowercase names of all locally available maps
+FAILED_MAPS = {}  # map name -> time it failed to load
+LOADED = False
+
+
+def maps_in_archive(path):
+    """Names of the maps inside a pk3, from its central directory"""
+    maps = set()
+
+    with zipfile.ZipFile(path) as pk3:
+        for name in pk3.namelist():
+            lower_name = name.lower()
+            if lower_name.startswith('maps/') and lower_name.endswith('.bsp') and lower_name.count('/') == 1:
+                maps.add(lower_name[len('maps/'):-len('.bsp')])
+
+    return sorted(maps)
+
+
+def load():
+    global LOADED
+
+    with INDEX_LOCK:
+        LOADED = True
+        try:
+            with open(INDEX_PATH, 'r') as f:
+                data = json.load(f)
+            ARCHIVES.update(data.get('archives', {}))
+            FAILED_MAPS.update(data.get('failed', {}))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Could not read map index, rebuilding it: {e}")
+
+
+def save():
+    with INDEX_LOCK:
+        data = {'archives': ARCHIVES, 'failed': FAILED_MAPS}
+
+    try:
+        os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+        tmp_path = INDEX_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, INDEX_PATH)
+    except Exception as e:
+        logging.error(f"Failed to save map index: {e}")
+
+
+def refresh():
+    """Rescan the archives, only opening the ones that are new or changed. Returns the number of maps available"""
+    if not LOADED:
+        load()
+
+    changed = False
+    seen = set()
+
+    with INDEX_LOCK:
+        for directory in SEARCH_DIRS:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if not entry.name.lower().endswith('.pk3') or not entry.is_file():
+                    continue
+
+                path = os.path.normpath(entry.path)
+                stat = entry.stat()
+                seen.add(path)
+
+                cached = ARCHIVES.get(path)
+                if cached is not None and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                    continue
+
+                try:
+                    maps = maps_in_archive(path)
+                except (zipfile.BadZipFile, OSError) as e:
+                    logging.warning(f"Could not read {path}: {e}")
+                    maps = []
+
+                ARCHIVES[path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'maps': maps}
+                changed = True
+
+        for path in [path for path in ARCHIVES if path not in seen]:
+            del ARCHIVES[path]
+            changed = True
+
+        maps = {name for archive in ARCHIVES.values() for name in archive['maps']}
+        try:
+            maps.update(name[:-len('.bsp')].lower() for name in os.listdir(MAPS_DIR) if name.lower().endswith('.bsp'))
+        except OSError:
+            pass
+
+        MAPS.clear()
+        MAPS.update(maps)
+
+    if changed:
+        save()
+        logging.info(f"Map index refreshed: {len(MAPS)} maps in {len(ARCHIVES)} archives")
+
+    return len(MAPS)
+
+
+def has_map(name):
+    """True if the map is available locally. Until the first scan completes every map is assumed available"""
+    if not MAPS:
+        return True
+    return bool(name) and name.lower() in MAPS
+
+
+def has_failed(name):
+    """True if the map failed to load recently"""
+    if not name:
+        return False
+
+    failed_at = FAILED_MAPS.get(name.lower())
+    return failed_at is not None and time.time() - failed_at < FAILED_MAP_EXPIRY
+
+
+def record_failure(name):
+    if not name:
+        return
+
+    with INDEX_LOCK:
+        FAILED_MAPS[name.lower()] = time.time()
+    logging.info(f"Map '{name}' failed to load, servers running it will be avoided for {FAILED_MAP_EXPIRY // 60} minutes")
+    save()
+
+
+def clear_failure(name):
+    if name and name.lower() in FAILED_MAPS:
+        with INDEX_LOCK:
+            FAILED_MAPS.pop(name.lower(), None)
+        save()
+
+
+def verify_archive(path, name):
+    """Raises ValueError unless the file at `path` is a pk3 containing maps/<name>.bsp"""
+    if not zipfile.is_zipfile(path):
+        raise ValueError("not a zip archive")
+    if name.lower() not in maps_in_archive(path):
+        raise ValueError(f"maps/{name}.bsp not in the archive")
+
+
+def is_safe_map_name(name):
+    """Map names come from the servers feed: only plain file names that stay in DF_DIR are downloaded"""
+    if not re.fullmatch(r'[\w\-.]+', name or ''):
+        return False
+    df_dir = os.path.realpath(config.DF_DIR)
+    target = os.path.realpath(os.path.join(df_dir, f"{name.lower()}.pk3"))
+    return os.path.dirname(target) == df_dir
+
+
+def predownload(name):
+    """
+    Download a missing map from MAP_DOWNLOAD_URL into DF_DIR, so connecting to its server doesn't wait on it.
+    The game only sees new archives after its next filesystem restart (vid_restart or a connect that restarts it).
+    """
+    if not MAP_DOWNLOAD_URL:
+        return False
+
+    if not is_safe_map_name(name):
+        logging.warning(f"Not downloading map {name!r}: invalid map name")
+        return False
+
+    target = os.path.join(config.DF_DIR, f"{name.lower()}.pk3")
+    tmp_path = target + '.part'
+
+    try:
+        with requests.get(MAP_DOWNLOAD_URL.format(name), stream=True, timeout=30) as r:
+            r.raise_for_status()
+            size = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    size += len(chunk)
+                    if size > MAX_DOWNLOAD_SIZE:
+                        raise ValueError(f"larger than {MAX_DOWNLOAD_SIZE // (1024 * 1024)}MB")
+                    f.write(chunk)
+
+        verify_archive(tmp_path, name)  # Never put anything but the map's pk3 in the game directory
+        os.replace(tmp_path, target)
+        logging.info(f"Pre-downloaded map {name}")
+        return True
+    except Exception as e:
+        logging.warning(f"Could not pre-download map {name}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def run(get_wanted_maps, interval=REFRESH_INTERVAL):
+    """
+    Keep the index up to date. When MAP_PREDOWNLOAD is enabled, also download the missing maps returned by
+    get_wanted_maps() (the maps of the best ranked servers) from MAP_DOWNLOAD_URL.
+    """
+    if environ.get('MAP_PREDOWNLOAD', False) and not MAP_DOWNLOAD_URL:
+        logging.warning("MAP_PREDOWNLOAD is enabled but MAP_DOWNLOAD_URL isn't set, no map will be downloaded")
+
+    while True:
+        try:
+            refresh()
+
+            if environ.get('MAP_PREDOWNLOAD', False) and MAP_DOWNLOAD_URL:
+                missing = [name for name in get_wanted_maps() if not has_map(name) and not has_failed(name)]
+                if missing and any([predownload(name) for name in missing]):
+                    refresh()
+        except Exception as e:
+            logging.error(f"Map index refresh failed: {e}")
+
+        time.sleep(interval)
@@ -0,0 +1,228 @@
+"""
+Timing instrumentation for connections and recoveries.
+
+A span measures one step of getting the stream back to a spectated player: a connect, a map load, a vid_restart,
+the state initialization, the time from a connect to the first successful follow, or one recovery attempt. Every
+span records the server it happened on, how it ended (its outcome) and why it started or ended (its reason).
+Only one span per name is open at a time, and starting a new one closes the previous one as 'superseded'.
+
+Finished spans are aggregated (count, outcomes, p50/p95/max duration) per name, and their durations are summed per
+server as "dead air". Counters track how often each console error signature fires. Everything is served on
+/metrics.json and logged as one summary line every SUMMARY_INTERVAL seconds.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import connection
+
+
+SPAN_HISTORY = 500  # Finished spans kept per name for the percentiles
+RECENT_SPANS = 50  # Finished spans of all names kept for the endpoint
+SUMMARY_INTERVAL = 300
+DEAD_AIR_SPANS = {'connect', 'map_load', 'vid_restart', 'state_init'}  # Time without a live stream (with recoveries)
+RECOVERY_PREFIX = 'recovery_'  # Recovery attempt spans are named after their tier (recovery_resume, ...)
+
+METRICS_LOCK = threading.Lock()
+OPEN_SPANS = {}  # name -> Span
+DURATIONS = {}  # name -> deque of durations
+OUTCOMES = {}  # name -> {outcome: count}
+RECENT = deque(maxlen=RECENT_SPANS)
+DEAD_AIR = {}  # server -> seconds
+COUNTERS = {}  # counter name -> {label: count}
+SERVER_COUNTERS = {}  # counter name -> {server: count}
+STARTED_AT = time.time()
+
+
+class Span:
+    __slots__ = ('name', 'server', 'reason', 'start', 'end', 'outcome', 'end_reason')
+
+    def __init__(self, name, server=None, reason=None):
+        self.name = name
+        self.server = server
+        self.reason = reason
+        self.start = time.time()
+        self.end = None
+        self.outcome = None
+        self.end_reason = None
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'server': self.server,
+            'reason': self.reason,
+            'start': self.start,
+            'duration': round(self.duration, 3),
+            'outcome': self.outcome,
+            'end_reason': self.end_reason,
+        }
+
+
+def _finish(span, outcome, reason):
+    span.end = time.time()
+    span.outcome = outcome
+    span.end_reason = reason
+
+    DURATIONS.setdefault(span.name, deque(maxlen=SPAN_HISTORY)).append(span.duration)
+    outcomes = OUTCOMES.setdefault(span.name, {})
+    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    RECENT.append(span)
+
+    if (span.name in DEAD_AIR_SPANS or span.name.startswith(RECOVERY_PREFIX)) and span.server:
+        DEAD_AIR[span.server] = DEAD_AIR.get(span.server, 0) + span.duration
+
+    logging.debug(f"[METRICS] {span.name} {outcome} after {span.duration:.2f}s ({span.server}, {reason or span.reason})")
+
+
+def start_span(name, server=None, reason=None):
+    """Open a span, closing the open span of the same name as 'superseded'"""
+    with METRICS_LOCK:
+        previous = OPEN_SPANS.get(name)
+        if previous is not None:
+            _finish(previous, 'superseded', reason)
+
+        span = OPEN_SPANS[name] = Span(name, server, reason)
+        return span
+
+
+def end_span(name, outcome='ok', reason=None):
+    """Close the open span of this name. Returns it, or None if there was no open span"""
+    with METRICS_LOCK:
+        span = OPEN_SPANS.pop(name, None)
+        if span is not None:
+            _finish(span, outcome, reason)
+        return span
+
+
+def is_open(name):
+    with METRICS_LOCK:
+        return name in OPEN_SPANS
+
+
+def open_recovery_spans():
+    with METRICS_LOCK:
+        return [name for name in OPEN_SPANS if name.startswith(RECOVERY_PREFIX)]
+
+
+def start_recovery_attempt(tier, server=None, reason=None):
+    """Open the span of a recovery attempt. The attempt before it, if still open, failed"""
+    for name in open_recovery_spans():
+        end_span(name, 'failed', reason)
+    return start_span(RECOVERY_PREFIX + tier, server, reason)
+
+
+def increment(counter, label, server=None):
+    with METRICS_LOCK:
+        counts = COUNTERS.setdefault(counter, {})
+        counts[label] = counts.get(label, 0) + 1
+        if server:
+            server_counts = SERVER_COUNTERS.setdefault(counter, {})
+            server_counts[server] = server_counts.get(server, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def aggregate(name):
+    durations = sorted(DURATIONS.get(name, ()))
+    return {
+        'count': sum(OUTCOMES.get(name, {}).values()),
+        'outcomes': dict(OUTCOMES.get(name, {})),
+        'p50': percentile(durations, 0.5),
+        'p95': percentile(durations, 0.95),
+        'max': durations[-1] if durations else None,
+    }
+
+
+def track_connection(connection_state, old_phase, new_phase, reason):
+    """Connection state machine listener (see connection.ConnectionState.subscribe) recording the phase spans"""
+    server = connection_state.target
+    with METRICS_LOCK:
+        connect_span = OPEN_SPANS.get('connect')
+
+    if new_phase == connection.CONNECTING and (old_phase != connection.CONNECTING or connect_span is None
+                                               or connect_span.server != server):
+        start_span('connect', server, reason)
+        start_span('first_follow', server, reason)
+    elif old_phase == connection.CONNECTING and new_phase != connection.CONNECTING:
+        end_span('connect', 'ok' if new_phase in (connection.INITIALIZING, connection.SPECTATING) else new_phase, reason)
+
+    for phase, name in ((connection.LOADING, 'map_load'), (connection.RESTARTING, 'vid_restart'),
+                        (connection.INITIALIZING, 'state_init')):
+        if new_phase == phase and old_phase != phase:
+            start_span(name, server, reason)
+        elif old_phase == phase and new_phase != phase:
+            ok = new_phase in (connection.INITIALIZING, connection.SPECTATING, connection.STANDBY)
+            end_span(name, 'ok' if ok else new_phase, reason)
+
+    if not connection_state.recovering:
+        if connection_state.phase in (connection.INITIALIZING, connection.SPECTATING):
+            outcome = 'ok'
+        elif connection_state.phase == connection.CONNECTING:
+            outcome = 'switched_server'
+        else:
+            outcome = 'gave_up'
+        for name in open_recovery_spans():
+            end_span(name, outcome, reason)
+
+
+def snapshot():
+    with METRICS_LOCK:
+        names = sorted(set(DURATIONS) | set(OPEN_SPANS))
+        return {
+            'uptime': time.time() - STARTED_AT,
+            'spans': {name: aggregate(name) for name in names},
+            'open': {name: span.to_dict() for name, span in OPEN_SPANS.items()},
+            'recent': [span.to_dict() for span in RECENT],
+            'dead_air': dict(sorted(DEAD_AIR.items(), key=lambda item: -item[1])),
+            'counters': {counter: dict(counts) for counter, counts in COUNTERS.items()},
+            'server_counters': {counter: dict(counts) for counter, counts in SERVER_COUNTERS.items()},
+        }
+
+
+def format_seconds(value):
+    return '-' if value is None else f"{value:.1f}s"
+
+
+def summary_line():
+    data = snapshot()
+    parts = []
+
+    for name, stats in data['spans'].items():
+        if not stats['count']:
+            continue
+        failed = stats['count'] - stats['outcomes'].get('ok', 0)
+        parts.append(f"{name} n={stats['count']} failed={failed} p50={format_seconds(stats['p50'])} "
+                     f"p95={format_seconds(stats['p95'])} max={format_seconds(stats['max'])}")
+
+    errors = data['counters'].get('error_filter', {})
+    if errors:
+        parts.append("errors: " + ", ".join(f"{label}={count}" for label, count in sorted(errors.items(), key=lambda item: -item[1])))
+
+    if data['dead_air']:
+        worst = list(data['dead_air'].items())[:3]
+        parts.append("dead air: " + ", ".join(f"{server}={seconds:.0f}s" for server, seconds in worst))
+
+    return " | ".join(parts) if parts else "no spans recorded yet"
+
+
+def reporter(interval=SUMMARY_INTERVAL):
+    """Log the summary line every `interval` seconds"""
+    while True:
+        time.sleep(interval)
+        try:
+            logging.info(f"[METRICS] {summary_line()}")
+        except Exception as e:
+            logging.error(f"Metrics summary failed: {e}")
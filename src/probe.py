@@ -0,0 +1,172 @@
+"""
+Engine responsiveness probe.
+
+Every PROBE_INTERVAL seconds an 'echo <PROBE_MARKER> <nonce>' goes out through the command queue, and the console
+tail reports when the nonce shows up in qconsole.log. The time in between is the engine's round trip: our queue,
+the transport and the engine's own frame loop. Round trips are kept in a histogram.
+
+While a probe is unanswered, its age escalates through three thresholds: WARN_AFTER logs a warning, RECOVER_AFTER
+triggers the connection recovery, RELAUNCH_AFTER kills the game so the main loop relaunches it. Probing is
+suspended while the connection is paused (loading a map, vid_restart...), when the engine legitimately stops
+answering, unless the recovery was already started by the probe.
+
+Each probe costs two qconsole.log lines, the echoed command and the answer. With the input sampler (4 per second,
+see inputs.py) the bot writes about 6 commands per second to the console while spectating, roughly 1MB of log per
+hour, all of it skipped by the console tail. Raise PROBE_INTERVAL and inputs.SAMPLE_INTERVAL to trade detection
+and sampling resolution for a smaller log.
+"""
+
+import bisect
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+import api
+import metrics
+from connection import CONNECTION
+
+
+PROBE_MARKER = '#probe#'
+PROBE_COMMAND = f"echo {PROBE_MARKER}"  # Followed by the probe's nonce
+PROBE_INTERVAL = 0.5  # Seconds between two probes
+WARN_AFTER = 1  # Seconds without an answer before each escalation level
+RECOVER_AFTER = 10
+RELAUNCH_AFTER = 60
+HISTOGRAM_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5)  # Upper bounds (seconds) of the histogram buckets, plus one for more
+LATENCY_HISTORY = 500
+MAX_OUTSTANDING = 4  # No more probes are queued behind this many unanswered ones
+
+OK, WARNED, RECOVERING, RELAUNCHED = range(4)
+LEVEL_NAMES = ('ok', 'warned', 'recovering', 'relaunched')
+
+NONCES = itertools.count(1)
+OUTSTANDING = {}  # nonce -> time the probe was queued
+HISTOGRAM = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+LATENCIES = deque(maxlen=LATENCY_HISTORY)
+PROBE_LOCK = threading.Lock()
+LEVEL = OK
+LAST_ANSWER_TIME = None
+STATS = {'sent': 0, 'answered': 0, 'late': 0, 'warnings': 0, 'recoveries': 0, 'relaunches': 0}
+
+
+def parse_line(line):
+    """A console line. Returns True if it was a probe answer"""
+    global LAST_ANSWER_TIME, LEVEL
+
+    if not line.startswith(PROBE_MARKER):
+        return False  # The engine echoing the typed command, not the answer
+
+    try:
+        nonce = int(line[len(PROBE_MARKER):].strip())
+    except ValueError:
+        return False
+
+    now = time.time()
+    with PROBE_LOCK:
+        sent_at = OUTSTANDING.pop(nonce, None)
+        if sent_at is None:
+            STATS['late'] += 1  # Answer to a probe dropped after a pause
+            return True
+
+        latency = now - sent_at
+        LATENCIES.append(latency)
+        HISTOGRAM[bisect.bisect_left(HISTOGRAM_BOUNDS, latency)] += 1
+        STATS['answered'] += 1
+        LAST_ANSWER_TIME = now
+
+        # Everything older than the answered probe is lost
+        for older in [n for n in OUTSTANDING if n < nonce]:
+            del OUTSTANDING[older]
+
+        if LEVEL != OK:
+            logging.info(f"[PROBE] Engine responding again ({latency:.2f}s round trip)")
+            LEVEL = OK
+
+    return True
+
+
+def is_probe_echo(line):
+    """The console's echo of a probe command"""
+    return line.startswith(']' + PROBE_COMMAND)
+
+
+def oldest_unanswered_age(now=None):
+    now = now or time.time()
+    with PROBE_LOCK:
+        return now - min(OUTSTANDING.values()) if OUTSTANDING else 0
+
+
+def reset():
+    global LEVEL
+    with PROBE_LOCK:
+        OUTSTANDING.clear()
+        LEVEL = OK
+
+
+def escalate(age, on_recover, on_relaunch):
+    """Move up the escalation levels according to the age of the oldest unanswered probe"""
+    global LEVEL
+
+    if age >= RELAUNCH_AFTER and LEVEL < RELAUNCHED:
+        LEVEL = RELAUNCHED
+        STATS['relaunches'] += 1
+        logging.critical(f"[PROBE] Engine hasn't processed a command for {age:.1f}s, killing it for a relaunch")
+        on_relaunch()
+        reset()
+    elif age >= RECOVER_AFTER and LEVEL < RECOVERING:
+        LEVEL = RECOVERING
+        STATS['recoveries'] += 1
+        logging.error(f"[PROBE] Engine hasn't processed a command for {age:.1f}s, starting recovery")
+        on_recover()
+    elif age >= WARN_AFTER and LEVEL < WARNED:
+        LEVEL = WARNED
+        STATS['warnings'] += 1
+        logging.warning(f"[PROBE] Engine hasn't processed a command for {age:.1f}s")
+
+
+def run(on_recover, on_relaunch, interval=PROBE_INTERVAL):
+    """Probe the engine every `interval` seconds and escalate when it stops answering"""
+    logging.info("Engine probe started")
+
+    while True:
+        time.sleep(interval)
+        try:
+            if CONNECTION.paused:
+                if LEVEL >= RECOVERING:
+                    # A recovery reconnect pauses the connection: keep counting, a frozen engine never loads
+                    escalate(oldest_unanswered_age(), on_recover, on_relaunch)
+                elif OUTSTANDING:
+                    reset()
+                continue
+
+            escalate(oldest_unanswered_age(), on_recover, on_relaunch)
+
+            if len(OUTSTANDING) >= MAX_OUTSTANDING:
+                continue
+
+            nonce = next(NONCES)
+            with PROBE_LOCK:
+                OUTSTANDING[nonce] = time.time()
+                STATS['sent'] += 1
+            api.exec_command(f"{PROBE_COMMAND} {nonce}", verbose=False, priority=api.CONTROL)
+        except Exception as e:
+            logging.error(f"Engine probe failed: {e}")
+
+
+def stats():
+    latencies = sorted(LATENCIES)
+    labels = [f"<={bound}s" for bound in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1]}s"]
+
+    return {
+        **STATS,
+        'level': LEVEL_NAMES[LEVEL],
+        'outstanding': len(OUTSTANDING),
+        'oldest_unanswered': oldest_unanswered_age(),
+        'last_answer': LAST_ANSWER_TIME,
+        'p50': metrics.percentile(latencies, 0.5),
+        'p95': metrics.percentile(latencies, 0.95),
+        'max': latencies[-1] if latencies else None,
+        'histogram': dict(zip(labels, HISTOGRAM)),
+    }
@@ -0,0 +1,141 @@
+"""
+Quake 3 getstatus prober.
+
+Sends out-of-band getstatus queries to many servers in parallel and parses the player list and round trip time
+from their statusResponse. This is much fresher than the defrag.racing servers feed, which can lag by minutes.
+The prober knows nothing about server selection: `run` asks for the addresses to probe and hands the results back
+through callbacks (see servers.get_probe_targets/servers.update_probe_results).
+"""
+
+import asyncio
+import logging
+import re
+import time
+
+
+GETSTATUS = b'\xff\xff\xff\xffgetstatus\n'
+STATUS_RESPONSE = b'\xff\xff\xff\xffstatusResponse'
+PROBE_TIMEOUT = 1.5  # Seconds to wait for each server's answer
+PROBE_RETRIES = 1  # getstatus goes over UDP, ask again before reporting a server that didn't answer
+PROBE_CONCURRENCY = 32
+PROBE_INTERVAL = 20  # Seconds between two probe rounds
+DEFAULT_PORT = 27960
+
+PLAYER_LINE_RX = re.compile(r'^(-?\d+) (\d+) "(.*)"$')
+
+
+class ProbeResult:
+    def __init__(self, address, info, players, rtt):
+        self.address = address
+        self.info = info  # Server cvars (sv_hostname, mapname, ...)
+        self.players = players  # [(score, ping, name)]
+        self.rtt = rtt  # Round trip time of the query in ms
+        self.probed_at = time.time()
+
+    @property
+    def humans(self):
+        """Players that aren't bots (bots always have a 0 ping)"""
+        return [player for player in self.players if player[1] > 0]
+
+    def count_humans(self, exclude=None):
+        """Number of humans, minus one if one of them is named `exclude` (colors stripped, lowercase)"""
+        humans = self.humans
+        if exclude and any(clean_name(player[2]) == exclude for player in humans):
+            return len(humans) - 1
+        return len(humans)
+
+
+def clean_name(name):
+    return re.sub(r'\^.', '', name).lower()
+
+
+def parse_status_response(data):
+    """Returns (info, players) from a raw statusResponse packet"""
+    lines = data[len(STATUS_RESPONSE):].decode('utf-8', errors='replace').strip('\n').split('\n')
+
+    fields = lines[0].split('\\')[1:] if lines else []
+    info = dict(zip(fields[0::2], fields[1::2]))
+
+    players = []
+    for line in lines[1:]:
+        match = PLAYER_LINE_RX.match(line.strip())
+        if match:
+            players.append((int(match.group(1)), int(match.group(2)), match.group(3)))
+
+    return info, players
+
+
+def split_address(address):
+    host, _, port = address.partition(':')
+    return host, int(port) if port else DEFAULT_PORT
+
+
+class StatusProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def connection_made(self, transport):
+        transport.sendto(GETSTATUS)
+
+    def datagram_received(self, data, addr):
+        if not self.future.done() and data.startswith(STATUS_RESPONSE):
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def probe(address, timeout=PROBE_TIMEOUT):
+    """Query a single server, returns a ProbeResult or None if it didn't answer in time"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport = None
+    start = time.perf_counter()
+
+    try:
+        transport, _ = await loop.create_datagram_endpoint(lambda: StatusProtocol(future), remote_addr=split_address(address))
+        data = await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, OSError, ValueError):
+        return None
+    finally:
+        if transport is not None:
+            transport.close()
+
+    info, players = parse_status_response(data)
+    return ProbeResult(address, info, players, (time.perf_counter() - start) * 1000)
+
+
+async def probe_servers(addresses, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY, retries=PROBE_RETRIES):
+    """Query all servers in parallel, returns {address: ProbeResult or None}"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited_probe(address):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                result = await probe(address, timeout)
+                if result is not None:
+                    break
+            return address, result
+
+    return dict(await asyncio.gather(*(limited_probe(address) for address in addresses)))
+
+
+def run(get_targets, on_results, interval=PROBE_INTERVAL):
+    """Probe the addresses returned by get_targets() every `interval` seconds and pass the results to on_results"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    logging.info("Server prober started")
+
+    while True:
+        try:
+            targets = get_targets()
+            if targets:
+                results = loop.run_until_complete(probe_servers(targets))
+                answered = sum(1 for result in results.values() if result is not None)
+                logging.debug(f"Probed {len(targets)} servers, {answered} answered")
+                on_results(results)
+        except Exception as e:
+            logging.error(f"Server probe round failed: {e}")
+
+        time.sleep(interval)
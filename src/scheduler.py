@@ -0,0 +1,190 @@
+"""
+Small cooperative scheduler for the state loop.
+
+Work that used to sleep inside the loop (waiting before a follow-up command, spacing out tells, verifying a team
+switch, tallying votes) is scheduled as a task instead and run by the loop between two reports, so one slow step
+doesn't hold back state refreshes. Every task has a deadline: a task that couldn't run before it is dropped, its
+follow-up no longer applies by then. The loop also times each of its iterations and logs the ones that overrun
+their budget.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+
+DEFAULT_DEADLINE = 10  # Seconds a task may run late before it is dropped
+TIMING_HISTORY = 100  # Iteration timings kept for stats
+
+
+class Task:
+    __slots__ = ('name', 'fn', 'args', 'run_at', 'deadline', 'cancelled')
+
+    def __init__(self, name, fn, args, run_at, deadline):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.run_at = run_at
+        self.deadline = deadline
+        self.cancelled = False
+
+
+class Scheduler:
+    def __init__(self, name, budget, task_budget=None):
+        self.name = name
+        self.budget = budget  # Max seconds one loop iteration should take
+        self.task_budget = task_budget if task_budget is not None else budget / 2  # Max seconds spent on tasks per run
+
+        self._heap = []  # (run_at, seq, Task)
+        self._tasks = {}  # name -> Task
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        self.timings = deque(maxlen=TIMING_HISTORY)
+        self.iterations = 0
+        self.overruns = 0
+        self.tasks_run = 0
+        self.tasks_expired = 0
+        self.tasks_failed = 0
+
+    def schedule(self, name, fn, *args, delay=0, deadline=DEFAULT_DEADLINE):
+        """
+        Run fn(*args) from the loop in `delay` seconds. A pending task with the same name is replaced. The task is
+        dropped if it can't run within `deadline` seconds of its run time.
+        """
+        run_at = time.time() + delay
+        task = Task(name, fn, args, run_at, run_at + deadline)
+
+        with self._lock:
+            previous = self._tasks.get(name)
+            if previous is not None:
+                previous.cancelled = True
+            self._tasks[name] = task
+            heapq.heappush(self._heap, (run_at, next(self._seq), task))
+
+    def cancel(self, name):
+        with self._lock:
+            task = self._tasks.pop(name, None)
+            if task is not None:
+                task.cancelled = True
+
+    def pending(self, name):
+        with self._lock:
+            return name in self._tasks
+
+    def next_delay(self):
+        """Seconds until the next task is due (0 if one is overdue), None if nothing is scheduled"""
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0, self._heap[0][0] - time.time())
+
+    def _pop_due(self, now):
+        with self._lock:
+            while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] <= now):
+                _, _, task = heapq.heappop(self._heap)
+                if task.cancelled:
+                    continue
+                del self._tasks[task.name]
+                return task
+            return None
+
+    def run_due(self):
+        """Run the tasks that are due, oldest first, until the task budget is spent. Returns the number of tasks run"""
+        start = time.time()
+        count = 0
+
+        while time.time() - start < self.task_budget:
+            now = time.time()
+            task = self._pop_due(now)
+            if task is None:
+                break
+
+            if now > task.deadline:
+                self.tasks_expired += 1
+                logging.warning(f"[{self.name}] Dropped task '{task.name}', it missed its deadline by {now - task.deadline:.1f}s")
+                continue
+
+            try:
+                task.fn(*task.args)
+                self.tasks_run += 1
+            except Exception as e:
+                self.tasks_failed += 1
+                logging.error(f"[{self.name}] Task '{task.name}' failed: {e}")
+            count += 1
+
+        return count
+
+    def iteration(self):
+        """Context manager timing one loop iteration"""
+        return IterationTimer(self)
+
+    def record_iteration(self, duration):
+        self.iterations += 1
+        self.timings.append(duration)
+
+        if duration > self.budget:
+            self.overruns += 1
+            logging.warning(f"[{self.name}] Loop iteration took {duration:.2f}s (budget {self.budget:.2f}s)")
+
+    def stats(self):
+        timings = sorted(self.timings)
+        with self._lock:
+            pending = sorted(self._tasks)
+
+        return {
+            'budget': self.budget,
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'last': self.timings[-1] if self.timings else None,
+            'p50': timings[len(timings) // 2] if timings else None,
+            'max': timings[-1] if timings else None,
+            'pending': pending,
+            'tasks_run': self.tasks_run,
+            'tasks_expired': self.tasks_expired,
+            'tasks_failed': self.tasks_failed,
+        }
+
+
+class IterationTimer:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.scheduler.record_iteration(time.time() - self.start)
+        return False
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+
+    def refill(self, now=None):
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost=1, now=None):
+        """Seconds until `cost` tokens are available (0 if they are)"""
+        now = now or time.time()
+        self.refill(now)
+        return max(0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+    def take(self, cost=1, now=None):
+        self.refill(now)
+        self.tokens -= min(cost, self.burst)
@@ -1,9 +1,175 @@
+import ipaddress
+import logging
+import re
+import socket
+import threading
+import time
+
 import requests
-import urllib3
 
-urllib3.disable_warnings()
+import config
+import mapindex
+import prober
+from cache import TTLCache
+
+SERVERS_URL = 'https://defrag.racing/servers/json'
+SERVERS_DATA_TTL = 15  # The servers list is requested by several features in a row, reuse it for a few seconds
+SERVERS_FEED_TIMEOUT = 5
+EMPTY_SERVERS_DATA = {
+    "active": {},
+    "empty": {}
+}
+
+# Server ranking, see default_score
+FAILURE_PENALTY = 10  # Score penalty (in players) of a failure that just happened, multiple failures add up
+FAILURE_HALF_LIFE = 300  # Seconds for a failure penalty to halve
+VISIT_BONUS = 1  # Score bonus (in players) for servers that haven't been visited for VISIT_BONUS_TIME
+VISIT_BONUS_TIME = 1800
+RANKING_MAX_AGE = 30  # Penalties decay over time, re-rank at least this often
+
+MISSING_MAP_PENALTY = 0.5  # Score penalty (in players) for a map we don't have locally and would need to download
+FAILED_MAP_PENALTY = 100  # Score penalty for a map that recently failed to load, effectively skips the server
+PING_PENALTY = 0.5  # Score penalty (in players) of a 1000ms ping, breaks ties in favour of closer servers
+PROBE_MAX_AGE = 60  # Probe results older than this are ignored
+PROBE_MAX_MISSES = 3  # Rounds a server has to miss in a row before the probe reports it down
+
+SERVER_FAILURES = {}  # ip -> (penalty, timestamp), penalty decays from timestamp on
+PROBE_RESULTS = {}  # ip -> (prober.ProbeResult or None if the server didn't answer, timestamp)
+PROBE_MISSES = {}  # ip -> probe rounds missed in a row
+OWN_PLAYER = None  # (ip, clean lowercase name) of the bot, which getstatus counts as a human on its server
+RESOLVED_HOSTS = {}  # Whitelisted host -> its IP addresses, resolved once
+SERVER_VISITS = {}  # ip -> last time the bot connected to it
+RANKING = None
+RANKING_LOCK = threading.Lock()
+
+
+class ServersSnapshot:
+    """One version of the servers feed, along with the views parsed from it (computed once per refresh)"""
+
+    def __init__(self, data, etag=None, last_modified=None):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.time()
+
+        self.active_players = {}  # ip -> list of active player ids
+        self.colored_names = {}  # ip -> {clean lowercase name: colored name}
+        self.maps = {}  # ip -> map the server is running
+
+        for section in ('active', 'empty'):
+            for ip_addr, server in data.get(section, {}).items():
+                if isinstance(server, dict) and server.get('map'):
+                    self.maps[ip_addr] = server['map']
+
+        for ip_addr, server in data.get('active', {}).items():
+            try:
+                self.active_players[ip_addr] = get_active_players(server)
+            except Exception as e:
+                logging.warning(f"Could not parse active players of {ip_addr}: {e}")
+                self.active_players[ip_addr] = []
+
+            self.colored_names[ip_addr] = parse_colored_names(server)
+
+
+class ServersFeed:
+    """
+    Shared access to the defrag.racing servers feed.
+
+    The feed is fetched through a pooled session and reused for `ttl` seconds. When it expires only one thread
+    refreshes it (revalidating with ETag/If-Modified-Since), the others keep using the stale copy meanwhile. When a
+    fetch fails the last good copy is served and refreshes back off exponentially.
+    """
+
+    def __init__(self, url=SERVERS_URL, ttl=SERVERS_DATA_TTL, timeout=SERVERS_FEED_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.cache = TTLCache('servers_data', ttl, maxsize=1, negative_ttl=ttl, max_negative_ttl=120)
+        self.refresh_lock = threading.Lock()
+        self.listeners = []  # Called with every new snapshot
+
+    def on_refresh(self, listener):
+        self.listeners.append(listener)
+
+    def snapshot(self):
+        snapshot = self.cache.get('servers')
+        if snapshot is not None:
+            return snapshot
+
+        stale = self.cache.get('servers', stale=True)
+
+        # Single-flight: only one thread refreshes, the others get the stale copy (or wait if there is none yet)
+        if not self.refresh_lock.acquire(blocking=stale is None):
+            return stale
+
+        try:
+            snapshot = self.cache.get('servers')
+            if snapshot is not None:  # Refreshed by another thread while we were waiting
+                return snapshot
+            return self.refresh(stale)
+        finally:
+            self.refresh_lock.release()
+
+    def refresh(self, stale=None):
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers['If-None-Match'] = stale.etag
+            if stale.last_modified:
+                headers['If-Modified-Since'] = stale.last_modified
+
+        try:
+            r = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304 and stale is not None:
+                self.cache.set('servers', stale)
+                return stale
+
+            r.raise_for_status()
+            snapshot = ServersSnapshot(r.json(), r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        except Exception as e:
+            logging.error(f"Failed to fetch servers data: {e}")
+            self.cache.set_negative('servers', default=ServersSnapshot(EMPTY_SERVERS_DATA))
+            return self.cache.get('servers', stale=True)
+
+        self.cache.set('servers', snapshot)
+
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logging.error(f"Servers feed listener failed: {e}")
+
+        return snapshot
+
+
+FEED = ServersFeed()
+
+
+def normalize_ip(ip):
+    """The feed lists servers as ip:port"""
+    return ip if ':' in ip else f"{ip}:27960"
+
+
+def get_server_data(ip):
+    """Returns the feed entry of an active server, None if it isn't active"""
+    return FEED.snapshot().data.get('active', {}).get(normalize_ip(ip))
+
+
+def get_colored_names(ip):
+    """Returns {clean lowercase name: colored name} for the players of an active server"""
+    return FEED.snapshot().colored_names.get(normalize_ip(ip), {})
+
+
+def parse_colored_names(server):
+    colored_names = {}
 
-LAST_SERVERS_DATA = None
+    for player_data in server.get('players', {}).values():
+        if isinstance(player_data, dict) and 'name' in player_data:
+            # Map clean name to colored name
+            clean_name = re.sub(r'\^.', '', player_data['name'])
+            colored_names[clean_name.lower()] = player_data['name']
+
+    return colored_names
 
 
 def is_valid_ip(ip):
@@ -27,35 +193,18 @@ def is_valid_ip(ip):
 
 
 def scrape_servers_data():
-    global LAST_SERVERS_DATA
-
-    try:
-        url = f'https://defrag.racing/servers/json'
-        data = requests.get(url, verify=False).json()
-    except Exception as e:
-        logging.error(f"Failed to fetch servers data: {e}")
-        return LAST_SERVERS_DATA or {
-            "active": {},
-            "empty": {}
-        }
-
-    LAST_SERVERS_DATA = data
-
-    return data
+    return FEED.snapshot().data
 
 
 def get_most_popular_server():
     """ Returns the IP of the server with the most players, or defrag.rocks if no servers are populated """
-    servers_data = scrape_servers_data()
-
-    servers_data = servers_data['active']
+    active_players = FEED.snapshot().active_players
 
     max_plyr_qty = 0
     max_plyr_ip = ""
 
-    for ip_addr, data in servers_data.items():
-        active_players = get_active_players(data)
-        player_qty = len(active_players)
+    for ip_addr, players in active_players.items():
+        player_qty = len(players)
         if player_qty > max_plyr_qty:
             max_plyr_qty = player_qty
             max_plyr_ip = ip_addr
@@ -65,16 +214,13 @@ def get_most_popular_server():
 
 def get_least_popular_server():
     """ Returns the IP of the server with the least players, used only for development """
-    servers_data = scrape_servers_data()
-
-    servers_data = servers_data['active']
+    active_players = FEED.snapshot().active_players
 
     min_plyr_qty = 9999
     min_plyr_ip = ""
 
-    for ip_addr, data in servers_data.items():
-        active_players = get_active_players(data)
-        player_qty = len(active_players)
+    for ip_addr, players in active_players.items():
+        player_qty = len(players)
         if player_qty < min_plyr_qty:
             min_plyr_qty = player_qty
             min_plyr_ip = ip_addr
@@ -84,7 +230,7 @@ def get_least_popular_server():
 
 def get_active_players(data):
     """Returns the amount of *active* players. Meaning player count without spectators or nospeccers"""
-    speccable_players = []
+    speccable_players = set()
     active_players = []
     if data['scores']['num_players']:
         if 'notice' in data:
@@ -92,42 +238,236 @@ def get_active_players(data):
 
         for plyr_num in data['players']:
             if isinstance(plyr_num, dict):
-                speccable_players.append(int(plyr_num['clientId']))
+                speccable_players.add(int(plyr_num['clientId']))
                 active_players.append(int(plyr_num['clientId']))
                 continue
 
             player = data['players'][plyr_num]
             if not player['nospec']:
-                speccable_players.append(int(player['clientId']))
+                speccable_players.add(int(player['clientId']))
         for score_player in data['scores']['players']:
             if score_player['player_num'] in speccable_players and score_player['follow_num'] == -1:
                 active_players.append(score_player['player_num'])
     return active_players
 
 
-def get_next_active_server(ignore_list, ignore_empty=False):
-    """Returns the next active server omitting the servers given in ignore_list"""
-    servers_data = scrape_servers_data()
+def failure_penalty(ip, now):
+    if ip not in SERVER_FAILURES:
+        return 0
 
-    servers_data = servers_data['active']
+    penalty, timestamp = SERVER_FAILURES[ip]
+    return penalty * 0.5 ** ((now - timestamp) / FAILURE_HALF_LIFE)
 
-    for ignore_ip in ignore_list:
-        if ':' not in ignore_ip:
-            ignore_ip += ':27960'
 
-    max_plyr_qty = 0
-    max_plyr_ip = ""
+def map_penalty(map_name):
+    if not map_name:
+        return 0
+    if mapindex.has_failed(map_name):
+        return FAILED_MAP_PENALTY
+    if not mapindex.has_map(map_name):
+        return MISSING_MAP_PENALTY
+    return 0
 
-    for ip_addr, data in servers_data.items():
-        active_players = get_active_players(data)
-        player_qty = len(active_players)
-        if player_qty > max_plyr_qty and ip_addr not in ignore_list:
-            max_plyr_qty = player_qty
-            max_plyr_ip = ip_addr
 
-    print("Next active server: " + max_plyr_ip + " (" + str(max_plyr_qty) + " players)")
+def default_score(ip, player_count, now, map_name=None):
+    """
+    Players count the most, servers that failed recently are pushed down (the penalty halves every
+    FAILURE_HALF_LIFE seconds) and servers that haven't been visited for a while get a small bonus.
+    Servers running a map that failed to load are skipped, maps that need to be downloaded cost a little.
+    """
+    since_visit = now - SERVER_VISITS.get(ip, 0)
+    visit_bonus = VISIT_BONUS * min(1, since_visit / VISIT_BONUS_TIME)
+
+    probe = get_probe_result(ip, now)
+    ping_penalty = PING_PENALTY * min(1, probe.rtt / 1000) if probe is not None else 0
+
+    return player_count - failure_penalty(ip, now) + visit_bonus - ping_penalty - map_penalty(map_name)
+
+
+SCORE_FUNCTION = default_score  # (ip, player_count, now, map_name) -> score, higher is better
+
+
+class ServerRanking:
+    """Active servers ordered by score, built from one feed snapshot"""
+
+    def __init__(self, active_players, score=None, maps=None):
+        score = score or SCORE_FUNCTION
+        now = time.time()
+
+        self.built_at = now
+        self.player_counts = merge_probe_results({ip: len(players) for ip, players in active_players.items()}, now)
+        self.maps = maps or {}
+        self.scores = {ip: score(ip, count, now, self.maps.get(ip)) for ip, count in self.player_counts.items()}
+        # Only servers with someone to spectate are candidates
+        self.order = sorted((ip for ip, count in self.player_counts.items() if count > 0),
+                            key=lambda ip: self.scores[ip], reverse=True)
 
-    if max_plyr_qty == 0 and ignore_empty:
+    def best(self, exclude=()):
+        """Returns the best ranked server not in `exclude`, None if there is none. Only looks past the excluded ones"""
+        for ip in self.order:
+            if ip not in exclude:
+                return ip
         return None
 
-    return max_plyr_ip
+
+def rebuild_ranking(snapshot=None):
+    global RANKING
+
+    snapshot = snapshot or FEED.snapshot()
+    with RANKING_LOCK:
+        RANKING = ServerRanking(snapshot.active_players, maps=snapshot.maps)
+    return RANKING
+
+
+def get_ranking():
+    """Returns the current ranking. It is rebuilt on each feed refresh, on failures/visits and when it gets old"""
+    snapshot = FEED.snapshot()  # May refresh the feed, which rebuilds the ranking
+    ranking = RANKING
+
+    if ranking is None or time.time() - ranking.built_at > RANKING_MAX_AGE:
+        ranking = rebuild_ranking(snapshot)
+
+    return ranking
+
+
+def record_failure(ip, reason=None, weight=1):
+    """Remember that connecting to/staying on a server failed, so it is ranked lower for a while"""
+    global RANKING
+
+    if not ip:
+        return
+
+    ip = normalize_ip(ip)
+    now = time.time()
+    with RANKING_LOCK:
+        SERVER_FAILURES[ip] = (failure_penalty(ip, now) + FAILURE_PENALTY * weight, now)
+        RANKING = None  # Re-rank on next use
+    logging.info(f"Server {ip} failed ({reason}), penalty is now {SERVER_FAILURES[ip][0]:.1f}")
+
+
+def record_visit(ip):
+    global RANKING
+
+    if not ip:
+        return
+
+    with RANKING_LOCK:
+        SERVER_VISITS[normalize_ip(ip)] = time.time()
+        RANKING = None
+
+
+def get_probe_result(ip, now=None):
+    """Returns the latest answer of a server to the getstatus prober, None if it has none recent enough"""
+    now = now or time.time()
+    result, timestamp = PROBE_RESULTS.get(ip, (None, 0))
+    return result if now - timestamp <= PROBE_MAX_AGE else None
+
+
+def set_own_player(ip, name):
+    """Where the bot is and under which name, so the probe doesn't count it as a player"""
+    global OWN_PLAYER
+
+    OWN_PLAYER = (normalize_ip(ip), prober.clean_name(name)) if ip and name else None
+
+
+def merge_probe_results(player_counts, now):
+    """
+    Correct the feed's player counts with the prober's fresher view. getstatus can't tell spectators apart (they
+    have a ping too), so the probe can only lower a count: a server that emptied (or stopped answering
+    PROBE_MAX_MISSES times in a row) since the feed was updated drops to 0. A server the feed lists as empty stays
+    out, even if the probe sees people on it: they may all be spectating. The bot itself isn't counted.
+    """
+    merged = dict(player_counts)
+    own_ip, own_name = OWN_PLAYER or (None, None)
+
+    for ip, (result, timestamp) in list(PROBE_RESULTS.items()):
+        if now - timestamp > PROBE_MAX_AGE:
+            continue
+
+        humans = result.count_humans(own_name if ip == own_ip else None) if result is not None else 0
+        if ip in merged:
+            merged[ip] = min(merged[ip], humans)
+
+    return merged
+
+
+def resolve_hosts(hosts):
+    """IP addresses of the given hosts (hostnames or IPs). Each hostname is only resolved once"""
+    addresses = set()
+    for host in hosts:
+        if host not in RESOLVED_HOSTS:
+            try:
+                RESOLVED_HOSTS[host] = set(socket.gethostbyname_ex(host)[2])
+            except OSError as e:
+                logging.warning(f"Couldn't resolve whitelisted server {host}: {e}")
+                RESOLVED_HOSTS[host] = set()
+        addresses |= RESOLVED_HOSTS[host]
+    return addresses
+
+
+def is_public_ip(host):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_global
+
+
+def get_probe_targets():
+    """
+    Addresses for the prober: the servers of the feed (keyed ip:port, like the probe results) whose host is
+    whitelisted. Local and private addresses aren't probed.
+    """
+    whitelist = set(config.get_list('whitelist_servers'))
+    allowed = whitelist | resolve_hosts(whitelist)
+    data = FEED.snapshot().data
+
+    targets = set()
+    for section in ('active', 'empty'):
+        for ip in data.get(section, {}):
+            host = ip.split(':')[0]
+            if host in allowed and is_public_ip(host):
+                targets.add(ip)
+
+    return sorted(targets)
+
+
+def get_wanted_maps():
+    """Maps of the best ranked servers, which are worth having locally before we connect to them"""
+    ranking = get_ranking()
+    return [ranking.maps[ip] for ip in ranking.order[:mapindex.PREDOWNLOAD_COUNT] if ip in ranking.maps]
+
+
+def update_probe_results(results):
+    global RANKING
+
+    now = time.time()
+    with RANKING_LOCK:
+        for ip, result in results.items():
+            if result is None:
+                PROBE_MISSES[ip] = PROBE_MISSES.get(ip, 0) + 1
+                if PROBE_MISSES[ip] < PROBE_MAX_MISSES:
+                    continue  # Probably lost packets, keep the last answer until the server misses a few rounds
+            else:
+                PROBE_MISSES.pop(ip, None)
+            PROBE_RESULTS[ip] = (result, now)
+        RANKING = None  # Re-rank on next use
+
+
+FEED.on_refresh(rebuild_ranking)
+
+
+def get_next_active_server(ignore_list, ignore_empty=False):
+    """Returns the best ranked active server omitting the servers given in ignore_list"""
+    ranking = get_ranking()
+    ignored = {normalize_ip(ip) for ip in ignore_list if ip}
+
+    next_ip = ranking.best(ignored)
+    player_qty = ranking.player_counts.get(next_ip, 0)
+
+    logging.info(f"Next active server: {next_ip} ({player_qty} players, score {ranking.scores.get(next_ip, 0):.1f})")
+
+    if next_ip is None:
+        return None if ignore_empty else ""
+
+    return next_ip
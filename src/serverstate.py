@@ -16,11 +16,19 @@ import random
 import config
 import os
 import servers
+import mapindex
+import inputs as input_history
 import logging
 import json
-import requests
-from hashlib import md5
-from env import environ
+import itertools
+import connection
+import cvars
+import metrics
+import scheduler
+import sounds
+import twitch_api
+from cache import TTLCache
+from connection import CONNECTION
 # import mapdata
 from websocket_console import notify_serverstate_change
 import traceback
@@ -45,6 +53,24 @@ CONNECTION_START_TIME = None
 MAX_CONNECTION_TIMEOUT = 90  # 90 seconds max for any connection attempt
 FORCE_RECOVERY_TIMEOUT = 90  # 90 seconds absolute maximum before force recovery
 RECOVERY_IN_PROGRESS = False
+
+# svinfo_report cadence, see ReportCadence
+STRIKE_INTERVAL = 2  # AFK and idle strikes are counted per 2 seconds of elapsed time, whatever the report cadence
+CADENCE_FAST = 0.3  # Poll interval during a burst (after switches and connects, AFK counter close to the timeout)
+CADENCE_NORMAL = 2
+CADENCE_SLOW = 4  # Poll interval when the state hasn't changed for a while (standby, static roster)
+CADENCE_BURST_TIME = 5  # How long a burst of fast polling lasts
+CADENCE_STABLE_CYCLES = 10  # Unchanged cycles before backing off to CADENCE_SLOW
+CADENCE_AFK_MARGIN = 3  # Poll fast when the AFK counter is within this many strikes of the timeout
+REPORT_TIMEOUT = 1.0  # Max time to wait for the game to write a requested report
+REPORT_POLL_STEP = 0.05
+REPORT_SETTLE_TIME = 0.05  # Give the game a moment to finish writing once the report's mtime changed
+STRIKE_CLOCKS = {}  # 'afk'/'idle' -> (last check time, carried seconds), see elapsed_strikes
+STATE_LOOP_BUDGET = 2  # Seconds one state loop iteration should take at most (report wait included)
+TEAM_VERIFY_DELAY = 3  # Check the bot's team this long after a 'team s'
+LEAVE_DELAY = 2  # Seconds between the farewell message and the switch to another server
+FAREWELL_TIMEOUT = 10  # Max seconds the switch waits for the farewell messages to be sent
+SCHEDULER = scheduler.Scheduler('state', STATE_LOOP_BUDGET)  # Follow-up tasks run by the state loop
 RECOVERY_ATTEMPTS = 0
 MAX_RECOVERY_ATTEMPTS = 3
 LAST_RECOVERY_TIME = 0
@@ -57,8 +83,9 @@ LAST_PAUSE_LOG_TIME = 0
 PAUSE_LOG_INTERVAL = 10  # Log every 10 pauses or every 30 seconds
 
 # Track failed follow attempts to prevent infinite retry loops
-FAILED_FOLLOW_ATTEMPTS = {}  # {player_id: {'timestamp': time, 'count': int}} - track failed attempts
 FAILED_FOLLOW_COOLDOWN = 10  # Retry after 10 seconds
+# player_id -> consecutive failures (see TTLCache.failures), a player is in cooldown while their entry is fresh
+FAILED_FOLLOW_ATTEMPTS = TTLCache('failed_follows', FAILED_FOLLOW_COOLDOWN, maxsize=64, max_negative_ttl=FAILED_FOLLOW_COOLDOWN)
 MAX_FOLLOW_FAILURES = 3  # Give up after 3 consecutive failures
 PERMANENTLY_EXCLUDED = set()  # Player IDs that failed too many times
 
@@ -436,21 +463,13 @@ def send_nationality_greeting(server_ip):
     Send a nationality-specific greeting based on server composition
     """
     try:
-        # Fetch server data
-        import requests
-        url = 'https://defrag.racing/servers/json'
-        response = requests.get(url, timeout=5)
-        servers_data = response.json()
-        
-        # Add default port if not present
-        api_ip = server_ip if ':' in server_ip else f"{server_ip}:27960"
-        
-        if 'active' not in servers_data or api_ip not in servers_data['active']:
+        server_data = servers.get_server_data(server_ip)
+
+        if server_data is None:
             # Fallback to regular greeting
             send_auto_greeting()
             return
         
-        server_data = servers_data['active'][api_ip]
         dominant_country = get_dominant_nationality(server_data)
         
         if dominant_country and dominant_country in NATIONALITY_GREETINGS:
@@ -537,45 +556,205 @@ WORLD_RECORD_MESSAGES = [
 LAST_WR_MESSAGE_TIME = 0
 WR_MESSAGE_COOLDOWN = 60  # 1 minute
 
-# Twitch account validation cache
-TWITCH_ACCOUNT_CACHE = {}  # username -> (exists, timestamp)
-TWITCH_LIVE_CACHE = {}  # username -> (is_live, timestamp)
+# Twitch account validation cache. Failed lookups are negatively cached with exponential backoff (30s, max 5 minutes)
 TWITCH_CACHE_EXPIRY = 300  # 5 minutes cache expiry
 TWITCH_LIVE_CACHE_EXPIRY = 60  # 1 minute cache for live status (more frequent updates needed)
-TWITCH_ERROR_BACKOFF = {}  # username -> (last_error_time, consecutive_errors)
+TWITCH_CACHE_SIZE = 512
+TWITCH_ACCOUNT_CACHE = TTLCache('twitch_accounts', TWITCH_CACHE_EXPIRY, maxsize=TWITCH_CACHE_SIZE, negative_ttl=30, jitter=0.2)  # username -> exists
+TWITCH_LIVE_CACHE = TTLCache('twitch_live', TWITCH_LIVE_CACHE_EXPIRY, maxsize=TWITCH_CACHE_SIZE, negative_ttl=30, jitter=0.2)  # username -> is_live
+TWITCH_WATCH_EXPIRY = 600  # Stop refreshing a streamer that hasn't been seen on the server for 10 minutes
+TWITCH_WATCHED = TTLCache('twitch_watched', TWITCH_WATCH_EXPIRY, maxsize=TWITCH_CACHE_SIZE)  # streamers seen in a player's color1, these are kept refreshed in the background
+TWITCH_REFRESH_EVENT = threading.Event()  # Wakes the refresher up when a new streamer shows up
+TWITCH_REFRESH_TICK = 5  # How often the refresher checks for due entries
 
 RECONNECTED_CHECK = False
 
 CURRENT_IP = None
 
 STATE = None
-PAUSE_STATE = False
 IGNORE_IPS = []
+# Mirrors of the connection state machine (see connection.py and sync_connection_flags), never assign them directly
+PAUSE_STATE = False
 CONNECTING = False
 VID_RESTARTING = False
 STATE_INITIALIZED = False
 LAST_REPORT_TIME = time.time()
 LAST_INIT_REPORT_TIME = time.time()
 
+
+def sync_connection_flags(connection_state, old_phase, new_phase, reason):
+    """Mirror the connection state machine into the flags read across the bot"""
+    global PAUSE_STATE, CONNECTING, VID_RESTARTING, STATE_INITIALIZED, RECOVERY_IN_PROGRESS, CONNECTION_START_TIME
+
+    PAUSE_STATE = connection_state.paused
+    CONNECTING = connection_state.connecting
+    VID_RESTARTING = connection_state.restarting
+    STATE_INITIALIZED = connection_state.initialized
+    RECOVERY_IN_PROGRESS = connection_state.recovering
+    CONNECTION_START_TIME = connection_state.since if connection_state.connecting else None
+
+
+CONNECTION.subscribe(sync_connection_flags)
+CONNECTION.subscribe(metrics.track_connection)
+CONNECTION.subscribe(cvars.track_connection)
+
+# Version counter shared by all State objects, so a re-initialized state never reuses the version of the old one
+STATE_VERSIONS = itertools.count(1)
+SAVED_STATE_VERSION = None  # Version of the state last written to storage/serverstate.json
+SAVED_RESUME_DATA = None  # Resume data last written to storage/serverstate.json
+RESUME_DATA = None  # Latest resume data, built by the state loop, the only thread mutating what it copies
+STATE_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'serverstate.json')
+STATE_WRITE_INTERVAL = 5  # The writer checks for changes at least this often, even if nobody wakes it up
+STATE_SAVE_EVENT = threading.Event()  # Set to wake up the writer after a state change
+WARM_START_MAX_AGE = 600  # Don't reattach using a saved state older than this
+
 # mapdata_thread = threading.Thread(target=mapdata.mapdataHook, daemon=True)
 
+def get_resume_data():
+    """
+    Bot-side data that isn't part of the published serverstate but is needed to pick up where the bot left off.
+    Call it from the state loop: the AFK dicts it copies are mutated there.
+    """
+    return {
+        'ip': CURRENT_IP or STATE.ip,
+        'secret': STATE.secret,
+        'bot_id': STATE.bot_id,
+        'current_player_id': STATE.current_player_id,
+        'afk_ids': list(STATE.afk_ids),
+        'afk_timestamps': {str(player_id): t for player_id, t in STATE.afk_timestamps.items()},
+        'player_afk_timeouts': dict(STATE.player_afk_timeouts),
+        'failed_follows': {str(player_id): FAILED_FOLLOW_ATTEMPTS.failures(player_id) for player_id in FAILED_FOLLOW_ATTEMPTS.keys()},
+        'excluded': sorted(PERMANENTLY_EXCLUDED),
+    }
+
+
 def save_serverstate_to_file():
+    """
+    Write the serverstate and the resume data to storage/serverstate.json if either changed since the last write.
+    The file is replaced atomically, so readers never see a partial file. Returns True if it was written.
+    """
+    global SAVED_STATE_VERSION, SAVED_RESUME_DATA
+
+    if not STATE or not hasattr(STATE, 'players'):
+        return False
+
+    resume_data = RESUME_DATA
+    if resume_data is None:
+        return False  # The state loop didn't complete an iteration yet
+    if STATE.version == SAVED_STATE_VERSION and resume_data == SAVED_RESUME_DATA:
+        return False  # Nothing changed since the last write
+
+    import websocket_console
+
+    version = STATE.version
+    data = websocket_console.serverstate_to_json()
+    data['resume'] = dict(resume_data, saved_at=time.time())
+
+    os.makedirs(os.path.dirname(STATE_FILE_PATH), exist_ok=True)
+    tmp_path = STATE_FILE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, STATE_FILE_PATH)
+
+    SAVED_STATE_VERSION = version
+    SAVED_RESUME_DATA = resume_data
+    return True
+
+
+def request_state_save():
+    STATE_SAVE_EVENT.set()
+
+
+def state_writer(interval=STATE_WRITE_INTERVAL):
+    """Background writer of storage/serverstate.json, woken up by request_state_save() or every `interval` seconds"""
+    while True:
+        STATE_SAVE_EVENT.wait(interval)
+        STATE_SAVE_EVENT.clear()
+
+        try:
+            save_serverstate_to_file()
+        except Exception as e:
+            logging.error(f"Failed to save serverstate: {e}")
+
+
+def load_resume_data():
+    """Resume data saved by a previous run, None if there is none or it is too old to be trusted"""
     try:
-        if STATE and hasattr(STATE, 'players'):
-            import websocket_console
-            import json
-            import os
-            
-            # Use storage directory for runtime data
-            storage_dir = os.path.join(os.path.dirname(__file__), '..', 'storage')
-            os.makedirs(storage_dir, exist_ok=True)
-            filepath = os.path.join(storage_dir, 'serverstate.json')
-            
-            data = websocket_console.serverstate_to_json()
-            with open(filepath, 'w') as f:
-                json.dump(data, f)
+        with open(STATE_FILE_PATH, 'r') as f:
+            resume_data = json.load(f).get('resume')
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read the saved serverstate: {e}")
+        return None
+
+    if not resume_data or time.time() - resume_data.get('saved_at', 0) > WARM_START_MAX_AGE:
+        return None
+    return resume_data
+
+
+def warm_start():
+    """
+    Reattach to the server the game is still connected to after the bot was restarted. The bot is recognized by the
+    secret it put in color1 before the restart, so the connect, team switch and nospec notifications of a full
+    initialization are skipped and the AFK and failed follow memory is restored. Returns True on success.
+    """
+    global STATE
+    global BOT_SECRET
+    global CURRENT_IP
+
+    resume_data = load_resume_data()
+    if resume_data is None:
+        return False
+
+    try:
+        api.exec_command("silent svinfo_report serverstate.txt", verbose=False, wait=True)
+        if wait_for_report(config.STATE_REPORT_P) is None or not new_report_exists(config.STATE_REPORT_P):
+            return False
+
+        server_info, players, num_players = get_svinfo_report(config.STATE_REPORT_P)
+        if not server_info or servers.normalize_ip(server_info['ip']) != servers.normalize_ip(resume_data['ip']):
+            logging.info("Warm start: the game isn't on the saved server anymore, initializing normally")
+            return False
+
+        bot_player = [player for player in players if player.c1 == resume_data['secret']]
+        if not bot_player:
+            logging.info("Warm start: bot not found on the saved server, initializing normally")
+            return False
+
+        BOT_SECRET = resume_data['secret']
+        state = State(BOT_SECRET, server_info, players, bot_player[0].id)
+        state.num_players = num_players
+        state.afk_ids = [player_id for player_id in resume_data['afk_ids'] if state.get_player_by_id(player_id)]
+        state.afk_timestamps = {int(player_id): t for player_id, t in resume_data['afk_timestamps'].items()}
+        state.player_afk_timeouts = dict(resume_data['player_afk_timeouts'])
+        for player_id in state.afk_ids:
+            if player_id in state.spec_ids:
+                state.spec_ids.remove(player_id)
+
+        current_player = state.get_player_by_id(resume_data['current_player_id'])
+        if current_player is not None and current_player.id != state.bot_id:
+            state.current_player_id = current_player.id
+            state.current_player = current_player
+        else:
+            state.current_player_id = state.bot_id
+            state.current_player = state.get_player_by_id(state.bot_id)
+
+        for player_id, failures in resume_data['failed_follows'].items():
+            for _ in range(failures):
+                FAILED_FOLLOW_ATTEMPTS.set_negative(int(player_id))
+        PERMANENTLY_EXCLUDED.update(resume_data['excluded'])
+
+        STATE = state
+        CURRENT_IP = resume_data['ip']
+        CONNECTION.transition(connection.INITIALIZING, "warm start", expect=(connection.IDLE,))
+        CONNECTION.set_initialized("warm start")
+        logging.info(f"Warm start: reattached to {CURRENT_IP} as client {STATE.bot_id}, spectating {STATE.current_player_id}")
+        return True
     except Exception as e:
-        logging.error(f"Failed to save serverstate: {e}")
+        logging.error(f"Warm start failed, initializing normally: {e}")
+        return False
+
 
 def get_twitch_viewer_count():
     """
@@ -583,133 +762,89 @@ def get_twitch_viewer_count():
     Returns viewer count as integer, or 0 if error occurs
     """
     try:
-        client_id = environ['TWITCH_API']['client_id']
-        client_secret = environ['TWITCH_API']['client_secret']
-        token_url = "https://id.twitch.tv/oauth2/token"
-        token_data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'grant_type': 'client_credentials'
-        }
-        token_response = requests.post(token_url, data=token_data, timeout=10)
-        token_response.raise_for_status()
-        token = token_response.json()['access_token']
-        stream_url = f"https://api.twitch.tv/helix/streams?user_login={'defraglive'}"
-        headers = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
-        response = requests.get(stream_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        stream_data = response.json()['data']
-        return stream_data[0]['viewer_count'] if stream_data else 0
+        return twitch_api.get_client().get_viewer_count('defraglive')
     except Exception as e:
         logging.error(f"Error getting Twitch viewer count: {e}")
         return 0
 
-def check_twitch_account_exists(username):
-    """
-    Check if a Twitch account exists with caching to avoid excessive API calls
-    Returns True if account exists, False if not found or error occurs
-    """
-    global TWITCH_ACCOUNT_CACHE
-    current_time = time.time()
+def watch_twitch_users(usernames):
+    """Register streamers seen in players' color1 so the background refresher keeps their status up to date"""
+    new_user = False
 
-    # Check cache first
-    if username in TWITCH_ACCOUNT_CACHE:
-        exists, timestamp = TWITCH_ACCOUNT_CACHE[username]
-        if current_time - timestamp < TWITCH_CACHE_EXPIRY:
-            return exists
+    for username in usernames:
+        if username not in TWITCH_WATCHED:
+            new_user = True
+        TWITCH_WATCHED.set(username, True)
 
-    try:
-        client_id = environ['TWITCH_API']['client_id']
-        client_secret = environ['TWITCH_API']['client_secret']
-        token_url = "https://id.twitch.tv/oauth2/token"
-        token_data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'grant_type': 'client_credentials'
-        }
-        token_response = requests.post(token_url, data=token_data, timeout=10)
-        token_response.raise_for_status()
-        token = token_response.json()['access_token']
-        user_url = f"https://api.twitch.tv/helix/users?login={username}"
-        headers = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
-        response = requests.get(user_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        user_data = response.json()['data']
-        exists = len(user_data) > 0  # Account exists if user data returned
-
-        # Cache the result
-        TWITCH_ACCOUNT_CACHE[username] = (exists, current_time)
-
-        return exists
-    except Exception as e:
-        logging.error(f"Error checking Twitch account existence {username}: {e}")
-        # Cache negative result for failed API calls to avoid spam
-        TWITCH_ACCOUNT_CACHE[username] = (False, current_time)
-        return False
+    if new_user:
+        TWITCH_REFRESH_EVENT.set()
 
-def check_twitch_channel_live(username):
+def get_twitch_status(username):
     """
-    Check if a Twitch channel is currently live with caching and error backoff
-    Returns True if live, False if not live or error occurs
+    Returns (exists, is_live) for a streamer straight from the caches, without ever doing a request.
+    Stale entries are still returned while the refresher fetches new ones. Streamers that haven't been looked up yet
+    are reported as existing but not live.
     """
-    global TWITCH_LIVE_CACHE, TWITCH_ERROR_BACKOFF
-    current_time = time.time()
+    watch_twitch_users([username])
 
-    # Check if we should skip due to recent errors (exponential backoff)
-    if username in TWITCH_ERROR_BACKOFF:
-        last_error_time, consecutive_errors = TWITCH_ERROR_BACKOFF[username]
-        backoff_time = min(300, 30 * (2 ** consecutive_errors))  # Max 5 minutes backoff
-        if current_time - last_error_time < backoff_time:
-            logging.debug(f"Skipping Twitch check for {username} due to backoff ({backoff_time}s)")
-            return False
+    exists = TWITCH_ACCOUNT_CACHE.get(username, True, stale=True)
+    is_live = TWITCH_LIVE_CACHE.get(username, False, stale=True)
 
-    # Check cache first
-    if username in TWITCH_LIVE_CACHE:
-        is_live, timestamp = TWITCH_LIVE_CACHE[username]
-        if current_time - timestamp < TWITCH_LIVE_CACHE_EXPIRY:
-            return is_live
+    return exists, is_live
 
-    try:
-        client_id = environ['TWITCH_API']['client_id']
-        client_secret = environ['TWITCH_API']['client_secret']
-        token_url = "https://id.twitch.tv/oauth2/token"
-        token_data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'grant_type': 'client_credentials'
-        }
-        token_response = requests.post(token_url, data=token_data, timeout=10)
-        token_response.raise_for_status()
-        token = token_response.json()['access_token']
+def refresh_twitch_status():
+    """
+    Refresh the account and live status of all watched streamers whose cache entries are due, with one batched
+    /users and one batched /streams request. Returns True if any status visible to the extension changed.
+    """
+    changed = False
+    watched = TWITCH_WATCHED.keys()
 
-        stream_url = f"https://api.twitch.tv/helix/streams?user_login={username}"
-        headers = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
-        response = requests.get(stream_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        stream_data = response.json()['data']
-        is_live = len(stream_data) > 0  # Live if stream data exists
+    due_accounts = [u for u in watched if u not in TWITCH_ACCOUNT_CACHE]
+    if due_accounts:
+        try:
+            users = twitch_api.get_client().get_users(due_accounts)
+            for username in due_accounts:
+                exists = users.get(username.lower()) is not None
+                changed |= TWITCH_ACCOUNT_CACHE.get(username, True, stale=True) != exists
+                TWITCH_ACCOUNT_CACHE.set(username, exists)
+        except Exception as e:
+            logging.error(f"Error checking Twitch accounts {due_accounts}: {e}")
+            for username in due_accounts:
+                TWITCH_ACCOUNT_CACHE.set_negative(username, default=True)
+            return changed
 
-        # Cache the successful result
-        TWITCH_LIVE_CACHE[username] = (is_live, current_time)
+    due_live = [u for u in watched if TWITCH_ACCOUNT_CACHE.get(u, True, stale=True) and u not in TWITCH_LIVE_CACHE]
+    if due_live:
+        try:
+            streams = twitch_api.get_client().get_streams(due_live)
+            for username in due_live:
+                is_live = streams.get(username.lower()) is not None
+                changed |= TWITCH_LIVE_CACHE.get(username, False, stale=True) != is_live
+                TWITCH_LIVE_CACHE.set(username, is_live)
+        except Exception as e:
+            logging.error(f"Error checking Twitch channels {due_live}: {e}")
+            for username in due_live:
+                TWITCH_LIVE_CACHE.set_negative(username, default=False)
 
-        # Clear error backoff on success
-        if username in TWITCH_ERROR_BACKOFF:
-            del TWITCH_ERROR_BACKOFF[username]
+    return changed
 
-        return is_live
-    except Exception as e:
-        logging.error(f"Error checking Twitch channel {username}: {e}")
+def twitch_status_refresher():
+    """
+    Background worker that keeps the Twitch status of streamers on the server fresh, so building the serverstate
+    never has to wait on the Twitch API.
+    """
+    logging.info("Twitch status refresher started")
 
-        # Update error backoff
-        if username in TWITCH_ERROR_BACKOFF:
-            last_error_time, consecutive_errors = TWITCH_ERROR_BACKOFF[username]
-            TWITCH_ERROR_BACKOFF[username] = (current_time, consecutive_errors + 1)
-        else:
-            TWITCH_ERROR_BACKOFF[username] = (current_time, 1)
+    while True:
+        TWITCH_REFRESH_EVENT.wait(TWITCH_REFRESH_TICK)
+        TWITCH_REFRESH_EVENT.clear()
 
-        # Cache negative result for failed API calls to avoid spam
-        TWITCH_LIVE_CACHE[username] = (False, current_time)
-        return False
+        try:
+            if refresh_twitch_status() and STATE is not None:
+                STATE.touch()  # The state loop will publish the new live status on its next cycle
+        except Exception as e:
+            logging.error(f"Twitch status refresher failed: {e}")
 
 
 def send_auto_greeting():
@@ -740,10 +875,28 @@ class State:
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
     """
-    Class that stores data about the state of the server and players
+    Class that stores data about the state of the server and players.
+
+    Assigning a different value to one of the TRACKED_FIELDS (the fields published to the extension) advances
+    `version`, so consumers can detect changes by comparing versions instead of comparing the whole state.
     """
 
+    TRACKED_FIELDS = frozenset({
+        'players', 'current_player', 'current_player_id', 'bot_id', 'secret', 'num_players',
+        'mapname', 'df_promode', 'defrag_gametype', 'ip', 'hostname',
+    })
+
+    def __setattr__(self, key, value):
+        if key in State.TRACKED_FIELDS and tracked_value(getattr(self, key, None)) != tracked_value(value):
+            object.__setattr__(self, 'version', next(STATE_VERSIONS))
+        object.__setattr__(self, key, value)
+
+    def touch(self):
+        """Advance the version for changes that happen outside of the tracked fields"""
+        self.version = next(STATE_VERSIONS)
+
     def __init__(self, secret, server_info, players, bot_id):
+        self.version = next(STATE_VERSIONS)
         for key in server_info:
             setattr(self, key.replace('sv_', ''), server_info[key])
         self.players = players
@@ -800,7 +953,7 @@ class State:
                     logging.warning(f"BOT ID: Secret lookup failed, identified bot by name '{player.n}' (ID: {player.id})")
                     # Re-set color1 to secret so future lookups work
                     try:
-                        api.exec_command(f"seta color1 {self.secret}", verbose=False)
+                        api.exec_command(f"seta color1 {self.secret}", verbose=False, wait=True)
                         logging.info(f"BOT ID: Re-set color1 to secret after name fallback")
                     except Exception as e:
                         logging.error(f"BOT ID: Failed to re-set color1: {e}")
@@ -837,19 +990,8 @@ class State:
         # to confirm we're actually successfully spectating the player (not just set current_player_id)
 
         # Remove players with recent failed follow attempts (cooldown period)
-        global FAILED_FOLLOW_COOLDOWN
-        current_time = time.time()
-        players_to_remove = []
-        for player_id, fail_data in list(FAILED_FOLLOW_ATTEMPTS.items()):
-            fail_time = fail_data['timestamp']
-            # If cooldown has expired, allow retrying BUT KEEP the failure count
-            if current_time - fail_time > FAILED_FOLLOW_COOLDOWN:
-                # Don't delete - just don't exclude them from spec_ids
-                # The count will persist so next failure increments properly
-                pass
-            # If still in cooldown and player is in spec_ids, remove them temporarily
-            elif player_id in self.spec_ids:
-                players_to_remove.append(player_id)
+        # Once the cooldown has expired the entry goes stale, which allows retrying BUT KEEPS the failure count
+        players_to_remove = [pid for pid in self.spec_ids if pid in FAILED_FOLLOW_ATTEMPTS]
 
         if players_to_remove:
             [self.spec_ids.remove(pid) for pid in players_to_remove]
@@ -941,9 +1083,11 @@ class State:
         self.voter_names = []
         self.vy_count = 0
         self.vn_count = 0
+        SCHEDULER.schedule('vote_tally', self.handle_vote, delay=VOTE_TALLY_TIME)
 
     def handle_vote(self):
-        if time.time() - self.vote_time > VOTE_TALLY_TIME:
+        """Tally the f1/f2 votes, run by the state loop VOTE_TALLY_TIME seconds after the vote started"""
+        if self.vote_active:
             logging.info("Voting tally done.")
             if self.vn_count > self.vy_count:
                 api.exec_command(f"say ^3{self.vy_count} ^2f1 ^7vs. ^3{self.vn_count} ^1f2^7. Voting ^3f2^7.")
@@ -962,8 +1106,6 @@ class State:
             self.vy_count = 0
             self.vn_count = 0
             self.vote_active = False
-        else:
-            return
 
 
 class Player:
@@ -978,6 +1120,22 @@ class Player:
         self.nospec = self.c1 == 'nospec' or self.c1 == 'nospecpm'
         self.nopm = self.c1 == 'nospecpm'
 
+    # Fields a refresh has to change for State to count the player as changed. c2 carries the player's inputs
+    # and changes on nearly every report, it's left out so input flicker doesn't advance the state version.
+    TRACKED_FIELDS = ('id', 'n', 't', 'c1', 'dfn')
+
+    def tracked(self):
+        return tuple(getattr(self, key, None) for key in Player.TRACKED_FIELDS)
+
+
+def tracked_value(value):
+    """What State compares to tell whether a tracked field changed: players (or lists of them) by their tracked()"""
+    if isinstance(value, Player):
+        return value.tracked()
+    if isinstance(value, list):
+        return [tracked_value(item) for item in value]
+    return value
+
 
 def start():
     """
@@ -987,11 +1145,14 @@ def start():
     global STATE
     global PAUSE_STATE
     global VID_RESTARTING
+    global RESUME_DATA
 
     state_paused_timer = 0
+    corrupt_read_skipped = False
 
-    prev_state, prev_state_hash, curr_state = None, None, None
-    initialize_state()
+    prev_state, prev_state_version, curr_state = None, None, None
+    if not warm_start():
+        initialize_state()
     while True:
         try:
             if PAUSE_STATE:
@@ -1001,48 +1162,43 @@ def start():
 
             # Only refresh the STATE object if new data has been read and if state is not paused
             while not new_report_exists(config.INITIAL_REPORT_P) and not PAUSE_STATE:
-                time.sleep(2)
-
-                try:
-                    save_serverstate_to_file()
-                except Exception as e:
-                    logging.error(f"Error saving serverstate to file: {e}")
-
-                if not PAUSE_STATE:
-                    api.exec_command("varmath color2 = $chsinfo(152);"  # Store inputs in color2
-                                           "silent svinfo_report serverstate.txt", verbose=False)  # Write a new report
-                    # Wait 0.5s to ensure file is completely written before reading
-                    time.sleep(0.5)
-                elif not VID_RESTARTING:
-                    raise Exception("VidPaused")
-
-                if new_report_exists(config.STATE_REPORT_P):
+                # Wake up for scheduled tasks (follow-up commands, vote tally...) between two reports
+                report_due = CADENCE.wait(SCHEDULER.next_delay())
+                SCHEDULER.run_due()
+                if not report_due:
+                    continue
+
+                with SCHEDULER.iteration():
+                    if not PAUSE_STATE:
+                        api.exec_command("varmath color2 = $chsinfo(152);"  # Store inputs in color2
+                                               "silent svinfo_report serverstate.txt", verbose=False)  # Write a new report
+                        # Wait for the game to write the report instead of a fixed delay
+                        CADENCE.record_latency(wait_for_report(config.STATE_REPORT_P))
+                    elif not VID_RESTARTING:
+                        raise Exception("VidPaused")
+
+                    if not new_report_exists(config.STATE_REPORT_P):
+                        continue
+
                     # Given that a new report exists, read this new data.
                     server_info, players, num_players = get_svinfo_report(config.STATE_REPORT_P)
 
-                    # If get_svinfo_report returned None, wait and request a fresh report
+                    # If get_svinfo_report returned None, skip this cycle, the next one requests a fresh report
                     if not bool(server_info):
-                        logging.warning("get_svinfo_report returned None - waiting 2s and requesting fresh report")
-                        time.sleep(2)
-                        api.exec_command("silent svinfo_report serverstate.txt", verbose=False)
-                        time.sleep(1)
-                        server_info, players, num_players = get_svinfo_report(config.STATE_REPORT_P)
-                        if not bool(server_info):
-                            logging.error("get_svinfo_report failed again after retry - skipping this cycle")
-                            continue
+                        logging.warning("get_svinfo_report returned None - skipping this cycle")
+                        continue
 
-                    # Validate: if player count drops drastically, likely corrupt read - wait and retry
-                    if bool(server_info) and STATE is not None and num_players is not None:
+                    # Validate: if player count drops drastically, likely corrupt read - skip it and check the next report
+                    if STATE is not None and num_players is not None:
                         if STATE.num_players is not None and STATE.num_players > 5:
                             # If we had many players and suddenly only see half or less, likely corrupt read
-                            if num_players < (STATE.num_players * 0.5):  # More than 50% drop
-                                logging.warning(f"CORRUPT READ DETECTED: Player count dropped from {STATE.num_players} to {num_players}. Waiting 2s for next report...")
-                                time.sleep(2)
-                                # Request fresh report and read again
-                                api.exec_command("silent svinfo_report serverstate.txt", verbose=False)
-                                time.sleep(0.5)
-                                server_info, players, num_players = get_svinfo_report(config.STATE_REPORT_P)
+                            if num_players < (STATE.num_players * 0.5) and not corrupt_read_skipped:  # More than 50% drop
+                                logging.warning(f"CORRUPT READ DETECTED: Player count dropped from {STATE.num_players} to {num_players}. Waiting for the next report...")
+                                corrupt_read_skipped = True
+                                continue
+                            elif corrupt_read_skipped:
                                 logging.info(f"Re-read complete: now showing {num_players} players")
+                    corrupt_read_skipped = False
 
                     if STATE is None:
                         # STATE is None, reinitialize
@@ -1051,26 +1207,28 @@ def start():
                             logging.error("Failed to initialize state, will retry on next update cycle")
                             continue
 
-                    if bool(server_info) and STATE is not None:   # New data is not empty and valid. Update the state object.
+                    if STATE is not None:   # New data is not empty and valid. Update the state object.
+                        previous_map = STATE.mapname
                         STATE.players = players
                         STATE.update_info(server_info)
                         STATE.num_players = num_players
+                        bot_player = STATE.get_player_by_id(STATE.bot_id)
+                        servers.set_own_player(STATE.ip, bot_player.n if bot_player is not None else None)
+                        if STATE.mapname != previous_map:
+                            mapindex.clear_failure(STATE.mapname)  # We're in the map, so it loads fine now
                         validate_state()  # Check for nospec, self spec, afk, and any other problems.
-                        curr_state_hash = md5(f'{curr_state}_{num_players}_{str([pl.__dict__ for pl in STATE.players])}'.encode('utf-8')).digest()
+                        CADENCE.observe(STATE.version)
+                        RESUME_DATA = get_resume_data()
                         if STATE.current_player is not None and STATE.current_player_id != STATE.bot_id:
                             curr_state = f"Spectating {STATE.current_player.n} on {STATE.mapname}" \
                                          f" in server {STATE.hostname} | ip: {STATE.ip}"
-                        if curr_state_hash != prev_state_hash:
+                        if STATE.version != prev_state_version:
                             # Notify all websocket clients about new serverstate
                             notify_serverstate_change()
+                            request_state_save()
                         prev_state = curr_state
-                        prev_state_hash = curr_state_hash
+                        prev_state_version = STATE.version
                         display_player_name(STATE.current_player_id)
-                    else:
-                        # Data was invalid but STATE exists - just skip this update and try again next cycle
-                        logging.warning(f"Skipping serverstate update - server_info empty or invalid (server_info={bool(server_info)}, STATE={STATE is not None})")
-                if getattr(STATE, 'vote_active', False) and STATE is not None:
-                    STATE.handle_vote()
         except Exception as e:
             if e.args[0] == 'Paused':
                 global STATE_PAUSED_COUNTER, LAST_PAUSE_LOG_TIME
@@ -1092,15 +1250,18 @@ def start():
                 # state_paused_timer += 1
 
                 # if state_paused_timer > 60:
-                #     prev_state, prev_state_hash, curr_state = None, None, None
+                #     prev_state, prev_state_version, curr_state = None, None, None
                 #     initialize_state()
                 #     state_paused_timer = 0
                 #     PAUSE_STATE = False
                 # pass
+                # Resume as soon as the game has loaded instead of on the next poll
+                CONNECTION.wait_until_active(timeout=2)
+                continue
             elif e.args[0] == 'VidPaused':
                 logging.info("Vid paused.")
             else:
-                prev_state, prev_state_hash, curr_state = None, None, None
+                prev_state, prev_state_version, curr_state = None, None, None
                 initialize_state()  # Handle the first state fetch. Some extra processing needs to be done this time.
                 logging.info(f"State failed: {e}")
                 print(traceback.format_exc())
@@ -1108,6 +1269,152 @@ def start():
             time.sleep(2)
 
 
+class ReportCadence:
+    """
+    Decides how often the state loop asks the game for a new svinfo_report: fast for a short burst after a switch
+    or a connect (to confirm the follow and catch "Client X is not active" quickly) and when the AFK counter is
+    close to the timeout, slower once the state stopped changing.
+    """
+
+    def __init__(self):
+        self.interval = CADENCE_NORMAL
+        self.burst_until = 0
+        self.burst_reason = None
+        self.unchanged_cycles = 0
+        self.last_version = None
+        self.report_latency = None  # Moving average of the time the game takes to write a requested report
+        self.last_report_latency = None
+        self.missed_reports = 0
+        self.due_at = None  # Time the next report is due, set when waiting for it starts
+        self.wake = threading.Event()
+
+    def burst(self, reason, duration=CADENCE_BURST_TIME):
+        self.burst_until = max(self.burst_until, time.time() + duration)
+        self.burst_reason = reason
+        self.unchanged_cycles = 0
+        self.wake.set()
+
+    def observe(self, version):
+        """Called once per refreshed state with its version"""
+        if version == self.last_version:
+            self.unchanged_cycles += 1
+        else:
+            self.unchanged_cycles = 0
+        self.last_version = version
+
+    def record_latency(self, latency):
+        if latency is None:
+            self.missed_reports += 1
+            return
+
+        self.last_report_latency = latency
+        self.report_latency = latency if self.report_latency is None else 0.8 * self.report_latency + 0.2 * latency
+
+    def next_interval(self):
+        if time.time() < self.burst_until:
+            return CADENCE_FAST
+
+        if STATE is not None and STATE.current_player_id != STATE.bot_id:
+            afk_timeout = STATE.get_afk_timeout_for_player(STATE.current_player_id)
+            if STATE.afk_counter >= afk_timeout - CADENCE_AFK_MARGIN:
+                return CADENCE_FAST
+
+        if self.unchanged_cycles >= CADENCE_STABLE_CYCLES:
+            return CADENCE_SLOW
+
+        return CADENCE_NORMAL
+
+    def wait(self, max_wait=None):
+        """
+        Sleep until the next report is due, until a burst is requested or for at most `max_wait` seconds (to run
+        scheduled tasks in between). Returns True if a report is due.
+        """
+        if self.due_at is None:
+            interval = self.next_interval()
+            if interval != self.interval:
+                logging.debug(f"Report cadence: {self.interval}s -> {interval}s")
+            self.interval = interval
+            self.due_at = time.time() + interval
+
+        timeout = self.due_at - time.time()
+        if max_wait is not None:
+            timeout = min(timeout, max_wait)
+
+        if self.wake.wait(max(0, timeout)) or time.time() >= self.due_at:
+            self.wake.clear()
+            self.due_at = None
+            return True
+
+        return False
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'burst': time.time() < self.burst_until,
+            'burst_reason': self.burst_reason,
+            'unchanged_cycles': self.unchanged_cycles,
+            'report_latency': self.report_latency,
+            'last_report_latency': self.last_report_latency,
+            'missed_reports': self.missed_reports,
+        }
+
+
+CADENCE = ReportCadence()
+
+
+def get_sampled_player():
+    """Id of the player whose inputs should be sampled, None when the bot isn't spectating anyone"""
+    if STATE is None or PAUSE_STATE or CONNECTING or STATE.current_player_id == STATE.bot_id:
+        return None
+    return STATE.current_player_id
+
+
+def wait_for_report(path, timeout=REPORT_TIMEOUT):
+    """
+    Wait until the game has written a report newer than the last one read, without consuming it
+    (see new_report_exists). Returns the time it took, or None if no report showed up in time.
+    """
+    start = time.time()
+    last_report_ts = LAST_INIT_REPORT_TIME if path == config.INITIAL_REPORT_P else LAST_REPORT_TIME
+
+    while time.time() - start < timeout:
+        try:
+            if os.path.getmtime(path) > last_report_ts:
+                latency = time.time() - start
+                time.sleep(REPORT_SETTLE_TIME)
+                return latency
+        except OSError:
+            pass
+        time.sleep(REPORT_POLL_STEP)
+
+    return None
+
+
+def elapsed_strikes(key):
+    """
+    Returns how many strikes (STRIKE_INTERVAL seconds each) elapsed since the last call for `key`, so strike based
+    timeouts don't depend on how often the state is refreshed. A call after a long gap counts as a single strike.
+    """
+    now = time.time()
+    last_check, carry = STRIKE_CLOCKS.get(key, (None, 0))
+
+    if last_check is None or now - last_check > CADENCE_SLOW + STRIKE_INTERVAL:
+        elapsed = STRIKE_INTERVAL
+        carry = 0
+    else:
+        elapsed = now - last_check
+
+    total = carry + elapsed
+    strikes = int(total // STRIKE_INTERVAL)
+    STRIKE_CLOCKS[key] = (now, total - strikes * STRIKE_INTERVAL)
+
+    return strikes
+
+
+def reset_strikes(key):
+    STRIKE_CLOCKS.pop(key, None)
+
+
 def initialize_state(force=False):
     """
     Handles necessary processing on the first iteration of state retrieval.
@@ -1118,7 +1425,6 @@ def initialize_state(force=False):
     global STATE
     global PAUSE_STATE
     global INIT_TIMEOUT
-    global STATE_INITIALIZED
     global LAST_TIME
     global AFK_COUNTDOWN_ACTIVE
     global AFK_HELP_THREADS
@@ -1140,7 +1446,7 @@ def initialize_state(force=False):
             init_counter += 1
             if not PAUSE_STATE:
                 # Set color1 to secret code to determine bot's client id
-                api.exec_command(f"seta color1 {secret};silent svinfo_report serverstate.txt", verbose=False)
+                api.exec_command(f"seta color1 {secret};silent svinfo_report serverstate.txt", verbose=False, wait=True)
             else:
                 raise Exception("Paused.")
 
@@ -1163,52 +1469,62 @@ def initialize_state(force=False):
         STATE.current_player_id = bot_id
         STATE.current_player = STATE.get_player_by_id(bot_id)  # Ensure current_player is set
         STATE.num_players = num_players
-        STATE_INITIALIZED = True
+        mapindex.clear_failure(STATE.mapname)  # We're in the map, so it loads fine now
+        CONNECTION.set_initialized("state initialized")
         logging.info("State Initialized.")
+        CADENCE.burst("connect")
 
         # Force bot to spectator mode to prevent joining as player
         logging.info(f"TEAM DEBUG: Bot current team before 'team s': {STATE.get_player_by_id(bot_id).t if STATE.get_player_by_id(bot_id) else 'Unknown'}")
         api.exec_command("team s")
         logging.info("Bot forced to spectator mode after initialization")
-        time.sleep(3)
+        # Check if team switch was successful once the state loop has refreshed the team info
+        SCHEDULER.schedule('team_verify', verify_bot_team, True, delay=TEAM_VERIFY_DELAY)
 
-        # Check if team switch was successful
-        # Refresh state to get updated team info
-        api.exec_command("svinfo_report serverstate.txt", verbose=False)
-        time.sleep(1)
-        if new_report_exists(config.STATE_REPORT_P):
-            _, updated_players, _ = get_svinfo_report(config.STATE_REPORT_P)
-            updated_bot = [player for player in updated_players if player.id == bot_id]
-            if updated_bot:
-                logging.info(f"TEAM DEBUG: Bot team after 'team s': {updated_bot[0].t}")
-                if updated_bot[0].t != '3':
-                    logging.warning(f"TEAM DEBUG: 'team s' failed! Bot still on team {updated_bot[0].t}, retrying...")
-                    api.exec_command("team s")
-                    time.sleep(2)
-                else:
-                    logging.info("TEAM DEBUG: Bot successfully switched to spectator mode (team 3)")
-            else:
-                logging.warning("TEAM DEBUG: Could not find bot in updated player list after team switch")
-
-        # Handle nospec notifications
+        # Handle nospec notifications, the tells are paced by the chat rate limit in api
+        tells = []
         for nospecid in (STATE.nospec_ids or []):
             if nospecid in STATE.nopmids:
                 # Send one-time message to nospecpm players
-                api.exec_command('tell ' + str(nospecid) + ' ^7nospec active, ^3defraglive ^7cant spectate.')
-                time.sleep(2)
+                tells.append((nospecid, '^7nospec active, ^3defraglive ^7cant spectate.'))
                 continue
-            api.exec_command('tell ' + str(nospecid) + ' Detected nospec, to disable this feature write /color1 spec')
-            time.sleep(2)
-            api.exec_command('tell ' + str(nospecid) + ' To disable private notifications about nospec, set /color1 nospecpm')        
+            tells.append((nospecid, 'Detected nospec, to disable this feature write /color1 spec'))
+            tells.append((nospecid, 'To disable private notifications about nospec, set /color1 nospecpm'))
+
+        for nospecid, message in tells:
+            api.exec_command(f'tell {nospecid} {message}')
     except Exception as e:
         logging.error(f"State initialization failed: {e}")
         return False
 
     return True
 
+def verify_bot_team(retry=False):
+    """Scheduled after a 'team s': check that the bot ended up in spectator mode (team 3), retrying once if `retry`"""
+    if STATE is None:
+        return
+
+    bot_player = STATE.get_player_by_id(STATE.bot_id)
+    if bot_player is None:
+        logging.warning("TEAM DEBUG: Could not find bot in updated player list after team switch")
+        return
+
+    logging.info(f"TEAM DEBUG: Bot team after 'team s': {bot_player.t}")
+    if bot_player.t == '3':
+        logging.info("TEAM DEBUG: Bot successfully switched to spectator mode (team 3)")
+    elif retry:
+        logging.warning(f"TEAM DEBUG: 'team s' failed! Bot still on team {bot_player.t}, retrying...")
+        api.exec_command("team s")
+        CADENCE.burst("team")
+        SCHEDULER.schedule('team_verify', verify_bot_team, False, delay=TEAM_VERIFY_DELAY)
+    else:
+        logging.error(f"TEAM DEBUG: CRITICAL - Bot still on team {bot_player.t} after retry!")
+
+
 def standby_mode_started():
     global RECONNECTED_CHECK
     logging.info("[Note] Goin on standby mode.")
+    CONNECTION.transition(connection.STANDBY, "no active servers")
 
     # Reset to bot when entering standby - but wait for new state to be initialized
     # Reset to bot when entering standby
@@ -1290,7 +1606,6 @@ def validate_state():
     global STATE
     global PAUSE_STATE
     global IGNORE_IPS
-    global RECONNECTED_CHECK
     global AFK_COUNTDOWN_ACTIVE
     global AFK_HELP_THREADS
     global FAILED_FOLLOW_ATTEMPTS
@@ -1435,11 +1750,14 @@ def validate_state():
 
     # Clear failure count for player we're successfully spectating
     # Only clear if NOT spectating_self (meaning we're actually on a real player, not stuck on bot)
-    if not spectating_self and STATE.current_player_id != STATE.bot_id and STATE.current_player_id in FAILED_FOLLOW_ATTEMPTS:
+    if not spectating_self and STATE.current_player_id != STATE.bot_id and FAILED_FOLLOW_ATTEMPTS.failures(STATE.current_player_id):
         # We're successfully spectating this player (follow succeeded), clear their failure history
-        del FAILED_FOLLOW_ATTEMPTS[STATE.current_player_id]
+        FAILED_FOLLOW_ATTEMPTS.pop(STATE.current_player_id)
         logging.info(f"Successfully spectating player {STATE.current_player_id} - cleared failure count")
 
+    if not spectating_self and STATE.current_player_id != STATE.bot_id and metrics.is_open('first_follow'):
+        metrics.end_span('first_follow', reason=f"following {STATE.current_player_id}")
+
     # AFK player pre-processing
     if spectating_afk:
         try:
@@ -1517,6 +1835,7 @@ def validate_state():
             display_player_name(follow_id)
             logging.info(f"SWITCH DEBUG: Executing 'follow {follow_id}' command")
             api.exec_command(f"follow {follow_id}")
+            CADENCE.burst("switch")
             STATE.current_player_id = int(follow_id)
             STATE.current_player = STATE.get_player_by_id(int(follow_id))
             STATE.idle_counter = 0  # Reset idle strike flag since a followable non-bot id was found.
@@ -1544,24 +1863,27 @@ def validate_state():
                 if should_log_switch:
                     logging.info(f"SWITCH DEBUG: No valid targets, switching to free spec mode using ID {target_id}")
                 api.exec_command(f"follow {target_id}")
+                CADENCE.burst("switch")
                 STATE.current_player_id = STATE.bot_id
             else:  # Was already spectating self. This is an idle strike
-                STATE.idle_counter += 1
-
-                # DEBUG: Add comprehensive logging for why we're not spectating anyone
-                logging.info(f"IDLE DEBUG: No spectatable players found - reason analysis:")
-                logging.info(f"IDLE DEBUG: Total players on server: {len(STATE.players)}")
-                logging.info(f"IDLE DEBUG: Spectatable players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.spec_ids]}")
-                logging.info(f"IDLE DEBUG: NoSpec players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.nospec_ids]}")
-                logging.info(f"IDLE DEBUG: AFK players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.afk_ids]}")
-                logging.info(f"IDLE DEBUG: Free spectators: {[(p.n, p.id) for p in STATE.players if p.t == '3']}")
-                logging.info(f"IDLE DEBUG: Bot ID: {STATE.bot_id}, Current player ID: {STATE.current_player_id}")
-
-                logging.info(f"Not spectating. Strike {STATE.idle_counter}/{IDLE_TIMEOUT}")
-                if not PAUSE_STATE:
-                    api.display_message(f"^3Strike {STATE.idle_counter}/{IDLE_TIMEOUT}", time=1)
-
-            if STATE.idle_counter >= IDLE_TIMEOUT or spectating_afk:
+                idle_strikes = elapsed_strikes('idle')
+                STATE.idle_counter += idle_strikes
+
+                if idle_strikes:
+                    # DEBUG: Add comprehensive logging for why we're not spectating anyone
+                    logging.info(f"IDLE DEBUG: No spectatable players found - reason analysis:")
+                    logging.info(f"IDLE DEBUG: Total players on server: {len(STATE.players)}")
+                    logging.info(f"IDLE DEBUG: Spectatable players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.spec_ids]}")
+                    logging.info(f"IDLE DEBUG: NoSpec players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.nospec_ids]}")
+                    logging.info(f"IDLE DEBUG: AFK players: {[(STATE.get_player_by_id(pid).n if STATE.get_player_by_id(pid) else 'Unknown', pid) for pid in STATE.afk_ids]}")
+                    logging.info(f"IDLE DEBUG: Free spectators: {[(p.n, p.id) for p in STATE.players if p.t == '3']}")
+                    logging.info(f"IDLE DEBUG: Bot ID: {STATE.bot_id}, Current player ID: {STATE.current_player_id}")
+
+                    logging.info(f"Not spectating. Strike {STATE.idle_counter}/{IDLE_TIMEOUT}")
+                    if not PAUSE_STATE:
+                        api.display_message(f"^3Strike {STATE.idle_counter}/{IDLE_TIMEOUT}", time=1)
+
+            if (STATE.idle_counter >= IDLE_TIMEOUT or spectating_afk) and not SCHEDULER.pending('leave_server'):
                 # There's been no one on the server for a while or only afks. Switch servers.
                 # Build detailed farewell message explaining why bot is leaving
                 farewell_parts = []
@@ -1582,21 +1904,21 @@ def validate_state():
                     farewell_parts.append(f"^1Spectating: ^7{', '.join(free_specs)}")
 
                 # Build final message - if message gets too long, split into multiple says
+                farewell = []  # Futures of the messages, the switch waits for them
                 if farewell_parts:
                     reason_msg = " | ".join(farewell_parts)
                     # Quake 3 say command has ~150 character limit, so split if needed
                     if len(reason_msg) > 120:
                         # Send reason details first
-                        api.exec_command(f"say {reason_msg}")
-                        time.sleep(0.5)
-                        api.exec_command("say ^3Switching servers. Farewell.")
+                        farewell.append(api.exec_command(f"say {reason_msg}"))
+                        farewell.append(api.exec_command("say ^3Switching servers. Farewell."))
                     else:
-                        api.exec_command(f"say {reason_msg} ^3- Farewell.")
+                        farewell.append(api.exec_command(f"say {reason_msg} ^3- Farewell."))
                 elif len(STATE.players) <= 1:  # Only bot left
-                    api.exec_command("say ^7No active players remaining. ^3Farewell.")
+                    farewell.append(api.exec_command("say ^7No active players remaining. ^3Farewell."))
                 else:
                     # Fallback (shouldn't happen, but just in case)
-                    api.exec_command("say ^7No spectatable players available. ^3Farewell.")
+                    farewell.append(api.exec_command("say ^7No spectatable players available. ^3Farewell."))
 
                 # DETAILED DEBUG: Print complete server state before leaving
                 logging.info("=" * 80)
@@ -1636,21 +1958,8 @@ def validate_state():
                 logging.info(f"Bot ID: {STATE.bot_id}")
                 logging.info("=" * 80)
 
-                # Wait 2 seconds before searching for new server and connecting
-                time.sleep(2)
-
-                IGNORE_IPS.append(STATE.ip) if STATE.ip not in IGNORE_IPS and STATE.ip != "" else None
-                new_ip = servers.get_next_active_server(IGNORE_IPS)
-                logging.info(f"Next active server found: {new_ip}")
-
-                if bool(new_ip):
-                    enhanced_connect(new_ip)
-                    return
-                else:  # No ip left to connect to, go on standby mode.
-                    api.exec_command("map st1")
-                    IGNORE_IPS = []
-                    RECONNECTED_CHECK = False
-                    standby_mode_started()
+                # Wait 2 seconds (and for the farewell to be sent) before searching for new server and connecting
+                SCHEDULER.schedule('leave_server', leave_server, farewell, time.time(), delay=LEAVE_DELAY)
 
         STATE.current_player = STATE.get_player_by_id(STATE.current_player_id)
 
@@ -1675,43 +1984,50 @@ def validate_state():
             should_log_afk = True
 
         inputs = STATE.get_inputs()
+        # The report's sample goes into the same history as the input sampler's, AFK is decided on the time since
+        # the player last pressed anything rather than on this single sample
+        input_history.record(inputs, STATE.current_player_id)
+        idle_time = input_history.idle_seconds(STATE.current_player_id)
 
         # Only log when AFK counter changes (increment/reset) or thresholds are hit
         previous_afk = LAST_AFK_SNAPSHOT[1] if LAST_AFK_SNAPSHOT is not None else None
 
-        if inputs == '':
-            # Empty key presses. This is an AFK strike.
-            STATE.afk_counter += 1
-            # Log only when the counter actually changed
-            if previous_afk is None or STATE.afk_counter != previous_afk:
-                # Only show increment logs for multiples of 5 to reduce noise
-                if STATE.afk_counter % 5 == 0:
-                    logging.info(f"AFK DEBUG: No inputs detected, incremented counter to {STATE.afk_counter}")
+        if idle_time is not None and idle_time >= STRIKE_INTERVAL:
+            # No key presses for a whole strike. This is an AFK strike.
+            # Strikes are counted per elapsed STRIKE_INTERVAL, so the timeout doesn't shrink when polling faster
+            for _ in range(elapsed_strikes('afk')):
+                STATE.afk_counter += 1
+                # Log only when the counter actually changed
+                if previous_afk is None or STATE.afk_counter != previous_afk:
+                    # Only show increment logs for multiples of 5 to reduce noise
+                    if STATE.afk_counter % 5 == 0:
+                        logging.info(f"AFK DEBUG: No inputs detected, incremented counter to {STATE.afk_counter}")
             
-            # Show notifications starting from strike 10, then every 5 strikes: 10, 15, 20, 25, 30...
-            if STATE.afk_counter >= 10 and (STATE.afk_counter - 10) % 5 == 0:  # Every 5 strikes after 10: 10, 15, 20, 25, 30...
-                remaining_time = (current_afk_timeout - STATE.afk_counter) * 2
-                if remaining_time > 0:
-                    logging.info(f"AFK detected. Strike {STATE.afk_counter}/{current_afk_timeout}")
+                # Show notifications starting from strike 10, then every 5 strikes: 10, 15, 20, 25, 30...
+                if STATE.afk_counter >= 10 and (STATE.afk_counter - 10) % 5 == 0:  # Every 5 strikes after 10: 10, 15, 20, 25, 30...
+                    remaining_time = (current_afk_timeout - STATE.afk_counter) * 2
+                    if remaining_time > 0:
+                        logging.info(f"AFK detected. Strike {STATE.afk_counter}/{current_afk_timeout}")
                     
-                    # Send both in-game and Twitch chat notification
-                    player_name = STATE.current_player.n if STATE.current_player else "Unknown"
-                    api.display_message(f" AFK detected. Switching in {remaining_time} seconds.", time=5)
+                        # Send both in-game and Twitch chat notification
+                        player_name = STATE.current_player.n if STATE.current_player else "Unknown"
+                        api.display_message(f" AFK detected. Switching in {remaining_time} seconds.", time=5)
                     
-                    # Also send to Twitch chat through the chat bridge system
-                    try:
-                        import console
-                        import json
-                        afk_msg = {
-                            'action': 'afk_notification',
-                            'message': f"AFK detected for {player_name}: {STATE.afk_counter}/{current_afk_timeout} strikes - switching in ~{remaining_time}s"
-                        }
-                        console.WS_Q.put(json.dumps(afk_msg))
-                    except Exception as e:
-                        logging.error(f"Failed to send AFK notification to Twitch: {e}")
+                        # Also send to Twitch chat through the chat bridge system
+                        try:
+                            import console
+                            import json
+                            afk_msg = {
+                                'action': 'afk_notification',
+                                'message': f"AFK detected for {player_name}: {STATE.afk_counter}/{current_afk_timeout} strikes - switching in ~{remaining_time}s"
+                            }
+                            console.WS_Q.put(json.dumps(afk_msg))
+                        except Exception as e:
+                            logging.error(f"Failed to send AFK notification to Twitch: {e}")
 
         else:
             # Activity detected, reset AFK strike counter for current player only
+            reset_strikes('afk')
             if STATE.afk_counter != 0:
                 # Only log on counter reset
                 if STATE.afk_counter >= 15:
@@ -1739,6 +2055,36 @@ def validate_state():
         # Save snapshot after processing so subsequent ticks can be compared
         LAST_AFK_SNAPSHOT = current_afk_snapshot
 
+def leave_server(farewell=(), since=None):
+    """
+    Scheduled after the farewell message: connect to the next active server, or go on standby if there is none.
+    Waits until the `farewell` futures are resolved (at most FAREWELL_TIMEOUT seconds after `since`): the connect
+    would drop the chat still waiting for the rate limit.
+    """
+    global IGNORE_IPS
+    global RECONNECTED_CHECK
+
+    if STATE is None or PAUSE_STATE or CONNECTING:
+        logging.info("Server switch cancelled, a connection is already in progress")
+        return
+
+    if not all(future.done() for future in farewell) and time.time() - (since or 0) < FAREWELL_TIMEOUT:
+        SCHEDULER.schedule('leave_server', leave_server, farewell, since, delay=0.5)
+        return
+
+    IGNORE_IPS.append(STATE.ip) if STATE.ip not in IGNORE_IPS and STATE.ip != "" else None
+    new_ip = servers.get_next_active_server(IGNORE_IPS)
+    logging.info(f"Next active server found: {new_ip}")
+
+    if bool(new_ip):
+        enhanced_connect(new_ip)
+    else:  # No ip left to connect to, go on standby mode.
+        api.exec_command("map st1")
+        IGNORE_IPS = []
+        RECONNECTED_CHECK = False
+        standby_mode_started()
+
+
 def switch_to_player(follow_id):
     """Helper function to handle player switching and timeout cleanup"""
     old_player_id = STATE.current_player_id
@@ -1756,9 +2102,6 @@ def connect(ip, caller=None):
     """
     Handles connection to a server and re-attempts if connection is not resolved.
     """
-    global PAUSE_STATE
-    global STATE_INITIALIZED
-    global CONNECTING
     global IGNORE_IPS
     global CURRENT_IP
     global RECONNECTED_CHECK
@@ -1783,10 +2126,8 @@ def connect(ip, caller=None):
     # Check if this is a NEW server connection or reconnection to same server
     is_new_server = (CURRENT_IP != ip)
 
-    STATE_INITIALIZED = False
     logging.info(f"Connecting to {ip}...")
-    PAUSE_STATE = True
-    CONNECTING = True
+    CONNECTION.transition(connection.CONNECTING, f"connect by {caller}" if caller else "connect", target=ip)
     
     if STATE:  # Check if STATE exists before accessing it
         STATE.idle_counter = 0
@@ -1801,6 +2142,7 @@ def connect(ip, caller=None):
 
     RECONNECTED_CHECK = True
     CURRENT_IP = ip
+    servers.record_visit(ip)
 
     # Store whether this should trigger a greeting (only for new servers)
     if is_new_server:
@@ -1815,14 +2157,13 @@ def attempt_state_resume():
     Try to resume normal state without reconnecting
     This checks if the connection actually worked but we just got stuck
     """
-    global PAUSE_STATE, CONNECTING, CONNECTION_START_TIME
     global STATE_PAUSED_COUNTER, LAST_PAUSE_LOG_TIME
     
     try:
         logging.info("Attempting to resume normal state...")
         
         # Try to get fresh server info to see if we're actually connected
-        api.exec_command("team s;svinfo_report serverstate.txt;svinfo_report initialstate.txt")
+        api.exec_command("team s;svinfo_report serverstate.txt;svinfo_report initialstate.txt", wait=True)
         
         # Wait a moment for reports to generate
         time.sleep(2)
@@ -1835,11 +2176,9 @@ def attempt_state_resume():
                 logging.info("State resume successful - connection was actually working!")
 
                 # Resume normal operation
-                PAUSE_STATE = False
+                CONNECTION.transition(connection.INITIALIZING, "state resume")
                 STATE_PAUSED_COUNTER = 0
                 LAST_PAUSE_LOG_TIME = 0
-                CONNECTING = False
-                CONNECTION_START_TIME = None
                 
                 # Reinitialize state properly
                 initialize_state(True)
@@ -1863,8 +2202,7 @@ def smart_connection_recovery(reason="Unknown"):
     5. Fifth attempt: Try different server  
     6+. Final fallback: Standby mode
     """
-    global RECOVERY_IN_PROGRESS, RECOVERY_ATTEMPTS, LAST_RECOVERY_TIME
-    global PAUSE_STATE, CONNECTING, CONNECTION_START_TIME
+    global RECOVERY_ATTEMPTS, LAST_RECOVERY_TIME, IGNORE_IPS
     
     current_time = time.time()
     
@@ -1872,9 +2210,7 @@ def smart_connection_recovery(reason="Unknown"):
     if RECOVERY_IN_PROGRESS and current_time - LAST_RECOVERY_TIME > 120:
         logging.error(f"RECOVERY DEADLOCK: Recovery stuck for 120s, forcing full reset. Reason: {reason}")
         reset_recovery_state()
-        PAUSE_STATE = False
-        CONNECTING = False
-        CONNECTION_START_TIME = None
+        CONNECTION.transition(connection.STANDBY, "recovery deadlock")
         api.exec_command("map st1")
         import threading
         standby_thread = threading.Thread(target=standby_mode_started, daemon=True)
@@ -1910,9 +2246,9 @@ def smart_connection_recovery(reason="Unknown"):
     is_access_violation = "ACCESS_VIOLATION" in reason
     max_attempts = 6 if is_access_violation else MAX_RECOVERY_ATTEMPTS
     
-    RECOVERY_IN_PROGRESS = True
     LAST_RECOVERY_TIME = current_time
     RECOVERY_ATTEMPTS += 1
+    CONNECTION.begin_recovery(f"attempt {RECOVERY_ATTEMPTS}: {reason}")
     
     # ADD ENHANCED LOGGING HERE
     logging.error(f"RECOVERY START: Attempt #{RECOVERY_ATTEMPTS}, Reason: {reason}")
@@ -1925,6 +2261,7 @@ def smart_connection_recovery(reason="Unknown"):
         if RECOVERY_ATTEMPTS == 1:
             # First attempt: Try to resume normal state
             logging.error("RECOVERY ATTEMPT 1: Trying state resume")
+            metrics.start_recovery_attempt('resume', CURRENT_IP, reason)
             if attempt_state_resume():
                 return  # Success, exit recovery
             
@@ -1932,15 +2269,14 @@ def smart_connection_recovery(reason="Unknown"):
             # Attempts 2-5 for ACCESS_VIOLATION, 2-4 for other crashes: Reconnect to same server 
             logging.error(f"RECOVERY ATTEMPT {RECOVERY_ATTEMPTS}: Reconnecting to same server")
             if CURRENT_IP:
+                metrics.start_recovery_attempt('reconnect', CURRENT_IP, reason)
                 # Reset connection state - be more aggressive about cleanup
-                PAUSE_STATE = True
-                CONNECTING = True
-                CONNECTION_START_TIME = time.time()
+                CONNECTION.transition(connection.CONNECTING, f"recovery attempt {RECOVERY_ATTEMPTS}", target=CURRENT_IP)
                 
                 # More robust reconnect - disconnect first, then reconnect
-                api.exec_command("disconnect", verbose=False)
+                api.exec_command("disconnect", verbose=False, wait=True)
                 time.sleep(3)  # 3 second delay between disconnect and reconnect
-                api.exec_command("connect " + CURRENT_IP, verbose=False)
+                api.exec_command("connect " + CURRENT_IP, verbose=False, wait=True)
                 start_connection_monitor()
             else:
                 # No current IP, skip to different server attempt
@@ -1951,6 +2287,7 @@ def smart_connection_recovery(reason="Unknown"):
         elif RECOVERY_ATTEMPTS == (6 if is_access_violation else 5):
             # Try different server (attempt 6 for ACCESS_VIOLATION, attempt 5 for others)
             logging.error(f"RECOVERY ATTEMPT {RECOVERY_ATTEMPTS}: Trying different server")
+            metrics.start_recovery_attempt('other_server', CURRENT_IP, reason)
             if CURRENT_IP:
                 IGNORE_IPS.append(CURRENT_IP)
             
@@ -1970,10 +2307,8 @@ def smart_connection_recovery(reason="Unknown"):
             logging.error("RECOVERY ATTEMPT 6+: Entering standby mode")
             reset_recovery_state()
             IGNORE_IPS = []
-            PAUSE_STATE = False
-            CONNECTING = False
-            CONNECTION_START_TIME = None
-            api.exec_command("map st1")  # Load local map
+            CONNECTION.transition(connection.STANDBY, "recovery attempts exhausted")
+            api.exec_command("map st1", wait=True)  # Load local map
             standby_mode_started()
             return
             
@@ -1985,27 +2320,25 @@ def smart_connection_recovery(reason="Unknown"):
         logging.critical(f"RECOVERY EXCEPTION: Error during attempt {RECOVERY_ATTEMPTS}: {e}")
         # Force standby on any exception
         reset_recovery_state()
-        PAUSE_STATE = False
+        CONNECTION.transition(connection.STANDBY, "recovery failed")
         api.exec_command("map st1")
 
 def check_recovery_deadlock():
     """Check if recovery system is deadlocked and force reset if needed"""
-    global RECOVERY_IN_PROGRESS, LAST_RECOVERY_TIME, PAUSE_STATE
-    
     if RECOVERY_IN_PROGRESS:
         stuck_time = time.time() - LAST_RECOVERY_TIME
         if stuck_time > 150:  # 2.5 minutes absolute deadlock protection
             logging.critical(f"RECOVERY DEADLOCK DETECTED: Stuck for {stuck_time:.0f}s - forcing emergency reset")
             reset_recovery_state()
-            PAUSE_STATE = False
+            CONNECTION.transition(connection.STANDBY, "recovery deadlock")
             api.exec_command("map st1")
             return True
     return False
 
 def reset_recovery_state():
     """Reset recovery tracking variables"""
-    global RECOVERY_IN_PROGRESS, RECOVERY_ATTEMPTS, RECOVERY_TIMEOUT_ACTIVE
-    RECOVERY_IN_PROGRESS = False
+    global RECOVERY_ATTEMPTS, RECOVERY_TIMEOUT_ACTIVE
+    CONNECTION.end_recovery("recovery reset")
     RECOVERY_ATTEMPTS = 0
     RECOVERY_TIMEOUT_ACTIVE = False
     logging.info("Recovery state reset")
@@ -2022,11 +2355,11 @@ def start_recovery_timeout():
     RECOVERY_TIMEOUT_ACTIVE = True
     
     def recovery_timeout_worker():
-        import time
-        time.sleep(60)  # Give each recovery attempt 60 seconds
-        
-        global RECOVERY_IN_PROGRESS, RECOVERY_ATTEMPTS, PAUSE_STATE, CONNECTING, RECOVERY_TIMEOUT_ACTIVE
-        
+        # Give each recovery attempt 60 seconds, returns early when the recovery completes
+        CONNECTION.wait_for(lambda c: not c.recovering, timeout=60)
+
+        global RECOVERY_ATTEMPTS, RECOVERY_TIMEOUT_ACTIVE
+
         if RECOVERY_IN_PROGRESS:
             logging.error(f"RECOVERY TIMEOUT: Attempt {RECOVERY_ATTEMPTS} stuck for 60s, forcing progression")
             
@@ -2034,8 +2367,7 @@ def start_recovery_timeout():
             if RECOVERY_ATTEMPTS >= MAX_RECOVERY_ATTEMPTS:
                 logging.error("RECOVERY TIMEOUT: Max attempts reached, forcing standby")
                 reset_recovery_state()
-                PAUSE_STATE = False
-                CONNECTING = False
+                CONNECTION.transition(connection.STANDBY, "recovery timeout")
                 api.exec_command("map st1")
                 import threading
                 standby_thread = threading.Thread(target=standby_mode_started, daemon=True)
@@ -2050,9 +2382,8 @@ def start_recovery_timeout():
                     # Attempt 2: Reconnect to same server
                     logging.error("TIMEOUT RECOVERY: Attempt 2 - Reconnecting to same server")
                     if CURRENT_IP:
-                        PAUSE_STATE = True
-                        CONNECTING = True
-                        CONNECTION_START_TIME = time.time()
+                        metrics.start_recovery_attempt('reconnect', CURRENT_IP, "recovery timeout")
+                        CONNECTION.transition(connection.CONNECTING, "recovery timeout reconnect", target=CURRENT_IP)
                         api.exec_command("reconnect", verbose=False)
                         start_connection_monitor()
                         # DON'T call start_recovery_timeout() here - would create infinite timeout threads
@@ -2063,6 +2394,7 @@ def start_recovery_timeout():
                 elif RECOVERY_ATTEMPTS == 3:
                     # Attempt 3: Try different server
                     logging.error("TIMEOUT RECOVERY: Attempt 3 - Trying different server")
+                    metrics.start_recovery_attempt('other_server', CURRENT_IP, "recovery timeout")
                     if CURRENT_IP:
                         IGNORE_IPS.append(CURRENT_IP)
                     
@@ -2075,8 +2407,7 @@ def start_recovery_timeout():
                         # No other servers, go to standby
                         logging.error("TIMEOUT RECOVERY: No other servers, forcing standby")
                         reset_recovery_state()
-                        PAUSE_STATE = False
-                        CONNECTING = False
+                        CONNECTION.transition(connection.STANDBY, "recovery timeout")
                         api.exec_command("map st1")
                         import threading
                         standby_thread = threading.Thread(target=standby_mode_started, daemon=True)
@@ -2085,8 +2416,7 @@ def start_recovery_timeout():
                     # Attempt 4+: Force standby
                     logging.error("TIMEOUT RECOVERY: Max attempts exceeded, forcing standby")
                     reset_recovery_state()
-                    PAUSE_STATE = False
-                    CONNECTING = False
+                    CONNECTION.transition(connection.STANDBY, "recovery timeout")
                     api.exec_command("map st1")
                     import threading
                     standby_thread = threading.Thread(target=standby_mode_started, daemon=True)
@@ -2100,9 +2430,9 @@ def start_recovery_timeout():
 
 def enhanced_connect(ip, caller=None):
     """Enhanced connect function with better timeout handling"""
-    global PAUSE_STATE, CONNECTING, CONNECTION_START_TIME, CURRENT_IP
-    global AFK_COUNTDOWN_ACTIVE, AFK_HELP_THREADS, RECOVERY_IN_PROGRESS
-    global STATE_INITIALIZED, RECONNECTED_CHECK
+    global CURRENT_IP, IGNORE_IPS
+    global AFK_COUNTDOWN_ACTIVE, AFK_HELP_THREADS
+    global RECONNECTED_CHECK
     global PERMANENTLY_EXCLUDED, FAILED_FOLLOW_ATTEMPTS
 
     # Reset console connection guard so new connection detection isn't blocked
@@ -2118,14 +2448,13 @@ def enhanced_connect(ip, caller=None):
         PERMANENTLY_EXCLUDED.clear()
         FAILED_FOLLOW_ATTEMPTS.clear()
 
-    # Record connection start time - BUT don't reset if we're already connecting to same server
-    # This prevents timeout bypass when user spam-reconnects to same hung server
-    if CONNECTION_START_TIME is None or ip != CURRENT_IP or not (PAUSE_STATE or CONNECTING):
-        CONNECTION_START_TIME = time.time()
-        logging.info(f"Connection timer started for {ip}")
-    else:
-        elapsed = time.time() - CONNECTION_START_TIME
+    # The connection start time is NOT reset if we're already connecting to same server (see
+    # ConnectionState.transition). This prevents timeout bypass when user spam-reconnects to same hung server
+    if CONNECTION.connecting and CONNECTION.target == ip:
+        elapsed = CONNECTION.time_in_phase()
         logging.warning(f"Reconnecting to same server while already stuck - keeping original timer (elapsed: {elapsed:.0f}s)")
+    else:
+        logging.info(f"Connection timer started for {ip}")
     
     # Cancel any AFK operations
     AFK_COUNTDOWN_ACTIVE = False
@@ -2133,11 +2462,10 @@ def enhanced_connect(ip, caller=None):
     
     # Set connection state
     is_new_server = (CURRENT_IP != ip)
-    STATE_INITIALIZED = False
     logging.info(f"Connecting to {ip}...")
-    PAUSE_STATE = True
-    CONNECTING = True
+    CONNECTION.transition(connection.CONNECTING, f"connect by {caller}" if caller else "connect", target=ip)
     CURRENT_IP = ip
+    servers.record_visit(ip)
 
     # IMPORTANT: Set console pause timer so health check can detect stuck connections
     # Even if game stops outputting console lines, the health check will still work
@@ -2168,31 +2496,25 @@ def enhanced_connect(ip, caller=None):
 def start_connection_monitor():
     """Start a background thread to monitor connection timeout - checks periodically"""
     def monitor_connection():
-        global CONNECTION_START_TIME, PAUSE_STATE, CONNECTING
-
-        # Check every 10 seconds instead of sleeping once for 90s
-        # This prevents the issue where CONNECTION_START_TIME gets reset while we're asleep
+        # Wake up as soon as the connection completes, or every 10 seconds to check the timeout
         check_interval = 10
-        max_checks = MAX_CONNECTION_TIMEOUT // check_interval
-
-        for i in range(int(max_checks) + 1):
-            time.sleep(check_interval)
-
-            # Check if we're still trying to connect
-            if CONNECTION_START_TIME and (PAUSE_STATE or CONNECTING):
-                elapsed = time.time() - CONNECTION_START_TIME
-
-                # If we've exceeded the timeout, trigger recovery
-                if elapsed > MAX_CONNECTION_TIMEOUT:
-                    logging.warning(f"Connection monitor: timeout after {elapsed:.0f}s - forcing recovery")
-                    force_connection_recovery("Connection timeout")
-                    return
-                elif i % 3 == 0:  # Log every 30 seconds
-                    logging.info(f"Connection monitor: still connecting, elapsed: {elapsed:.0f}s/{MAX_CONNECTION_TIMEOUT}s")
-            else:
-                # Connection completed successfully, exit monitor
-                logging.info("Connection monitor: connection completed, exiting monitor")
+        checks = 0
+
+        while not CONNECTION.wait_for(lambda c: not c.connecting, timeout=check_interval):
+            checks += 1
+            elapsed = CONNECTION.time_in_phase()
+
+            # If we've exceeded the timeout, trigger recovery
+            if elapsed > MAX_CONNECTION_TIMEOUT:
+                logging.warning(f"Connection monitor: timeout after {elapsed:.0f}s - forcing recovery")
+                servers.record_failure(CURRENT_IP, reason="Connection timeout")
+                force_connection_recovery("Connection timeout")
                 return
+            elif checks % 3 == 0:  # Log every 30 seconds
+                logging.info(f"Connection monitor: still connecting, elapsed: {elapsed:.0f}s/{MAX_CONNECTION_TIMEOUT}s")
+
+        # Connection completed successfully, exit monitor
+        logging.info("Connection monitor: connection completed, exiting monitor")
 
     monitor_thread = threading.Thread(target=monitor_connection, daemon=True)
     monitor_thread.start()
@@ -2267,6 +2589,7 @@ async def switch_spec(direction='next', channel=None):
         else:
             display_player_name(follow_id)
             api.exec_command(f"follow {follow_id}")  # Follow this player.
+            CADENCE.burst("switch")
             STATE.idle_counter = 0  # Reset idle strike flag since a followable non-bot id was found.
             STATE.current_player_id = follow_id  # Notify the state object of the new player we are spectating.
             STATE.afk_counter = 0
@@ -2281,6 +2604,7 @@ def spectate_player(follow_id):
     if follow_id in STATE.spec_ids:
 ##        display_player_name(follow_id)
         api.exec_command(f"follow {follow_id}")  # Follow this player.
+        CADENCE.burst("switch")
         STATE.idle_counter = 0  # Reset idle strike flag since a followable non-bot id was found.
         STATE.current_player_id = follow_id  # Notify the state object of the new player we are spectating.
         STATE.afk_counter = 0
@@ -2475,41 +2799,16 @@ def handle_world_record_event(player_name=None, record_time=None):
     """
     logging.info("Server record detected! Triggering celebration.")
     send_world_record_celebration(player_name, record_time)
-    # Try to play sound, with error handling
-    sound_file = 'worldrecord.wav'
-    sound_path = f"D:\\Games\\defragtv\\defrag\\music\\common\\{sound_file}"
-    if os.path.exists(sound_path):
-        api.play_sound(sound_file)
-    else:
-        logging.warning(f"Sound file {sound_path} not found, skipping sound playback.")
+    sounds.play_sound('worldrecord.wav', urgent=True)
 
 def get_colored_player_names():
-    """Fetch colored player names from defrag.racing API"""
+    """Colored player names of the current server, from the defrag.racing servers feed"""
     try:
-        import requests
         current_ip = STATE.ip if STATE and hasattr(STATE, 'ip') else None
         if not current_ip:
             return {}
-            
-        # Add default port if not present
-        api_ip = current_ip if ':' in current_ip else f"{current_ip}:27960"
-        
-        url = 'https://defrag.racing/servers/json'
-        response = requests.get(url, timeout=5)
-        servers_data = response.json()
-        
-        # Look for our server in active servers
-        if 'active' in servers_data and api_ip in servers_data['active']:
-            server_data = servers_data['active'][api_ip]
-            colored_names = {}
-            
-            if 'players' in server_data:
-                for player_id, player_data in server_data['players'].items():
-                    if isinstance(player_data, dict) and 'name' in player_data:
-                        # Map clean name to colored name
-                        clean_name = remove_color_codes(player_data['name'])
-                        colored_names[clean_name.lower()] = player_data['name']
-            return colored_names
+
+        return servers.get_colored_names(current_ip)
     except Exception as e:
         logging.error(f"Error fetching colored names: {e}")
     
@@ -2600,17 +2899,9 @@ def check_bot_team_status():
 
         logging.info("TEAM DEBUG: Bot forced back to spectator mode due to periodic check")
 
-        # Verify the team switch worked
-        time.sleep(2)
-        api.exec_command("svinfo_report serverstate.txt", verbose=False)
-        time.sleep(1)
-        if new_report_exists(config.STATE_REPORT_P):
-            _, updated_players, _ = get_svinfo_report(config.STATE_REPORT_P)
-            updated_bot = [player for player in updated_players if player.id == STATE.bot_id]
-            if updated_bot:
-                logging.info(f"TEAM DEBUG: After retry - Bot team: {updated_bot[0].t}")
-                if updated_bot[0].t != '3':
-                    logging.error(f"TEAM DEBUG: CRITICAL - Bot still on team {updated_bot[0].t} after retry!")
+        # Verify the team switch worked once the state loop has refreshed the team info
+        CADENCE.burst("team")
+        SCHEDULER.schedule('team_verify', verify_bot_team, delay=TEAM_VERIFY_DELAY)
     else:
         if should_log_team:
             logging.info(f"TEAM DEBUG: Bot correctly in spectator mode (team 3)")
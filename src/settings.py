@@ -0,0 +1,109 @@
+"""
+Stream settings the viewers change through the VPS (the Twitch extension): the cvar behind each setting, how its
+value converts to the UI format, and reading the current values from a config written by the engine.
+"""
+
+import logging
+import os
+import threading
+
+import config
+
+
+SETTINGS_CFG = 'settings-current.cfg'
+SETTINGS_CFG_P = os.path.join(config.DF_DIR, SETTINGS_CFG)
+
+
+class Setting:
+    def __init__(self, cvar, key, kind, default, on=None):
+        """
+        `kind` is 'int', 'float' or 'bool'. A 'bool' setting is on when the cvar equals `on`, or is not 0 when `on`
+        is None.
+        """
+        self.cvar = cvar
+        self.key = key
+        self.kind = kind
+        self.default = default
+        self.on = on
+
+    def to_ui(self, value):
+        if value is None:
+            value = self.default
+        number = float(value)
+
+        if self.kind == 'float':
+            return number
+        if self.kind == 'int':
+            return int(number)
+        if self.on is None:
+            return number != 0
+        return number == self.on
+
+
+SETTINGS = [
+    Setting('r_renderTriggerBrushes', 'triggers', 'bool', '0'),
+    Setting('r_fastsky', 'sky', 'bool', '0', on=0),  # Reversed: the sky is drawn without fastsky
+    Setting('r_renderClipBrushes', 'clips', 'bool', '0'),
+    Setting('r_renderSlickSurfaces', 'slick', 'bool', '0'),
+    Setting('r_mapOverbrightBits', 'brightness', 'int', '2'),
+    Setting('r_picmip', 'picmip', 'int', '0'),
+    Setting('r_fullbright', 'fullbright', 'bool', '0'),
+    Setting('r_gamma', 'gamma', 'float', '1.2'),
+    Setting('cg_drawGun', 'drawgun', 'bool', '1', on=1),  # 2 hides the gun too
+    Setting('df_chs1_Info6', 'angles', 'bool', '0', on=40),
+    Setting('cg_lagometer', 'lagometer', 'bool', '0'),
+    Setting('mdd_snap', 'snaps', 'bool', '3', on=3),
+    Setting('mdd_cgaz', 'cgaz', 'bool', '1'),
+    Setting('df_chs1_Info5', 'speedinfo', 'bool', '23', on=23),
+    Setting('df_drawSpeed', 'speedorig', 'bool', '0'),
+    Setting('df_chs0_Draw', 'inputs', 'bool', '1'),
+    Setting('df_chs1_Info7', 'obs', 'bool', '0', on=50),
+    Setting('df_mp_NoDrawRadius', 'nodraw', 'bool', '100', on=100000),
+    Setting('cg_thirdperson', 'thirdperson', 'bool', '0'),
+    Setting('df_ghosts_MiniviewDraw', 'miniview', 'bool', '0'),
+    Setting('cg_gibs', 'gibs', 'bool', '0'),
+    Setting('com_blood', 'blood', 'bool', '0'),
+]
+BY_CVAR = {setting.cvar.lower(): setting for setting in SETTINGS}
+
+CACHE_LOCK = threading.Lock()
+CACHE = {}  # path -> ((mtime, size), values)
+
+
+def read_config(path=SETTINGS_CFG_P):
+    """
+    The values of the settings' cvars in the config at `path`, lowercased cvar -> value. Cached until the file's
+    mtime or size changes. Raises OSError if the file can't be read.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime, stat.st_size)
+
+    with CACHE_LOCK:
+        cached = CACHE.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+    values = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as cfg:
+        for line in cfg:
+            if not line.startswith('seta '):
+                continue
+            parts = line.split(None, 2)
+            if len(parts) == 3 and parts[1].lower() in BY_CVAR:
+                values[parts[1].lower()] = parts[2].strip().strip('"')
+
+    with CACHE_LOCK:
+        CACHE[path] = (signature, values)
+    return values
+
+
+def to_ui(values):
+    """UI settings from the cvar values (lowercased cvar -> value), missing or invalid values are the defaults"""
+    ui_settings = {}
+    for name, setting in BY_CVAR.items():
+        try:
+            ui_settings[setting.key] = setting.to_ui(values.get(name))
+        except ValueError:
+            logging.warning(f"[SETTINGS] Invalid value for {setting.cvar}: {values.get(name)}, using the default")
+            ui_settings[setting.key] = setting.to_ui(setting.default)
+    return ui_settings
@@ -0,0 +1,586 @@
+"""
+Fake DeFRaG client for running the bot without the game.
+
+FakeEngine takes console lines the way the game does (';'-separated commands, through transport.SimulatorTransport
+or on stdin when run as a script, which makes it a drop-in client for the pipe transport) and answers through the
+same files the bot reads: qconsole.log in the game directory and the svinfo reports in system/reports. A scenario
+drives the server side: players joining and leaving, nospec toggles, AFK players, map changes, vid_restarts, map
+load errors and crashes. All delays (scenario steps and load times) are divided by `speed`.
+
+The engine also times how the bot reacts: how long it takes to follow someone else once the followed player became
+unspectatable ('switch'), and to get back to following a player after a map error or a crash ('recovery').
+
+    python simulator.py --dir /tmp/defrag --scenario churn --speed 4 +connect 127.0.0.1:27960
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+BOT_NAME = '^0^7D^6e^7Frag^6.^7LIVE^0/'
+LOCAL_IP = 'loopback'  # Reports written on a local map (standby)
+LOAD_TIME = 4  # Seconds a map load takes at speed 1
+VID_RESTART_TIME = 3
+LATENCY_HISTORY = 200
+KEYS = 'wasdjc'  # Keys an active player presses ($chsinfo(152))
+PHYSICS = {'0': 'vq3', '1': 'cpm'}
+
+
+class SimPlayer:
+    def __init__(self, id, name, team='0', c1='', afk=False):
+        self.id = id
+        self.name = name
+        self.team = team
+        self.c1 = c1
+        self.c2 = ''
+        self.afk = afk
+
+    @property
+    def keys(self):
+        return '' if self.afk else ''.join(random.sample(KEYS, random.randint(1, 3)))
+
+    @property
+    def spectatable(self):
+        return self.team != '3' and self.c1 not in ('nospec', 'nospecpm')
+
+
+def split_commands(line):
+    """Split a console line on the ';' that aren't quoted"""
+    commands, current, quoted = [], [], False
+    for char in line:
+        if char == '"':
+            quoted = not quoted
+        if char == ';' and not quoted:
+            commands.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    commands.append(''.join(current))
+    return [command.strip() for command in commands if command.strip()]
+
+
+class FakeEngine:
+    def __init__(self, df_dir, scenario=None, speed=1, hostname='Simulated Server'):
+        self.df_dir = df_dir
+        self.log_path = os.path.join(df_dir, 'qconsole.log')
+        self.reports_dir = os.path.join(df_dir, 'system', 'reports')
+        self.scenario = scenario or []
+        self.speed = speed
+        self.hostname = hostname
+
+        self.running = False
+        self.crashed = False
+        self.loading = False
+        self.ip = None
+        self.mapname = None
+        self.promode = '1'
+        self.players = {}  # id -> SimPlayer, the bot included
+        self.bot = None
+        self.following = None  # Id of the followed player (the bot's own id in free spectator mode)
+        self.cvars = {}
+        self.commands = 0
+        self.started_at = None
+
+        self.pending_switch = None  # (reason, time) the followed player became unspectatable
+        self.pending_recovery = None  # (reason, time) the game broke
+        self.latencies = {'switch': deque(maxlen=LATENCY_HISTORY), 'recovery': deque(maxlen=LATENCY_HISTORY)}
+
+        self._server_players = []  # (name, fields) of the players on the server, kept across map loads
+        self._lock = threading.RLock()
+        self._log = None
+        self._session = 0  # Bumped on every start/stop so a previous scenario run stops
+        self._generation = 0  # Bumped on every start/load so stale timers do nothing
+
+    # Lifecycle
+
+    def start(self, ip=None):
+        with self._lock:
+            os.makedirs(self.reports_dir, exist_ok=True)
+            if self._log is not None:
+                self._log.close()
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+
+            self._session += 1
+            self._generation += 1
+            self.running = True
+            self.crashed = False
+            self.started_at = time.time()
+            self.players = {}
+            self.bot = None
+            self._server_players = []
+            self.log("DeFRaG simulator started")
+            self.log("GL_RENDERER: Simulated")
+
+        threading.Thread(target=self.run_scenario, args=(self._session,), daemon=True).start()
+        self.load(ip or LOCAL_IP, 'st1' if not ip else None)
+
+    def stop(self):
+        with self._lock:
+            self._session += 1
+            self._generation += 1
+            self.running = False
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    @property
+    def alive(self):
+        return self.running and not self.crashed
+
+    def later(self, delay, fn, *args):
+        """Run fn(*args) in `delay` seconds (scaled by the speed), unless the engine restarted or loaded meanwhile"""
+        generation = self._generation
+
+        def run():
+            with self._lock:
+                if generation == self._generation and self.alive:
+                    fn(*args)
+
+        timer = threading.Timer(delay / self.speed, run)
+        timer.daemon = True
+        timer.start()
+
+    # Console
+
+    def log(self, line):
+        if self._log is not None:
+            self._log.write(line + '\n')
+            self._log.flush()
+
+    def execute(self, line):
+        """Run one console line"""
+        with self._lock:
+            if not self.alive:
+                return
+            for command in split_commands(line):
+                self.commands += 1
+                try:
+                    self.run_command(command)
+                except Exception as e:
+                    logging.error(f"[SIMULATOR] '{command}' failed: {e}")
+
+    def run_command(self, command):
+        name, _, args = command.partition(' ')
+        name = name.lower()
+        args = args.strip()
+
+        handler = getattr(self, f"cmd_{name}", None)
+        if handler is not None:
+            handler(args)
+        elif args:
+            self.cvars[name] = args.strip('"')
+        elif name in self.cvars:
+            self.log(f'"{name}" is:"{self.cvars[name]}^7"')
+        else:
+            self.log(f'Unknown command "{name}^7"')
+
+    def cmd_silent(self, args):
+        self.run_command(args)
+
+    def cmd_echo(self, args):
+        self.log(args)
+
+    def cmd_set(self, args):
+        name, _, value = args.partition(' ')
+        value = value.strip().strip('"')
+        self.cvars[name.lower()] = value
+
+        if name.lower() == 'color1' and self.bot is not None:
+            self.bot.c1 = value
+        elif name.lower() == 'df_promode':
+            self.promode = value
+
+    cmd_seta = cmd_set
+
+    def cmd_varcommand(self, args):
+        followed = self.players.get(self.following)
+        args = args.replace('$chsinfo(152)', followed.keys if followed else '')
+        args = args.replace('$chsinfo(117)', followed.name if followed else '')
+        self.run_command(args)
+
+    def cmd_varmath(self, args):
+        if args.replace(' ', '').startswith('color2=') and self.bot is not None:
+            followed = self.players.get(self.following)
+            self.bot.c2 = followed.keys if followed else ''
+
+    def cmd_say(self, args):
+        if self.bot is not None and not self.loading:
+            self.log(f"{BOT_NAME}^7: ^2{args.strip(chr(34))}")
+
+    def cmd_say_team(self, args):
+        if self.bot is not None and not self.loading:
+            self.log(f"({BOT_NAME}^7): ^5{args.strip(chr(34))}")
+
+    def cmd_team(self, args):
+        if self.bot is not None:
+            self.bot.team = '3' if args.lower().startswith('s') else '0'
+
+    def cmd_follow(self, args):
+        if self.bot is None or self.loading:
+            return
+        try:
+            player_id = int(args)
+        except ValueError:
+            return
+
+        player = self.players.get(player_id)
+        if player is None:
+            self.log(f"Client {player_id} is not active")
+            return
+        if player is not self.bot and not player.spectatable:
+            return
+
+        if player_id != self.following and player is not self.bot:
+            for kind in ('switch', 'recovery'):
+                pending = getattr(self, f'pending_{kind}')
+                if pending is not None:
+                    self.latencies[kind].append(time.time() - pending[1])
+                    setattr(self, f'pending_{kind}', None)
+        self.following = player_id
+
+    def cmd_svinfo_report(self, args):
+        if self.loading or self.bot is None:
+            return
+        filename = args.split()[0] if args else 'serverstate.txt'
+        with open(os.path.join(self.reports_dir, filename), 'w', encoding='utf-8') as report:
+            report.write(self.report())
+        self.log(f"report written to system/reports/{filename}")
+
+    def cmd_writeconfig(self, args):
+        filename = args.split()[0] if args else 'q3config.cfg'
+        with open(os.path.join(self.df_dir, filename), 'w', encoding='utf-8') as cfg:
+            cfg.write("// generated by the DeFRaG simulator\n")
+            for name, value in sorted(self.cvars.items()):
+                cfg.write(f'seta {name} "{value}"\n')
+        self.log(f"Writing {filename}.")
+
+    def cmd_connect(self, args):
+        self.load(args.split()[0] if args else self.ip)
+
+    def cmd_reconnect(self, args):
+        self.load(self.ip)
+
+    def cmd_map(self, args):
+        self.load(LOCAL_IP, args.split()[0] if args else 'st1')
+
+    cmd_devmap = cmd_map
+
+    def cmd_disconnect(self, args):
+        self.leave_map()
+        self.ip = None
+        self.log("Disconnected from server")
+
+    def cmd_vid_restart(self, args):
+        self.loading = True
+        self.log("RE_Shutdown( 1 )")
+        self.later(VID_RESTART_TIME, self.finish_vid_restart)
+
+    def cmd_quit(self, args):
+        self.stop()
+
+    def cmd_clear(self, args):
+        pass
+
+    def cmd_tell(self, args):
+        pass
+
+    def cmd_vote(self, args):
+        pass
+
+    def cmd_play(self, args):
+        pass
+
+    def cmd_displaymessage(self, args):
+        pass
+
+    # Map loading
+
+    def leave_map(self):
+        self._generation += 1
+        self.bot = None
+        self.following = None
+        self.players = {}
+
+    def load(self, ip, mapname=None):
+        self.leave_map()
+        self.loading = True
+        self.ip = ip
+        self.log(f"Connecting to {ip}..." if ip != LOCAL_IP else "RE_Shutdown( 0 )")
+        self.later(LOAD_TIME, self.finish_load, ip, mapname or self.mapname or 'st1')
+
+    def scenario_players(self):
+        """Players already on a server the bot connects to"""
+        return [] if self.ip == LOCAL_IP else list(self._server_players)
+
+    def finish_load(self, ip, mapname):
+        self.loading = False
+        self.ip = ip
+        self.mapname = mapname
+        self.log("Loading vm file vm/cgame.qvm...")
+        self.log(f"CL_InitCGame: {random.uniform(0.2, 0.8):.2f} seconds")
+        self.log(f"Com_TouchMemory: {random.randint(5, 40)} msec")
+
+        self.bot = SimPlayer(0, BOT_NAME, team='0', c1=self.cvars.get('color1', ''))
+        self.players = {0: self.bot}
+        self.following = 0
+        self.log(f"{BOT_NAME}^7 entered the game.")
+
+        for name, fields in self.scenario_players():
+            self.add_player(name, quiet=True, **fields)
+
+    def finish_vid_restart(self):
+        self.loading = False
+        self.log("GL_RENDERER: Simulated")
+        self.log(f"CL_InitCGame: {random.uniform(0.2, 0.8):.2f} seconds")
+        self.log(f"Com_TouchMemory: {random.randint(5, 40)} msec")
+
+    # Server side events
+
+    def find_player(self, name):
+        for player in self.players.values():
+            if player.name == name:
+                return player
+        return None
+
+    def add_player(self, name, quiet=False, team='0', c1='', afk=False):
+        player_id = next(i for i in range(64) if i not in self.players)
+        self.players[player_id] = SimPlayer(player_id, name, team, c1, afk)
+        if not quiet:
+            self.log(f"{name}^7 connected")
+            self.log(f"{name}^7 entered the game.")
+
+    def unspectatable(self, player, reason):
+        if player.id == self.following and self.pending_switch is None:
+            self.pending_switch = (reason, time.time())
+
+    def event_join(self, name, **fields):
+        self._server_players.append((name, fields))
+        if self.bot is not None and self.ip != LOCAL_IP:
+            self.add_player(name, **fields)
+
+    def event_leave(self, name):
+        self._server_players = [(n, fields) for n, fields in self._server_players if n != name]
+        player = self.find_player(name)
+        if player is not None and player is not self.bot:
+            self.unspectatable(player, 'leave')
+            del self.players[player.id]
+            self.log(f"{name}^7 disconnected")
+
+    def event_set(self, name, **fields):
+        """Change a player's team/c1/afk, e.g. set('Alpha', c1='nospec')"""
+        for server_name, server_fields in self._server_players:
+            if server_name == name:
+                server_fields.update(fields)
+
+        player = self.find_player(name)
+        if player is None:
+            return
+        for key, value in fields.items():
+            setattr(player, key, value)
+        if not player.spectatable:
+            self.unspectatable(player, 'nospec' if player.c1 in ('nospec', 'nospecpm') else 'team')
+        elif player.afk:
+            self.unspectatable(player, 'afk')
+
+    def event_chat(self, name, message):
+        self.log(f"{name}^7: ^2{message}")
+
+    def event_map_change(self, mapname):
+        if self.bot is None or self.ip == LOCAL_IP:
+            return
+        caller = next((player.name for player in self.players.values() if player is not self.bot), 'Player')
+        self.log(f"{caller}^7 called a vote: map {mapname}")
+        self.log("VoteVote passed.")
+        self.log("RE_Shutdown( 0 )")
+        ip = self.ip
+        self.leave_map()
+        self.loading = True
+        self.later(LOAD_TIME, self.finish_load, ip, mapname)
+
+    def event_vid_restart(self):
+        self.cmd_vid_restart('')
+
+    def event_map_error(self, mapname):
+        self.leave_map()
+        self.loading = False
+        self.pending_recovery = ('map_error', time.time())
+        self.log(f"ERROR: CM_LoadMap: couldn't load maps/{mapname}.bsp")
+
+    def event_crash(self):
+        self.pending_recovery = ('crash', time.time())
+        self.log("Exception Code: ACCESS_VIOLATION")
+        self.log("Exception Address: 0x00000000")
+        self.crashed = True
+
+    def run_scenario(self, session):
+        """Play the scenario steps (time, event, args, fields) from the engine's start"""
+        start = time.time()
+
+        for step in sorted(self.scenario, key=lambda step: step[0]):
+            at, event = step[0], step[1]
+            args = step[2] if len(step) > 2 else ()
+            fields = step[3] if len(step) > 3 else {}
+
+            time.sleep(max(0, start + at / self.speed - time.time()))
+            with self._lock:
+                if session != self._session:
+                    return
+                if self.crashed:
+                    continue
+                try:
+                    getattr(self, f"event_{event}")(*args, **fields)
+                except Exception as e:
+                    logging.error(f"[SIMULATOR] Scenario step {step} failed: {e}")
+
+    # Reports
+
+    def report(self):
+        followed = self.players.get(self.following)
+        lines = [
+            '-' * 60,
+            f"= Report for {self.ip} ({time.strftime('%Y.%m.%d-%H:%M:%S')})",
+            '-' * 60,
+            '',
+            '*** Server Info',
+            f"sv_hostname         {self.hostname}",
+            f"mapname             {self.mapname}",
+            "defrag_gametype     1",
+            f"df_promode          {self.promode}",
+            "sv_maxclients       32",
+            '',
+            '*** Info',
+            f"physics             {PHYSICS.get(self.promode, 'cpm')}",
+            f"player              {followed.name if followed else ''}",
+            '',
+        ]
+
+        for player_id, player in sorted(self.players.items()):
+            lines += [
+                f"*** Client Info {player_id}",
+                f"n                   {player.name}",
+                f"t                   {player.team}",
+                f"c1                  {player.c1}",
+                f"c2                  {player.c2}",
+                f"dfn                 {player.name}",
+                '',
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+    def stats(self):
+        latencies = {}
+        for kind, values in self.latencies.items():
+            values = sorted(values)
+            latencies[kind] = {'count': len(values), 'p50': metrics.percentile(values, 0.5),
+                               'p95': metrics.percentile(values, 0.95), 'max': values[-1] if values else None}
+        return {
+            'running': self.running,
+            'crashed': self.crashed,
+            'loading': self.loading,
+            'ip': self.ip,
+            'map': self.mapname,
+            'players': len(self.players),
+            'following': self.following,
+            'commands': self.commands,
+            'latencies': latencies,
+        }
+
+
+# Scenarios: lists of (time, event, args, fields), times in seconds at speed 1
+
+def basic_scenario():
+    return [
+        (0, 'join', ('Alpha',)),
+        (0, 'join', ('Bravo',)),
+        (0, 'join', ('Charlie',), {'c1': 'nospec'}),
+        (20, 'chat', ('Alpha', 'hi bot')),
+        (40, 'set', ('Alpha',), {'c1': 'nospec'}),
+        (60, 'join', ('Delta',)),
+        (80, 'set', ('Bravo',), {'afk': True}),
+        (120, 'map_change', ('st2',)),
+        (160, 'vid_restart'),
+        (200, 'set', ('Alpha',), {'c1': ''}),
+        (220, 'leave', ('Delta',)),
+        (260, 'set', ('Bravo',), {'afk': False}),
+    ]
+
+
+def errors_scenario():
+    return basic_scenario()[:4] + [
+        (60, 'map_error', ('missingmap',)),
+        (150, 'crash'),
+        (240, 'join', ('Echo',)),
+    ]
+
+
+def churn_scenario(players=16, duration=600, seed=1):
+    """`players` players joining, leaving and toggling nospec/AFK at random for `duration` seconds"""
+    rng = random.Random(seed)
+    names = [f"Player{i}" for i in range(players)]
+    steps = [(0, 'join', (name,)) for name in names[:players // 2]]
+    online = set(names[:players // 2])
+
+    t = 0
+    while t < duration:
+        t += rng.uniform(2, 10)
+        name = rng.choice(names)
+        if name not in online:
+            steps.append((t, 'join', (name,)))
+            online.add(name)
+        else:
+            event = rng.choice(['leave', 'nospec', 'spec', 'afk', 'active', 'chat'])
+            if event == 'leave':
+                steps.append((t, 'leave', (name,)))
+                online.discard(name)
+            elif event in ('nospec', 'spec'):
+                steps.append((t, 'set', (name,), {'c1': 'nospec' if event == 'nospec' else ''}))
+            elif event in ('afk', 'active'):
+                steps.append((t, 'set', (name,), {'afk': event == 'afk'}))
+            else:
+                steps.append((t, 'chat', (name, 'gg')))
+
+    return steps
+
+
+SCENARIOS = {
+    'idle': list,
+    'basic': basic_scenario,
+    'errors': errors_scenario,
+    'churn': churn_scenario,
+}
+
+
+def main():
+    """Run as a client reading console commands from stdin (see transport.PipeTransport)"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', required=True, help="Game directory to write qconsole.log and the reports to")
+    parser.add_argument('--scenario', default='basic', choices=sorted(SCENARIOS))
+    parser.add_argument('--speed', type=float, default=1)
+    args, engine_args = parser.parse_known_args()
+
+    connect_ip = None
+    if '+connect' in engine_args and engine_args.index('+connect') + 1 < len(engine_args):
+        connect_ip = engine_args[engine_args.index('+connect') + 1]
+
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    engine = FakeEngine(args.dir, SCENARIOS[args.scenario](), args.speed)
+    engine.start(connect_ip)
+
+    for line in sys.stdin:
+        engine.execute(line.rstrip('\r\n'))
+        if not engine.running:
+            break
+
+    logging.info(f"[SIMULATOR] {engine.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Viewer sound commands ($4ity, $holy...) and the server record sound.
+
+The sounds in DF_DIR/music/common are indexed once (with their length, read from the wav header) and the index is
+rebuilt when the directory's mtime changes, so a request never touches the filesystem. Requests go through a small
+playback queue: a sound starts once the previous one finished, the same sound can't be queued again within
+SOUND_COOLDOWN seconds, and requests beyond MAX_QUEUE waiting sounds are dropped. Urgent sounds (the server record)
+skip both the queue and the cooldown.
+"""
+
+import logging
+import os
+import threading
+import time
+import wave
+from collections import deque
+
+import api
+import config
+
+
+SOUND_DIR = 'music/common'  # As the engine's 'play' command wants it
+SOUND_DIR_P = os.path.join(config.DF_DIR, 'music', 'common')
+INDEX_CHECK_INTERVAL = 30  # Seconds between two checks of the sound directory for changes
+DEFAULT_LENGTH = 1  # Seconds, for sounds whose length can't be read
+SOUND_COOLDOWN = 5  # Min seconds between two requests of the same sound
+MAX_QUEUE = 4  # Sounds waiting to be played
+
+SOUND_COND = threading.Condition()
+SOUNDS = {}  # lowercased file name -> length in seconds
+INDEX_MTIME = None
+LAST_INDEX_CHECK = 0
+QUEUE = deque()  # File names waiting to be played
+LAST_REQUESTED = {}  # lowercased file name -> time it was last accepted
+PLAYING_UNTIL = 0
+STATS = {'played': 0, 'queued': 0, 'cooldown': 0, 'dropped': 0, 'missing': 0, 'index_builds': 0}
+
+
+def sound_length(path):
+    try:
+        with wave.open(path, 'rb') as sound:
+            return sound.getnframes() / float(sound.getframerate())
+    except Exception:
+        return DEFAULT_LENGTH
+
+
+def refresh_index(force=False):
+    """Rebuild the index if the sound directory changed since the last build. Returns True if it was rebuilt"""
+    global INDEX_MTIME, LAST_INDEX_CHECK, SOUNDS
+
+    LAST_INDEX_CHECK = time.time()
+    try:
+        mtime = os.stat(SOUND_DIR_P).st_mtime
+    except OSError:
+        mtime = None
+
+    if mtime == INDEX_MTIME and not force:
+        return False
+
+    sounds = {}
+    if mtime is not None:
+        for name in os.listdir(SOUND_DIR_P):
+            if name.lower().endswith('.wav'):
+                sounds[name.lower()] = sound_length(os.path.join(SOUND_DIR_P, name))
+    else:
+        logging.warning(f"Sound directory {SOUND_DIR_P} not found")
+
+    with SOUND_COND:
+        SOUNDS = sounds
+        INDEX_MTIME = mtime
+        STATS['index_builds'] += 1
+    logging.info(f"Sound index built: {len(sounds)} sounds")
+    return True
+
+
+def _play(sound):
+    """Call with SOUND_COND held"""
+    global PLAYING_UNTIL
+
+    api.exec_command(f"play {SOUND_DIR}/{sound}")
+    PLAYING_UNTIL = time.time() + SOUNDS.get(sound.lower(), DEFAULT_LENGTH)
+    STATS['played'] += 1
+
+
+def play_sound(sound, urgent=False):
+    """
+    Request the sound `sound` (a file name in music/common). Returns False if it doesn't exist or the request was
+    dropped (cooldown or full queue).
+    """
+    key = sound.lower()
+    now = time.time()
+
+    with SOUND_COND:
+        if key not in SOUNDS:
+            STATS['missing'] += 1
+            logging.info(f"Sound file {SOUND_DIR}/{sound} not found.")
+            return False
+
+        if urgent:
+            LAST_REQUESTED[key] = now
+            _play(sound)
+            return True
+
+        if now - LAST_REQUESTED.get(key, 0) < SOUND_COOLDOWN:
+            STATS['cooldown'] += 1
+            logging.info(f"Sound {sound} was requested less than {SOUND_COOLDOWN}s ago, ignoring it")
+            return False
+
+        if len(QUEUE) >= MAX_QUEUE:
+            STATS['dropped'] += 1
+            logging.info(f"{len(QUEUE)} sounds already waiting, dropping {sound}")
+            return False
+
+        LAST_REQUESTED[key] = now
+        QUEUE.append(sound)
+        STATS['queued'] += 1
+        SOUND_COND.notify()
+    return True
+
+
+def run():
+    """Play the queued sounds one after the other, and keep the index up to date"""
+    logging.info("Sound player started")
+
+    while True:
+        try:
+            if time.time() - LAST_INDEX_CHECK >= INDEX_CHECK_INTERVAL:
+                refresh_index()
+
+            with SOUND_COND:
+                now = time.time()
+                if QUEUE and now >= PLAYING_UNTIL:
+                    _play(QUEUE.popleft())
+                    continue
+
+                next_check = LAST_INDEX_CHECK + INDEX_CHECK_INTERVAL
+                SOUND_COND.wait(max(0, min(next_check, PLAYING_UNTIL if QUEUE else next_check) - now))
+        except Exception as e:
+            logging.error(f"Sound player failed: {e}")
+            time.sleep(1)
+
+
+def stats():
+    return {
+        **STATS,
+        'sounds': dict(SOUNDS),
+        'queue': list(QUEUE),
+        'playing_for': max(0, PLAYING_UNTIL - time.time()),
+    }
@@ -0,0 +1,313 @@
+"""
+Engine transports: how console commands reach the game, and how the bot tells whether the game is alive and
+responding.
+
+    ahk   the Windows client: the console window is driven through AutoHotkey (a persistent helper, see
+          ahk_daemon.py, with one-off scripts as fallback) and hangs are detected with IsHungAppWindow
+    pipe  a client reading its console from stdin (ioq3/iDFe on Linux): commands are written straight to the stdin
+          of the client the bot launched, or to a named pipe the client reads (ENGINE_PIPE). A client that stops
+          draining the pipe for HUNG_WRITE_TIMEOUT seconds is considered hung.
+    simulator
+          a fake engine in the bot's process (see simulator.py), for running the bot without the game
+
+The backend is picked with ENGINE_TRANSPORT in env.py.
+"""
+
+import abc
+import ctypes
+import errno
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from env import environ
+
+import ahk_daemon
+
+
+AHK_EXE = 'C:\\Program Files\\AutoHotkey\\AutoHotkey.exe'
+CONSOLEWINDOW = "TwitchBot Console"
+ENGINEWINDOW = "TwitchBot Engine"
+HUNG_WRITE_TIMEOUT = 10  # Seconds a pipe may stay full before the client is considered hung
+
+
+class WindowNotFoundError(Exception):
+    pass
+
+
+class EngineTransport(abc.ABC):
+    name = None
+    launches_engine = False  # launch() has to run in the bot's process to keep hold of the engine
+    needs_executable = True  # launch() runs DF_EXE_PATH
+
+    @abc.abstractmethod
+    def init(self):
+        """Find the running engine. Raises WindowNotFoundError if it isn't running or can't be driven"""
+
+    @abc.abstractmethod
+    def send_line(self, line):
+        """Run one console line. Blocks until the engine has it"""
+
+    @abc.abstractmethod
+    def is_alive(self):
+        pass
+
+    def is_hung(self):
+        """The engine is running but not processing its input"""
+        return False
+
+    @property
+    def degraded(self):
+        """Commands go through a slow fallback, background traffic (input sampling) should back off"""
+        return False
+
+    def launch(self, args, cwd):
+        subprocess.Popen(args=args, cwd=cwd)
+
+    def stats(self):
+        return {'name': self.name, 'alive': self.is_alive(), 'hung': self.is_hung(), 'degraded': self.degraded}
+
+
+class AhkTransport(EngineTransport):
+    name = 'ahk'
+
+    def __init__(self):
+        from ahk import AHK
+
+        self.ahk = AHK(executable_path=AHK_EXE)
+        self.console = None
+        self.window = None
+        self.spawns = 0  # One-off scripts run for commands
+        # Long-lived AutoHotkey helper typing the console lines, one-off scripts are the fallback
+        self.daemon = ahk_daemon.CommandDaemon(lambda console: [AHK_EXE, '/ErrorStdOut', ahk_daemon.SCRIPT_PATH, console])
+
+    def init(self):
+        """Grab both engine and console windows with better error handling"""
+        try:
+            # Existing console setup code...
+            if environ["DEVELOPMENT"]:
+                console = self.ahk.run_script("WinShow," + CONSOLEWINDOW +
+                           "\nControlGet, console, Hwnd ,, Edit1, " + CONSOLEWINDOW +
+                           "\nFileAppend, %console%, * ;", blocking=True)
+            else:
+                console = self.ahk.run_script("WinShow," + CONSOLEWINDOW + \
+                            "\nControlGet, console, Hwnd ,, Edit1, " + CONSOLEWINDOW +
+                            "\nWinHide," + CONSOLEWINDOW +
+                            "\nFileAppend, %console%, * ;", blocking=True)
+
+            window = self.ahk.find_window(title=ENGINEWINDOW)
+
+            # Better validation
+            if console is None:
+                raise WindowNotFoundError("Console window not found")
+            if window is None:
+                raise WindowNotFoundError("Engine window not found")
+            if not window.exists:
+                raise WindowNotFoundError("Engine window exists but is not accessible")
+
+            self.console = console
+            self.window = window
+        except Exception as e:
+            logging.error(f"Window initialization failed: {e}")
+            raise WindowNotFoundError(f"Could not initialize windows: {e}")
+
+        if environ.get('AHK_DAEMON', True):
+            try:
+                self.daemon.start(self.console)  # Rebinds the helper if the console window changed
+            except ahk_daemon.DaemonError as e:
+                logging.warning(f"Command daemon unavailable, falling back to one script per command: {e}")
+
+    def send_line(self, line):
+        if self.daemon.target is not None:
+            try:
+                self.daemon.send(line)
+                return
+            except ahk_daemon.WindowLostError:
+                logging.warning("Console window lost, grabbing it again")
+                self.init()
+            except ahk_daemon.DaemonError as e:
+                logging.warning(f"Command daemon failed, sending through a one-off script: {e}")
+
+        self.spawns += 1
+        # send the text to the console window, escape commas (must be `, to show up in chat)
+        self.ahk.run_script("ControlSetText, , " + line.replace(',', '`,') + ", ahk_id " + self.console +
+                    "\nControlSend, , {Enter}, ahk_id " + self.console, blocking=True)
+
+    @property
+    def degraded(self):
+        # Without the helper every command spawns an AutoHotkey process
+        return self.daemon.target is None or not self.daemon.alive
+
+    def is_alive(self):
+        try:
+            return bool(self.window and self.window.exists)
+        except Exception:
+            return False
+
+    def is_hung(self):
+        """Check if the game window is hung (Not Responding) via Windows API"""
+        try:
+            user32 = ctypes.windll.user32
+            hwnd = user32.FindWindowW(None, ENGINEWINDOW)
+            return bool(hwnd and user32.IsHungAppWindow(hwnd))
+        except Exception:
+            return False
+
+    def stats(self):
+        return {**super().stats(), 'console': self.console, 'spawns': self.spawns, 'daemon': self.daemon.stats()}
+
+
+class PipeTransport(EngineTransport):
+    name = 'pipe'
+    launches_engine = True
+
+    def __init__(self, pipe_path=None):
+        self.pipe_path = pipe_path or None  # Named pipe the client reads its console from, None to use its stdin
+        self.process = None  # Client launched by the bot
+        self.fd = None
+        self.blocked_since = None  # First time a write found the pipe full
+        self.unfinished = b''  # Rest of a line the client got only part of, written before the next line
+        self.lines = 0
+        self._lock = threading.Lock()
+
+    def launch(self, args, cwd):
+        if self.pipe_path:
+            if not os.path.exists(self.pipe_path):
+                os.mkfifo(self.pipe_path)
+            # Read-write so opening doesn't wait for a writer, the client gets its own copy of the descriptor
+            stdin = os.open(self.pipe_path, os.O_RDWR)
+            try:
+                self.process = subprocess.Popen(args=args, cwd=cwd, stdin=stdin)
+            finally:
+                os.close(stdin)
+        else:
+            if self.process is not None and self.process.stdin:
+                self.process.stdin.close()
+            self.process = subprocess.Popen(args=args, cwd=cwd, stdin=subprocess.PIPE)
+            self.fd = self.process.stdin.fileno()
+            os.set_blocking(self.fd, False)
+        self.blocked_since = None
+        self.unfinished = b''
+
+    def _close(self):
+        if self.fd is not None and self.pipe_path:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+        self.fd = None
+        self.unfinished = b''  # Whoever reads the pipe next starts on a fresh line
+
+    def init(self):
+        if self.process is not None and self.process.poll() is not None:
+            self._close()
+            raise WindowNotFoundError(f"Engine exited with code {self.process.poll()}")
+
+        if self.pipe_path and self.fd is None:
+            try:
+                # Fails with ENXIO while no client has the pipe open for reading
+                self.fd = os.open(self.pipe_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                raise WindowNotFoundError(f"No engine reading {self.pipe_path}: {e}")
+
+        if self.fd is None:
+            raise WindowNotFoundError("Engine not running")
+
+    def send_line(self, line):
+        data = (line.replace('\n', ' ').replace('\r', ' ') + '\n').encode('utf-8', 'replace')
+
+        with self._lock:
+            if self.fd is None:
+                self.init()
+
+            # The client already has the start of the last line that timed out: finish it first, so it isn't
+            # glued to this one
+            unfinished = len(self.unfinished)
+            data = self.unfinished + data
+            self.unfinished = b''
+
+            start = time.time()
+            while data:
+                try:
+                    written = os.write(self.fd, data)
+                    data = data[written:]
+                    unfinished -= written
+                    self.blocked_since = None
+                except BlockingIOError:
+                    # The client isn't draining its input, wait a bit for it but don't block the flusher forever
+                    self.blocked_since = self.blocked_since or time.time()
+                    if time.time() - start > 1:
+                        if unfinished < 0:
+                            self.unfinished = data  # Stopped in the middle of this line
+                        elif unfinished > 0:
+                            self.unfinished = data[:unfinished]  # Still in the middle of the old line, drop this one
+                        raise WindowNotFoundError("Engine isn't reading its console input")
+                    time.sleep(0.01)
+                except OSError as e:
+                    self._close()
+                    if e.errno in (errno.EPIPE, errno.EBADF):
+                        raise WindowNotFoundError(f"Engine pipe closed: {e}")
+                    raise
+            self.lines += 1
+
+    def is_alive(self):
+        if self.process is not None:
+            return self.process.poll() is None
+        return self.fd is not None
+
+    def is_hung(self):
+        return self.blocked_since is not None and time.time() - self.blocked_since > HUNG_WRITE_TIMEOUT
+
+    def stats(self):
+        return {**super().stats(), 'pipe': self.pipe_path, 'pid': self.process.pid if self.process else None,
+                'lines': self.lines, 'blocked_since': self.blocked_since}
+
+
+class SimulatorTransport(EngineTransport):
+    """Commands go to an in-process simulator.FakeEngine writing to the game directory"""
+    name = 'simulator'
+    launches_engine = True
+    needs_executable = False
+
+    def __init__(self, options=None):
+        import config
+        import simulator
+
+        options = options or {}
+        scenario = simulator.SCENARIOS[options.get('SCENARIO', 'basic')]()
+        self.engine = simulator.FakeEngine(options.get('DIR') or config.DF_DIR, scenario, options.get('SPEED', 1))
+
+    def launch(self, args, cwd):
+        ip = args[args.index('+connect') + 1] if '+connect' in args[:-1] else None
+        self.engine.start(ip)
+
+    def init(self):
+        if not self.engine.alive:
+            raise WindowNotFoundError("Simulated engine not running")
+
+    def send_line(self, line):
+        self.init()
+        self.engine.execute(line)
+
+    def is_alive(self):
+        return self.engine.alive
+
+    def stats(self):
+        return {**super().stats(), 'engine': self.engine.stats()}
+
+
+TRANSPORTS = {
+    'ahk': AhkTransport,
+    'pipe': lambda: PipeTransport(environ.get('ENGINE_PIPE')),
+    'simulator': lambda: SimulatorTransport(environ.get('SIMULATOR')),
+}
+
+
+def create(name=None):
+    name = name or environ.get('ENGINE_TRANSPORT', 'ahk')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown engine transport '{name}', expected one of: {', '.join(TRANSPORTS)}")
+    logging.info(f"Engine transport: {name}")
+    return TRANSPORTS[name]()
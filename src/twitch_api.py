@@ -0,0 +1,162 @@
+"""
+Shared client for the Twitch Helix API.
+
+All Helix lookups go through a single pooled HTTP session and reuse one app access token until shortly before it
+expires. Lookups of logins are batched (up to 100 per request, the Helix limit) and concurrent lookups of the same
+login are coalesced into a single request.
+
+The token and Helix URLs can be overridden, which allows running the client against a local stub server.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+from env import environ
+
+
+TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+HELIX_URL = "https://api.twitch.tv/helix"
+REQUEST_TIMEOUT = 10
+TOKEN_EXPIRY_MARGIN = 120  # Refresh the app token this many seconds before it actually expires
+MAX_LOGINS_PER_REQUEST = 100  # Helix limit for the login/user_login query parameters
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+
+
+class PendingLookup:
+    """Result slot shared by all callers waiting on the same in-flight login lookup"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class HelixClient:
+    def __init__(self, client_id, client_secret, token_url=TOKEN_URL, helix_url=HELIX_URL, timeout=REQUEST_TIMEOUT):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.helix_url = helix_url.rstrip('/')
+        self.timeout = timeout
+
+        self.session = requests.Session()
+
+        self._token = None
+        self._token_expiry = 0
+        self._token_lock = threading.Lock()
+
+        self._pending = {}  # (endpoint, login) -> PendingLookup
+        self._pending_lock = threading.Lock()
+
+    def get_token(self, force=False):
+        """Returns a valid app access token, only requesting a new one when the cached one is about to expire"""
+        with self._token_lock:
+            if not force and self._token is not None and time.time() < self._token_expiry:
+                return self._token
+
+            r = self.session.post(self.token_url, data={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials'
+            }, timeout=self.timeout)
+            r.raise_for_status()
+            token_data = r.json()
+
+            self._token = token_data['access_token']
+            self._token_expiry = time.time() + max(0, token_data.get('expires_in', 3600) - TOKEN_EXPIRY_MARGIN)
+            logging.info(f"[TWITCH] Fetched new app access token (valid for {token_data.get('expires_in', '?')}s)")
+
+            return self._token
+
+    def get(self, endpoint, params):
+        """GET a Helix endpoint and return its 'data' list. Retries once with a fresh token if the token was revoked"""
+        for attempt in range(2):
+            token = self.get_token(force=attempt > 0)
+            headers = {"Authorization": f"Bearer {token}", "Client-Id": self.client_id}
+            r = self.session.get(f"{self.helix_url}/{endpoint}", params=params, headers=headers, timeout=self.timeout)
+
+            if r.status_code == 401 and attempt == 0:
+                logging.warning("[TWITCH] App access token rejected, fetching a new one")
+                continue
+
+            r.raise_for_status()
+            return r.json()['data']
+
+    def lookup(self, endpoint, param, field, logins):
+        """
+        Returns {login: item or None} for the given logins, where item is the entry of the endpoint's data whose
+        `field` matches the login. Logins that are already being looked up by another thread are not requested
+        again, this call waits for that request instead.
+        """
+        logins = list(dict.fromkeys(login.lower() for login in logins if login))
+        owned, waiting = {}, {}
+
+        with self._pending_lock:
+            for login in logins:
+                pending = self._pending.get((endpoint, login))
+                if pending is None:
+                    pending = self._pending[(endpoint, login)] = PendingLookup()
+                    owned[login] = pending
+                else:
+                    waiting[login] = pending
+
+        results = {}
+        error = None
+        try:
+            owned_logins = list(owned)
+            for i in range(0, len(owned_logins), MAX_LOGINS_PER_REQUEST):
+                batch = owned_logins[i:i + MAX_LOGINS_PER_REQUEST]
+                data = self.get(endpoint, [(param, login) for login in batch])
+                found = {item[field].lower(): item for item in data}
+
+                for login in batch:
+                    owned[login].result = results[login] = found.get(login)
+        except Exception as e:
+            error = e
+        finally:
+            with self._pending_lock:
+                for login, pending in owned.items():
+                    self._pending.pop((endpoint, login), None)
+                    if login not in results:
+                        pending.error = error or RuntimeError(f"Lookup of {login} did not complete")
+                    pending.event.set()
+
+        if error is not None:
+            raise error
+
+        for login, pending in waiting.items():
+            if not pending.event.wait(self.timeout * 2):
+                raise TimeoutError(f"Timed out waiting for the lookup of {login}")
+            if pending.error is not None:
+                raise pending.error
+            results[login] = pending.result
+
+        return results
+
+    def get_users(self, logins):
+        """Returns {login: user data or None}. A login maps to None when the account does not exist"""
+        return self.lookup('users', 'login', 'login', logins)
+
+    def get_streams(self, logins):
+        """Returns {login: stream data or None}. A login maps to None when the channel is not live"""
+        return self.lookup('streams', 'user_login', 'user_login', logins)
+
+    def get_viewer_count(self, channel):
+        """Returns the current viewer count of a channel, 0 if it is offline"""
+        stream = self.get_streams([channel]).get(channel.lower())
+        return stream['viewer_count'] if stream else 0
+
+
+def get_client():
+    """Returns the shared HelixClient, creating it from the TWITCH_API settings on first use"""
+    global CLIENT
+
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            CLIENT = HelixClient(environ['TWITCH_API']['client_id'], environ['TWITCH_API']['client_secret'])
+        return CLIENT
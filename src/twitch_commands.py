@@ -2,9 +2,10 @@ import config
 import api
 import servers
 import serverstate
-import requests
+import connection
+from connection import CONNECTION
+import twitch_api
 import time
-from env import environ
 import logging
 from mapdata import MapData
 from serverstate import send_auto_greeting
@@ -241,8 +242,6 @@ async def brightness(ctx, author, args):
     value = args[0]
     if value.isdigit() and (0 < int(value) <= 5):
         logging.info("vid_restarting...")
-        serverstate.VID_RESTARTING = True
-        # serverstate.PAUSE_STATE = True
         api.exec_command(f"r_mapoverbrightbits {value};vid_restart")
         MapData.save(serverstate.STATE.mapname, 'brightness', value)
     else:
@@ -258,8 +257,7 @@ async def picmip(ctx, author, args):
     value = args[0]
     if value.isdigit() and (0 <= int(value) <= 6):
         logging.info("vid_restarting..")
-        serverstate.VID_RESTARTING = True
-        serverstate.PAUSE_STATE = True
+        CONNECTION.transition(connection.RESTARTING, "picmip vid_restart")
         api.exec_command(f"r_picmip {value};vid_restart")
         MapData.save(serverstate.STATE.mapname, 'picmip', value)
     else:
@@ -275,8 +273,7 @@ async def fullbright(ctx, author, args):
     value = args[0]
     if value.isdigit() and (0 <= int(value) <= 6):
         logging.info("vid_restarting..")
-        serverstate.VID_RESTARTING = True
-        serverstate.PAUSE_STATE = True
+        CONNECTION.transition(connection.RESTARTING, "fullbright vid_restart")
         api.exec_command(f"r_fullbright {value};vid_restart")
         MapData.save(serverstate.STATE.mapname, 'fullbright', value)
     else:
@@ -303,23 +300,7 @@ async def ip(ctx, author, args):
 
 
 async def howmany(ctx, author, args):
-    client_id = environ['TWITCH_API']['client_id']
-    client_secret = environ['TWITCH_API']['client_secret']
-    token_url = "https://id.twitch.tv/oauth2/token"
-    token_data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'grant_type': 'client_credentials'
-    }
-    r = requests.post(token_url, data=token_data, timeout=10)
-    r.raise_for_status()
-    token = r.json()['access_token']
-    stream_url = f"https://api.twitch.tv/helix/streams?user_login={'defraglive'}"
-    headers = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
-    r = requests.get(stream_url, headers=headers, timeout=10)
-    r.raise_for_status()
-    stream_data = r.json()['data']
-    viewer_count = stream_data[0]['viewer_count']
+    viewer_count = twitch_api.get_client().get_viewer_count('defraglive')
     reply_string = f"$chsinfo(117) ^7-- you are being watched by ^3{viewer_count} ^7viewer" + ("s" if viewer_count > 0 else "")
     api.exec_command(f"varcommand say {reply_string}")
 
@@ -4,17 +4,29 @@ import websockets
 import logging
 import time
 import json
+import re
 import random
 
 import api
 import console
 import config
 import serverstate
+import connection
+from connection import CONNECTION
 import filters
 import servers
+import settings
+import cache
+import cvars
+import inputs
+import probe
+import metrics
+import sounds
 
 import requests
 import threading
+import functools
+from collections import deque
 
 # logger = logging.getLogger('websockets')
 # logger.setLevel(logging.DEBUG)
@@ -25,13 +37,34 @@ import time
 import logging
 
 SETTINGS_QUEUE = []
-CANCEL_PENDING_WRITECONFIG = False
+
+# Settings changes from the VPS are merged per cvar and applied in one batch, with a single config sync
+SETTINGS_DEBOUNCE = 1  # Seconds without a change before the batch is applied
+SETTINGS_MAX_WAIT = 5  # Seconds a batch waits at most, however long the burst of changes lasts
+SETTINGS_APPLY_TIMEOUT = 10
+SETTINGS_WRITE_TIMEOUT = 1  # Seconds the engine gets to write the settings config
+SETTINGS_COND = threading.Condition()
+PENDING_SETTINGS = {}  # cvar (lowercased) -> settings command, in the order they were last changed
+SETTINGS_RESTART = False  # A vid_restart was requested, the batch is applied right away
+SETTINGS_FIRST_CHANGE = 0
+SETTINGS_LAST_CHANGE = 0
+SETTINGS_THREAD = None
+SETTINGS_STATS = {'changes': 0, 'merged': 0, 'batches': 0, 'syncs': 0}
 
 # Serverstate change logging throttle
 SERVERSTATE_CHANGE_COUNTER = 0
 LAST_SERVERSTATE_LOG_TIME = 0
 SERVERSTATE_LOG_INTERVAL = 10  # Log every 10 changes or every 30 seconds
 
+# Versioned serverstate stream: a full snapshot is sent on connect/resync, every change after that is sent
+# as a JSON-patch (RFC 6902) against the previous version. The VPS applies the patches in seq order and asks
+# for a resync (action 'serverstate_resync', 'since': last seq it has) when it detects a gap.
+SERVERSTATE_LOCK = threading.Lock()
+SERVERSTATE_SEQ = 0
+LAST_SERVERSTATE = None  # Last document published, patches are computed against it
+SERVERSTATE_HISTORY_SIZE = 50  # How many patches to keep for resyncs
+SERVERSTATE_HISTORY = deque(maxlen=SERVERSTATE_HISTORY_SIZE)  # (seq, patch)
+
 def handle_settings_command(content):
     """Handle settings command from VPS"""
     # QUEUE SETTINGS COMMANDS DURING MAP LOADING
@@ -48,260 +81,158 @@ def handle_settings_command(content):
     # Execute immediately if not loading
     execute_settings_command(content)
 
+def settings_cvar(command):
+    """Key the settings changes are merged on: the cvar set by `command` (lowercased), else the command itself"""
+    cvar = cvars.parse_set(command.strip())
+    return cvar[0].lower() if cvar else command.strip()
+
 def execute_settings_command(content):
-    global CANCEL_PENDING_WRITECONFIG
-    
+    """
+    Add a settings change to the pending batch. Changes to the same cvar are merged (last write wins) until no
+    change came for SETTINGS_DEBOUNCE seconds, then the batch is applied as one command (see settings_flusher).
+    A vid_restart applies the batch right away, followed by the restart.
+    """
+    global SETTINGS_RESTART, SETTINGS_FIRST_CHANGE, SETTINGS_LAST_CHANGE
+
     logging.info(f'[SETTINGS] Received command: {content["command"]}')
-    
+
     try:
-        command = content["command"]
-        
-        if command == "vid_restart":
-            logging.info("[SETTINGS] Executing vid_restart - canceling any pending writeconfig")
-            CANCEL_PENDING_WRITECONFIG = True  # Cancel any pending writeconfig
-            import serverstate
-            serverstate.VID_RESTARTING = True
-            serverstate.PAUSE_STATE = True
-            api.exec_command(command)
-            logging.info(f'[SETTINGS] Executed: {command}')
-            return
-        
-        # RESET flag for regular commands
-        CANCEL_PENDING_WRITECONFIG = False
-        
-        # Add seta prefix only for extension cvars if not already present
-        extension_cvars = [
-            'r_renderTriggerBrushes', 'r_fastsky', 'r_renderClipBrushes', 'r_renderSlickSurfaces',
-            'r_mapOverbrightBits', 'r_picmip', 'r_fullbright', 'r_gamma', 'cg_drawGun',
-            'df_chs1_Info6', 'cg_lagometer', 'mdd_snap', 'mdd_cgaz', 'df_chs1_Info5',
-            'df_drawSpeed', 'df_chs0_Draw', 'df_chs1_Info7', 'df_mp_NoDrawRadius',
-            'cg_thirdperson', 'df_ghosts_MiniviewDraw', 'cg_gibs', 'com_blood'
-        ]
-        
-        # Check if command starts with any of the extension cvars and add seta if needed
-        for cvar in extension_cvars:
-            if command.startswith(f"{cvar} ") and not command.startswith("seta "):
+        command = content["command"].strip()
+
+        if command != "vid_restart":
+            # Add seta prefix only for extension cvars if not already present, so they're archived
+            words = command.split(' ', 1)
+            if len(words) == 2 and words[0].lower() in settings.BY_CVAR:
                 command = f"seta {command}"
                 logging.info(f'[SETTINGS] Modified extension command to use seta: {command}')
-                break
-        
-        # Execute the setting command
-        api.exec_command(command)
-        logging.info(f'[SETTINGS] Executed: {command}')
-        
-        # Add 1-second delay before writeconfig for non-vid_restart commands
-        def delayed_writeconfig():
-            import time
-            global CANCEL_PENDING_WRITECONFIG
-            time.sleep(2)
-            # Check if writeconfig was cancelled
-            if not CANCEL_PENDING_WRITECONFIG:
-                api.exec_command("writeconfig settings-current.cfg")
-                logging.info("[SETTINGS] Wrote config after 1-second delay")
-                
-                # Sync settings after writeconfig for regular commands
-                def delayed_settings_confirmation():
-                    import time
-                    time.sleep(2)  # Wait for writeconfig to complete
-                    try:
-                        sync_current_settings_to_vps()
-                        logging.info("[SETTINGS] Synced settings after regular command")
-                    except Exception as e:
-                        logging.error(f"[SETTINGS] Failed to sync after regular command: {e}")
-                
-                import threading
-                sync_thread = threading.Thread(target=delayed_settings_confirmation)
-                sync_thread.daemon = True
-                sync_thread.start()
+
+        if SETTINGS_THREAD is None:
+            start_settings_flusher()
+
+        with SETTINGS_COND:
+            now = time.time()
+            if not PENDING_SETTINGS and not SETTINGS_RESTART:
+                SETTINGS_FIRST_CHANGE = now
+            SETTINGS_LAST_CHANGE = now
+            SETTINGS_STATS['changes'] += 1
+
+            if command == "vid_restart":
+                SETTINGS_RESTART = True
             else:
-                logging.info("[SETTINGS] Writeconfig cancelled due to vid_restart")
-        
-        # Start the writeconfig thread
-        import threading
-        writeconfig_thread = threading.Thread(target=delayed_writeconfig)
-        writeconfig_thread.daemon = True
-        writeconfig_thread.start()
-        
+                key = settings_cvar(command)
+                if PENDING_SETTINGS.pop(key, None) is not None:
+                    SETTINGS_STATS['merged'] += 1
+                PENDING_SETTINGS[key] = command
+            SETTINGS_COND.notify()
+
     except Exception as e:
         logging.error(f'[SETTINGS] Failed to execute command {content["command"]}: {e}')
 
+def apply_settings(commands, restart):
+    """Send a batch of settings changes as one command, then write the config and sync the VPS once"""
+    command = ";".join(commands)
+
+    if restart:
+        # The restart reloads everything, the sync happens once it's done (see console.py)
+        logging.info(f"[SETTINGS] Applying {len(commands)} settings with a vid_restart")
+        CONNECTION.transition(connection.RESTARTING, "settings vid_restart")
+        api.exec_command(f"{command};vid_restart" if command else "vid_restart", priority=api.CONTROL)
+        return
+
+    logging.info(f"[SETTINGS] Applying {len(commands)} settings: {command}")
+    try:
+        api.exec_command(command, priority=api.CONTROL).result(SETTINGS_APPLY_TIMEOUT)
+    except Exception as e:
+        logging.error(f"[SETTINGS] Failed to apply settings: {e}")
+        return
+
+    sync_current_settings_to_vps()
+    SETTINGS_STATS['syncs'] += 1
+
+def settings_flusher():
+    """Apply the pending settings batch once its burst of changes settled"""
+    global SETTINGS_RESTART
+
+    logging.info("Settings flusher started")
+    while True:
+        try:
+            with SETTINGS_COND:
+                while not PENDING_SETTINGS and not SETTINGS_RESTART:
+                    SETTINGS_COND.wait()
+
+                # Wait for the burst to settle, but not longer than SETTINGS_MAX_WAIT after its first change
+                while not SETTINGS_RESTART:
+                    due = min(SETTINGS_LAST_CHANGE + SETTINGS_DEBOUNCE, SETTINGS_FIRST_CHANGE + SETTINGS_MAX_WAIT)
+                    if time.time() >= due:
+                        break
+                    SETTINGS_COND.wait(due - time.time())
+
+                commands = list(PENDING_SETTINGS.values())
+                restart = SETTINGS_RESTART
+                PENDING_SETTINGS.clear()
+                SETTINGS_RESTART = False
+
+                if CONNECTION.paused and not restart:
+                    # Loading a map, the batch is applied once it's done (see process_queued_settings)
+                    SETTINGS_QUEUE.extend({'command': command} for command in commands)
+                    continue
+
+                SETTINGS_STATS['batches'] += 1
+
+            apply_settings(commands, restart)
+        except Exception as e:
+            logging.error(f"[SETTINGS] Settings flusher failed: {e}")
+
+def start_settings_flusher():
+    global SETTINGS_THREAD
+
+    with SETTINGS_COND:
+        if SETTINGS_THREAD is None:
+            SETTINGS_THREAD = threading.Thread(target=settings_flusher, daemon=True)
+            SETTINGS_THREAD.start()
+
 def process_queued_settings():
-    """Process all queued settings commands after map loading"""
-    global SETTINGS_QUEUE
-    
+    """Process all queued settings commands after map loading, they're merged and applied as one batch"""
     if SETTINGS_QUEUE:
         logging.info(f"[SETTINGS] Processing {len(SETTINGS_QUEUE)} queued settings commands")
-        
-        for content in SETTINGS_QUEUE:
-            execute_settings_command(content)
-        
+
+        queued = list(SETTINGS_QUEUE)
         SETTINGS_QUEUE.clear()
+        for content in queued:
+            execute_settings_command(content)
+
         logging.info("[SETTINGS] Finished processing queued settings commands")
-        
-        # NEW: Sync settings after processing all queued commands
-        import threading
-        def delayed_queue_sync():
-            import time
-            time.sleep(2)  # Wait for all commands to take effect
-            try:
-                sync_current_settings_to_vps()
-                logging.info("[SETTINGS] Synced settings after processing queued commands")
-            except Exception as e:
-                logging.error(f"[SETTINGS] Failed to sync after queue processing: {e}")
-        
-        sync_thread = threading.Thread(target=delayed_queue_sync)
-        sync_thread.daemon = True
-        sync_thread.start()
 
 def get_current_game_settings():
-    """Get current game settings by reading the config file"""
-    settings_file_path = r"D:\Games\defragtv\defrag\settings-current.cfg"
-    
-    # Default values for all cvars
-    default_values = {
-        'r_renderTriggerBrushes': '0',
-        'r_fastsky': '0', 
-        'r_renderClipBrushes': '0',
-        'r_renderSlickSurfaces': '0',
-        'r_mapOverbrightBits': '2',
-        'r_picmip': '0',
-        'r_fullbright': '0',
-        'r_gamma': '1.2',
-        'cg_drawGun': '1',
-        'df_chs1_Info6': '0',
-        'cg_lagometer': '0',
-        'mdd_snap': '3',
-        'mdd_cgaz': '1',
-        'df_chs1_Info5': '23',
-        'df_drawSpeed': '0',
-        'df_chs0_Draw': '1',
-        'df_chs1_Info7': '0',
-        'df_mp_NoDrawRadius': '100',
-        'cg_thirdperson': '0',
-        'df_ghosts_MiniviewDraw': '0',
-        'cg_gibs': '0',
-        'com_blood': '0'
-    }
-    
-    # Mapping from game cvars to UI setting names
-    cvar_to_setting = {
-        'r_renderTriggerBrushes': 'triggers',
-        'r_fastsky': 'sky',
-        'r_renderClipBrushes': 'clips', 
-        'r_renderSlickSurfaces': 'slick',
-        'r_mapOverbrightBits': 'brightness',
-        'r_picmip': 'picmip',
-        'r_fullbright': 'fullbright',
-        'r_gamma': 'gamma',
-        'cg_drawGun': 'drawgun',
-        'df_chs1_Info6': 'angles',
-        'cg_lagometer': 'lagometer',
-        'mdd_snap': 'snaps',
-        'mdd_cgaz': 'cgaz',
-        'df_chs1_Info5': 'speedinfo',
-        'df_drawSpeed': 'speedorig',
-        'df_chs0_Draw': 'inputs',
-        'df_chs1_Info7': 'obs',
-        'df_mp_NoDrawRadius': 'nodraw',
-        'cg_thirdperson': 'thirdperson',
-        'df_ghosts_MiniviewDraw': 'miniview',
-        'cg_gibs': 'gibs',
-        'com_blood': 'blood'
-    }
-    
+    """Get current game settings, from the cvar shadow when it's fresh or else from a config written by the engine"""
     try:
+        # The cvar shadow knows the engine's values as long as it was reconciled since the last reconnect/vid_restart
+        if cvars.fresh():
+            return settings.to_ui({name: cvars.get(name) for name in settings.BY_CVAR})
+
+        try:
+            previous_mtime = os.path.getmtime(settings.SETTINGS_CFG_P)
+        except OSError:
+            previous_mtime = None
+
         # Execute writeconfig command to generate current settings file
-        logging.info("[SETTINGS] Writing current config to settings-current.cfg")
-        api.exec_command("writeconfig settings-current.cfg")
-        
+        logging.info(f"[SETTINGS] Writing current config to {settings.SETTINGS_CFG}")
+        api.exec_command(f"writeconfig {settings.SETTINGS_CFG}", priority=api.CONTROL).result(SETTINGS_APPLY_TIMEOUT)
+
         # Wait for file to be written
-        time.sleep(0.5)
-        
-        # Check if file exists
-        if not os.path.exists(settings_file_path):
-            logging.error(f"[SETTINGS] Config file not found: {settings_file_path}")
-            return {}
-        
-        # Read the config file and parse cvar values
-        current_values = {}
-        
-        with open(settings_file_path, 'r') as f:
-            content = f.read()
-            
-        # Parse each line to find cvar settings
-        for line in content.split('\n'):
-            line = line.strip()
-            
-            # Skip comments and empty lines
-            if not line or line.startswith('//') or line.startswith('#'):
-                continue
-                
-            # Look for "seta cvar_name value" format
-            if line.startswith('seta '):
-                parts = line.split()
-                if len(parts) >= 3:
-                    cvar_name = parts[1]
-                    cvar_value = parts[2].strip('"')  # Remove quotes if present
-                    
-                    # Case-insensitive lookup
-                    for default_cvar in default_values.keys():
-                        if cvar_name.lower() == default_cvar.lower():
-                            current_values[default_cvar] = cvar_value
-                            break
-        
-        # Fill in missing cvars with defaults
-        for cvar_name in default_values:
-            if cvar_name not in current_values:
-                current_values[cvar_name] = default_values[cvar_name]
-                logging.info(f"[SETTINGS] Using default value for {cvar_name}: {default_values[cvar_name]}")
-        
-        # Convert to UI setting format
-        ui_settings = {}
-        for cvar_name, cvar_value in current_values.items():
-            if cvar_name in cvar_to_setting:
-                setting_key = cvar_to_setting[cvar_name]
-                
-                # Convert to UI setting format
-                ui_settings = {}
-                for cvar_name, cvar_value in current_values.items():
-                    if cvar_name in cvar_to_setting:
-                        setting_key = cvar_to_setting[cvar_name]
-                        
-                        # Convert values to appropriate types
-                        if setting_key in ['brightness', 'picmip']:
-                            # Integer values that stay as integers
-                            ui_settings[setting_key] = int(cvar_value)
-                        elif setting_key == 'gamma':
-                            # Float value
-                            ui_settings[setting_key] = float(cvar_value)
-                        elif setting_key == 'drawgun':
-                            # 1 = True, 2 = False
-                            ui_settings[setting_key] = (int(cvar_value) == 1)
-                        elif setting_key == 'sky':
-                            # 0 = True, 1 = False (reversed!)
-                            ui_settings[setting_key] = (int(cvar_value) == 0)
-                        elif setting_key == 'angles':
-                            # 40 = True, 0 = False
-                            ui_settings[setting_key] = (int(cvar_value) == 40)
-                        elif setting_key == 'snaps':
-                            # 3 = True, 0 = False - send as boolean
-                            ui_settings[setting_key] = (int(cvar_value) == 3)
-                        elif setting_key == 'speedinfo':
-                            # 23 = True, 0 = False - send as boolean
-                            ui_settings[setting_key] = (int(cvar_value) == 23)
-                        elif setting_key == 'obs':
-                            # 50 = True, 0 = False - send as boolean
-                            ui_settings[setting_key] = (int(cvar_value) == 50)
-                        elif setting_key == 'nodraw':
-                            # 100000 = True, 100 = False - send as boolean
-                            ui_settings[setting_key] = (int(cvar_value) == 100000)
-                        else:
-                            # Standard boolean values (0 = False, anything else = True)
-                            ui_settings[setting_key] = bool(int(cvar_value))
-        
+        deadline = time.time() + SETTINGS_WRITE_TIMEOUT
+        while time.time() < deadline:
+            try:
+                if os.path.getmtime(settings.SETTINGS_CFG_P) != previous_mtime:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.05)
+
+        ui_settings = settings.to_ui(settings.read_config())
         logging.info(f"[SETTINGS] Successfully read current game settings: {ui_settings}")
         return ui_settings
-        
+
     except Exception as e:
         logging.error(f"[SETTINGS] Failed to get current game settings: {e}")
         return {}
@@ -329,6 +260,12 @@ def sync_current_settings_to_vps():
     except Exception as e:
         logging.error(f"[SETTINGS] Failed to sync settings to VPS: {e}")
 
+@functools.lru_cache(maxsize=512)
+def censor_name(name):
+    """Names rarely change between two reports, so only run the (expensive) censoring once per distinct name"""
+    return filters.filter_author(name)
+
+
 def serverstate_to_json():
     data = {
         'bot_id': serverstate.STATE.bot_id,
@@ -347,11 +284,10 @@ def serverstate_to_json():
         data['current_player'] = serverstate.STATE.current_player.__dict__.copy()
 
         if 'n' in data['current_player']:
-            data['current_player']['n'] = filters.filter_author(data['current_player']['n'])
+            data['current_player']['n'] = censor_name(data['current_player']['n'])
             
         # Check for Twitch channels in current player's c1 field and add live status
         if 'c1' in data['current_player'] and data['current_player']['c1'] and 'twitch.tv/' in data['current_player']['c1']:
-            import re
             # Extract username from twitch.tv/username format (handles both twitch.tv/ and nospec.twitch.tv/)
             match = re.search(r'twitch\.tv/([^,\s]+)', data['current_player']['c1'])
             if match:
@@ -359,12 +295,11 @@ def serverstate_to_json():
                 # Remove any existing ,live or ,not suffix
                 base_c1 = re.sub(r',(?:live|not)$', '', data['current_player']['c1'])
 
-                # First check if the Twitch account exists
-                if not serverstate.check_twitch_account_exists(username):
+                # Status comes from the background refresher, this never waits on the Twitch API
+                exists, is_live = serverstate.get_twitch_status(username)
+                if not exists:
                     data['current_player']['c1'] = 'invalid-twitch-account'
                 else:
-                    # Check if channel is live
-                    is_live = serverstate.check_twitch_channel_live(username)
                     suffix = ',live' if is_live else ',not'
                     data['current_player']['c1'] = base_c1 + suffix
     else:
@@ -374,11 +309,10 @@ def serverstate_to_json():
         pl_dict = pl.__dict__.copy()  # Make a copy to avoid modifying original
 
         if 'n' in pl_dict:
-            pl_dict['n'] = filters.filter_author(pl_dict['n'])
+            pl_dict['n'] = censor_name(pl_dict['n'])
 
         # Check for Twitch channels in c1 field and add live status
         if 'c1' in pl_dict and pl_dict['c1'] and 'twitch.tv/' in pl_dict['c1']:
-            import re
             # Extract username from twitch.tv/username format (handles both twitch.tv/ and nospec.twitch.tv/)
             match = re.search(r'twitch\.tv/([^,\s]+)', pl_dict['c1'])
             if match:
@@ -386,12 +320,11 @@ def serverstate_to_json():
                 # Remove any existing ,live or ,not suffix
                 base_c1 = re.sub(r',(?:live|not)$', '', pl_dict['c1'])
 
-                # First check if the Twitch account exists
-                if not serverstate.check_twitch_account_exists(username):
+                # Status comes from the background refresher, this never waits on the Twitch API
+                exists, is_live = serverstate.get_twitch_status(username)
+                if not exists:
                     pl_dict['c1'] = 'invalid-twitch-account'
                 else:
-                    # Check if channel is live
-                    is_live = serverstate.check_twitch_channel_live(username)
                     suffix = ',live' if is_live else ',not'
                     pl_dict['c1'] = base_c1 + suffix
 
@@ -440,6 +373,86 @@ def raw_console_log():
     return output
 
 
+@app.route('/caches.json')
+def cache_stats():
+    output = jsonify(cache.cache_stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/cadence.json')
+def report_cadence():
+    output = jsonify(serverstate.CADENCE.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/scheduler.json')
+def state_loop_scheduler():
+    output = jsonify(serverstate.SCHEDULER.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/connection.json')
+def connection_state():
+    output = jsonify(CONNECTION.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/metrics.json')
+def connection_metrics():
+    output = jsonify(metrics.snapshot())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/commands.json')
+def console_commands():
+    output = jsonify(api.command_stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/cvars.json')
+def cvar_shadow():
+    output = jsonify(cvars.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/sounds.json')
+def sound_player():
+    output = jsonify(sounds.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/probe.json')
+def engine_probe():
+    output = jsonify(probe.stats())
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
+@app.route('/inputs.json')
+def input_history():
+    output = jsonify(inputs.history_message(since=time.time() - 30))
+    output.headers['Access-Control-Allow-Origin'] = '*'
+
+    return output
+
+
 @app.route('/console/delete_message/<id>')
 def delete_message(id):
     output = jsonify({'status': 'ok'})
@@ -468,11 +481,95 @@ def run_flask_server(host, port):
 # - Websocket client
 # ------------------------------------------------------------
 
+def escape_patch_key(key):
+    """Escape a dict key for use in a JSON pointer path (RFC 6901)"""
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def diff_serverstate(old, new, path=''):
+    """
+    Returns the list of JSON-patch operations that turn the `old` serverstate document into `new`.
+    Nested dicts (players, current_player) are diffed field by field, anything else is replaced as a whole.
+    """
+    ops = []
+
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': f"{path}/{escape_patch_key(key)}"})
+
+    for key, value in new.items():
+        key_path = f"{path}/{escape_patch_key(key)}"
+        if key not in old:
+            ops.append({'op': 'add', 'path': key_path, 'value': value})
+            continue
+
+        old_value = old[key]
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            ops.extend(diff_serverstate(old_value, value, key_path))
+        elif value != old_value:
+            ops.append({'op': 'replace', 'path': key_path, 'value': value})
+
+    return ops
+
+
+def send_serverstate_snapshot():
+    """Publish the full serverstate document, used on (re)connect and when the VPS can't be resynced with patches"""
+    global SERVERSTATE_SEQ, LAST_SERVERSTATE
+
+    if serverstate.STATE is None:
+        return
+
+    data = serverstate_to_json()
+
+    with SERVERSTATE_LOCK:
+        if LAST_SERVERSTATE is None or data != LAST_SERVERSTATE:
+            SERVERSTATE_SEQ += 1
+            SERVERSTATE_HISTORY.clear()  # Patches before a snapshot can't be applied on top of it
+        LAST_SERVERSTATE = data
+        console.WS_Q.put(json.dumps({'action': 'serverstate', 'seq': SERVERSTATE_SEQ, 'message': data}))
+
+
+def resync_serverstate(since=None):
+    """
+    Bring a client that last saw version `since` up to date. Replays the missed patches when they are still in
+    the history, otherwise falls back to a full snapshot.
+    """
+    with SERVERSTATE_LOCK:
+        missed = [(seq, patch) for seq, patch in SERVERSTATE_HISTORY if since is not None and seq > since]
+        can_replay = (since is not None and LAST_SERVERSTATE is not None and
+                      (since == SERVERSTATE_SEQ or (missed and missed[0][0] == since + 1)))
+
+        if can_replay:
+            for seq, patch in missed:
+                console.WS_Q.put(json.dumps({'action': 'serverstate_patch', 'seq': seq, 'base': seq - 1, 'patch': patch},
+                                            separators=(',', ':')))
+            logging.info(f"[Serverstate] Resynced from version {since} with {len(missed)} patches")
+            return
+
+    logging.info(f"[Serverstate] Resync from version {since} not possible with patches, sending snapshot")
+    send_serverstate_snapshot()
+
+
 def notify_serverstate_change():
     global SERVERSTATE_CHANGE_COUNTER, LAST_SERVERSTATE_LOG_TIME
+    global SERVERSTATE_SEQ, LAST_SERVERSTATE
+
+    if LAST_SERVERSTATE is None:
+        send_serverstate_snapshot()
+        return
 
     data = serverstate_to_json()
-    console.WS_Q.put(json.dumps({'action': 'serverstate', 'message': data}))
+
+    with SERVERSTATE_LOCK:
+        patch = diff_serverstate(LAST_SERVERSTATE, data)
+        if not patch:
+            return  # Nothing the extension can see has changed
+
+        SERVERSTATE_SEQ += 1
+        SERVERSTATE_HISTORY.append((SERVERSTATE_SEQ, patch))
+        LAST_SERVERSTATE = data
+        console.WS_Q.put(json.dumps({'action': 'serverstate_patch', 'seq': SERVERSTATE_SEQ, 'base': SERVERSTATE_SEQ - 1, 'patch': patch},
+                                    separators=(',', ':')))
 
     # Increment counter
     SERVERSTATE_CHANGE_COUNTER += 1
@@ -486,7 +583,7 @@ def notify_serverstate_change():
     # Only log if it's the interval OR heartbeat (but reset counter on heartbeat to avoid double-log)
     if is_interval or is_heartbeat:
         # Show what changed in a concise way
-        change_info = []
+        change_info = [f"v{SERVERSTATE_SEQ}, {len(patch)} ops"]
         if serverstate.STATE:
             if hasattr(serverstate.STATE, 'num_players'):
                 change_info.append(f"{serverstate.STATE.num_players} players")
@@ -570,6 +667,7 @@ def handle_ws_command(msg):
                     logging.info(f"Manual spectate to {id}")
             
                 api.exec_command(f"follow {id}")
+                serverstate.CADENCE.burst("switch")
                 serverstate.STATE.current_player_id = int(id)  # Convert to int for consistency
                 serverstate.STATE.current_player = serverstate.STATE.get_player_by_id(int(id))
                 api.exec_command(f"cg_centertime 2;displaymessage 140 10 ^3{author} ^7has switched to ^3 Next Player")
@@ -717,7 +815,6 @@ def handle_ws_command(msg):
 
 def remove_color_codes(text):
     """Remove Quake 3 color codes from text for comparison"""
-    import re
     return re.sub(r'\^.', '', text)
 
 def fix_empty_author_message(message_data):
@@ -792,6 +889,11 @@ def on_ws_message(msg):
         handle_settings_command(message)
         return
 
+    # VPS missed serverstate versions (or just started), bring it up to date (BEFORE origin check)
+    if message.get('action') == 'serverstate_resync':
+        resync_serverstate(message.get('since'))
+        return
+
     # if there is no origin, exit
     # this function only processes messages directly from twitch console extension
     if 'origin' not in message:
@@ -914,6 +1016,9 @@ async def ws_start(q):
             
             # Sync current settings to VPS after connecting
             sync_current_settings_to_vps()
+
+            # The VPS may have restarted while we were away, start the serverstate stream with a full snapshot
+            send_serverstate_snapshot()
             
             await asyncio.gather(
                 ws_receive(websocket),
@@ -0,0 +1,30 @@
+"""
+Tests import the modules of src/ directly. Their configuration (src/env.py, never committed) is built from
+env-template.py, with DF_DIR pointing to a temporary game directory and commands going to the pipe transport.
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+DF_DIR = tempfile.mkdtemp(prefix='defraglive-tests-')
+
+
+def load_env():
+    spec = importlib.util.spec_from_file_location('env', os.path.join(SRC_DIR, 'env-template.py'))
+    env = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(env)
+
+    env.environ.update({
+        'DF_DIR': DF_DIR,
+        'ENGINE_TRANSPORT': 'pipe',
+        'AHK_DAEMON': False,
+    })
+    return env
+
+
+os.makedirs(os.path.join(DF_DIR, 'system', 'reports'), exist_ok=True)
+sys.modules['env'] = load_env()
+sys.path.insert(0, os.path.abspath(SRC_DIR))
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import ahk_daemon
+from ahk_daemon import CommandDaemon, DaemonError, WindowLostError
+
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'stub_ahk_daemon.py')
+
+
+@pytest.fixture
+def make_daemon(tmp_path):
+    """Start a CommandDaemon running the stub helper with the given options, its acknowledged commands go to .log"""
+    daemons = []
+
+    def make(*options, ack_timeout=2):
+        log = tmp_path / f"helper{len(daemons)}.log"
+        daemon = CommandDaemon(lambda target: [sys.executable, STUB, str(target), '--log', str(log), *options],
+                               name='stub-daemon', ack_timeout=ack_timeout)
+        daemon.log = log
+        daemons.append(daemon)
+        daemon.start(1234)
+        return daemon
+
+    yield make
+    for daemon in daemons:
+        daemon.stop()
+
+
+def test_ready_handshake(make_daemon):
+    daemon = make_daemon()
+
+    stats = daemon.stats()
+    assert daemon.alive
+    assert stats['starts'] == 1
+    assert stats['pid'] == daemon.process.pid
+    assert stats['target'] == 1234
+
+
+@pytest.mark.parametrize('script', ['import time; time.sleep(10)', 'pass'])
+def test_helper_that_never_gets_ready_fails_to_start(monkeypatch, script):
+    monkeypatch.setattr(ahk_daemon, 'READY_TIMEOUT', 0.5)
+    daemon = CommandDaemon(lambda target: [sys.executable, '-c', script])
+
+    with pytest.raises(DaemonError):
+        daemon.start(1234)
+    assert daemon.stats()['starts'] == 0
+
+
+def test_commands_are_acknowledged(make_daemon):
+    daemon = make_daemon()
+
+    assert daemon.send('say hello')
+    assert daemon.ping()
+    assert daemon.send('echo multi\nline')
+
+    assert daemon.log.read_text() == "1234 say hello\n1234 echo multi line\n"
+    assert daemon.stats()['acks'] == 3
+    assert daemon.stats()['pending'] == 0
+
+
+def test_lost_window_raises_window_lost_error(make_daemon):
+    daemon = make_daemon('--lose-window-after', '2')
+
+    assert daemon.send('say hello')
+    with pytest.raises(WindowLostError):
+        daemon.send('say bye')
+
+    assert daemon.alive  # Only the window is gone, the helper keeps running
+    assert daemon.stats()['errors'] == 1
+
+
+def test_crash_fails_pending_commands(make_daemon):
+    # The helper takes 0.5s to acknowledge the first command, the others queue up behind it until it crashes
+    daemon = make_daemon('--crash-after', '2', '--delay', '0.5', ack_timeout=5)
+    results = []
+
+    def send(line):
+        try:
+            results.append(daemon.send(line))
+        except Exception as e:
+            results.append(e)
+
+    since = time.time()
+    threads = [threading.Thread(target=send, args=(f"say {i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    errors = [result for result in results if result is not True]
+    assert len(errors) == 2
+    assert all(type(e) is DaemonError and 'exited' in str(e) for e in errors)
+    assert time.time() - since < 5  # Failed by the crash, not by the ack timeout
+    assert daemon.stats()['crashes'] == 1
+    assert daemon.stats()['pending'] == 0
+
+
+def test_crashed_helper_is_restarted_after_backoff(monkeypatch, make_daemon):
+    monkeypatch.setattr(ahk_daemon, 'RESTART_BACKOFF', 0.5)
+    daemon = make_daemon('--crash-after', '2')
+    crashed = daemon.process
+
+    assert daemon.send('say 1')
+    with pytest.raises(DaemonError):
+        daemon.send('say 2')
+    crashed.wait(5)
+
+    with pytest.raises(DaemonError, match='restarting'):
+        daemon.send('say 3')
+
+    time.sleep(ahk_daemon.RESTART_BACKOFF)
+    assert daemon.send('say 4')
+    assert daemon.process is not crashed
+    assert daemon.stats()['starts'] == 2
+    assert daemon.log.read_text() == "1234 say 1\n1234 say 4\n"
+
+
+def test_ack_timeout_kills_the_helper(make_daemon):
+    daemon = make_daemon('--delay', '2', ack_timeout=0.3)
+    stuck = daemon.process
+
+    with pytest.raises(DaemonError, match='acknowledge'):
+        daemon.send('say hello')
+
+    assert stuck.wait(5) is not None
+    assert not daemon.alive
+    assert daemon.stats()['timeouts'] == 1
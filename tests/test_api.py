@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import api
+import cvars
+import scheduler
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """
+    Empty command queues and full buckets, console lines collected instead of sent. The tests flush the queues
+    themselves: a flusher started by an earlier test keeps waiting on the old queues' condition.
+    """
+    monkeypatch.setattr(api, 'COMMAND_QUEUES', {priority: deque() for priority in api.PRIORITIES})
+    monkeypatch.setattr(api, 'COMMAND_COND', threading.Condition())
+    monkeypatch.setattr(api, 'FLUSHER_THREAD', object())
+    monkeypatch.setattr(api, 'BUCKETS', {priority: scheduler.TokenBucket(*limits)
+                                         for priority, limits in api.CLASS_LIMITS.items()})
+    monkeypatch.setattr(cvars, 'filter_command', lambda cmd: (cmd, []))
+
+    lines = []
+    monkeypatch.setattr(api, 'send_line', lines.append)
+    return lines
+
+
+def flush(now=None):
+    batch, wait = api.next_batch(now or time.time())
+    api.flush_commands(batch)
+    return wait
+
+
+def test_classification():
+    assert api.classify('say hello') == api.CHAT
+    assert api.classify('!top') == api.CHAT  # Counted by the server's flood protection too
+    assert api.classify('cg_centertime 2;displaymessage 140 10 hi') == api.HUD
+    assert api.classify('set df_hud_drawSpecfollow 0') == api.HUD
+    assert api.classify('follow 3') == api.CONTROL
+    assert api.classify('follow 3;say hi') == api.CHAT
+
+
+def test_commands_keep_their_order(queue):
+    futures = [api.exec_command(cmd) for cmd in ('follow 3', 'follow 5', 'follow 3')]
+
+    flush()
+
+    assert queue == ['follow 3;follow 5;follow 3']
+    assert len(set(futures)) == 3
+    assert all(future.result(0) for future in futures)
+
+
+def test_barriers_get_their_own_line(queue):
+    for cmd in ('follow 3', 'connect 1.2.3.4', 'team s'):
+        api.exec_command(cmd)
+
+    flush()
+
+    assert queue == ['follow 3', 'connect 1.2.3.4', 'team s']
+
+
+def test_repeated_last_command_is_merged(queue):
+    first = api.exec_command('say hi')
+    second = api.exec_command('say hi')
+    api.exec_command('say bye')
+    third = api.exec_command('say hi')
+
+    assert first is second
+    assert third is not first
+    assert [pending.cmd for pending in api.COMMAND_QUEUES[api.CHAT]] == ['say hi', 'say bye', 'say hi']
+
+
+def test_chat_is_rate_limited(queue):
+    now = time.time()
+    for i in range(3):
+        api.exec_command(f"say {i}")
+
+    wait = flush(now)
+    assert queue == ['say 0']
+    assert wait == pytest.approx(1 / api.CLASS_LIMITS[api.CHAT][0])
+
+    flush(now + wait)
+    assert queue == ['say 0', 'say 1']
+
+
+def test_control_commands_are_not_held_by_chat(queue):
+    now = time.time()
+    api.exec_command('say 0')
+    api.exec_command('say 1')
+    api.exec_command('follow 3')
+
+    flush(now)
+
+    assert queue == ['say 0;follow 3']
+    assert len(api.COMMAND_QUEUES[api.CHAT]) == 1
+
+
+def test_expired_commands_are_dropped(queue):
+    future = api.exec_command('say late', expires=1)
+
+    flush(time.time() + 2)
+
+    assert queue == []
+    assert future.cancelled()
+
+
+def test_waiting_on_a_dropped_command_raises_a_regular_exception(queue):
+    # The "flusher" only gets to the command once it has expired
+    threading.Timer(0.1, flush, args=(time.time() + 60,)).start()
+
+    with pytest.raises(api.CommandDroppedError):
+        api.exec_command('say late', wait=True)
+
+
+def test_chat_queued_before_leaving_is_dropped(queue):
+    now = time.time()
+    api.exec_command('say 0')
+    chat = api.exec_command('say 1')  # Held by the rate limit
+    hud = api.exec_command('cg_centertime 2;displaymessage 140 10 hi')
+    api.exec_command('connect 1.2.3.4')
+    later = api.exec_command('say 2')
+    api.COMMAND_QUEUES[api.CHAT][-1].queued_at = now + 1  # Queued after the connect
+
+    flush(now)
+
+    assert queue == ['say 0;cg_centertime 2;displaymessage 140 10 hi', 'connect 1.2.3.4']
+    assert hud.done() and not hud.cancelled()
+    assert chat.cancelled()
+    assert not later.done()
+
+
+def test_send_failure_fails_the_line(queue, monkeypatch):
+    def fail(line):
+        raise api.WindowNotFoundError("Engine not running")
+    monkeypatch.setattr(api, 'send_line', fail)
+
+    futures = [api.exec_command('follow 3'), api.exec_command('team s')]
+    flush()
+
+    assert all(isinstance(future.exception(0), api.WindowNotFoundError) for future in futures)
@@ -0,0 +1,116 @@
+import threading
+import time
+import types
+
+import pytest
+
+import connection
+import cvars
+
+
+@pytest.fixture
+def shadow(monkeypatch):
+    """An empty, reconciled shadow"""
+    monkeypatch.setattr(cvars, 'SHADOW', {})
+    monkeypatch.setattr(cvars, 'SET_AT', {})
+    monkeypatch.setattr(cvars, 'STALE', False)
+    monkeypatch.setattr(cvars, 'PAUSES', 0)
+    monkeypatch.setattr(cvars, 'RECONCILE_THREAD', None)
+    monkeypatch.setattr(cvars, 'STATS', dict.fromkeys(cvars.STATS, 0))
+    return cvars.SHADOW
+
+
+@pytest.mark.parametrize('part, expected', [
+    ('set r_gamma 1.2', ('r_gamma', '1.2')),
+    ('seta name "Defrag Live"', ('name', 'Defrag Live')),
+    ('SETA cg_fov 110', ('cg_fov', '110')),
+    ('df_hud_drawSpecfollow 0', ('df_hud_drawSpecfollow', '0')),
+    ('cg_centertime 2 extra', None),  # Bare sets only take one value
+    ('color1 nospec', None),  # Unknown bare name
+    ('follow 3', None),
+    ('say set a b', None),
+    ('set r_gamma', None),
+    ('seta name "unbalanced', None),
+    ('', None),
+])
+def test_parse_set(shadow, part, expected):
+    assert cvars.parse_set(part) == expected
+
+
+def test_bare_set_of_a_known_cvar(shadow):
+    shadow['color1'] = 'x'
+
+    assert cvars.parse_set('color1 nospec') == ('color1', 'nospec')
+
+
+def test_redundant_sets_are_dropped(shadow):
+    assert cvars.filter_command('set r_gamma 1.2;follow 3') == ('set r_gamma 1.2;follow 3', ['r_gamma'])
+
+    assert cvars.filter_command('follow 3;set r_gamma 1.2;cg_fov 110') == ('follow 3;cg_fov 110', ['cg_fov'])
+    assert cvars.filter_command('R_GAMMA 1.2;cg_fov 110') == ('', [])
+    assert cvars.get('r_gamma') == '1.2'
+    assert cvars.STATS['redundant'] == 3
+
+
+def test_stale_shadow_sends_every_set(shadow, monkeypatch):
+    cvars.filter_command('set r_gamma 1.2')
+    monkeypatch.setattr(cvars, 'STALE', True)
+
+    assert cvars.filter_command('set r_gamma 1.2') == ('set r_gamma 1.2', ['r_gamma'])
+
+
+def test_rejected_set_is_forgotten(shadow):
+    cvars.filter_command('set sv_cheats 1')
+
+    assert cvars.parse_line('sv_cheats is cheat protected.')
+    assert cvars.get('sv_cheats') is None
+    assert cvars.filter_command('set sv_cheats 1')[0] == 'set sv_cheats 1'
+
+
+def test_load_keeps_values_set_during_the_reconcile(shadow, monkeypatch):
+    monkeypatch.setattr(cvars, 'STALE', True)
+    cvars.filter_command('set r_gamma 1;set cg_fov 90')
+    since = time.time()
+    cvars.SET_AT['r_gamma'] = since - 1  # Set before the writeconfig, the engine's value wins
+    cvars.filter_command('set cg_fov 110')  # Set while the engine was writing the config
+
+    assert cvars.load({'r_gamma': '1.5', 'cg_fov': '90', 'com_maxfps': '125'}, since, pauses=0)
+
+    assert shadow == {'r_gamma': '1.5', 'cg_fov': '110', 'com_maxfps': '125'}
+    assert cvars.fresh()
+
+
+def test_load_after_a_pause_is_refused(shadow):
+    cvars.filter_command('set r_gamma 1')
+    pauses = cvars.PAUSES
+    cvars.track_connection(types.SimpleNamespace(paused=True), None, None, 'map change')
+
+    assert not cvars.load({'r_gamma': '2'}, time.time(), pauses)
+
+    assert cvars.STALE
+    assert cvars.get('r_gamma') == '1'
+
+
+def test_resume_reconciles_once(shadow, monkeypatch):
+    monkeypatch.setattr(connection, 'CONNECTION', types.SimpleNamespace(paused=False))
+    release = threading.Event()
+    calls = []
+
+    def reconcile():
+        calls.append(cvars.PAUSES)
+        release.wait(5)
+        return cvars.load({}, time.time(), calls[-1])
+    monkeypatch.setattr(cvars, 'reconcile', reconcile)
+
+    cvars.track_connection(types.SimpleNamespace(paused=True), None, None, 'map change')
+    cvars.track_connection(types.SimpleNamespace(paused=False), None, None, 'loaded')
+    thread = cvars.RECONCILE_THREAD
+    cvars.track_connection(types.SimpleNamespace(paused=False), None, None, 'loaded')  # Already reconciling
+    assert cvars.RECONCILE_THREAD is thread
+
+    release.set()
+    thread.join(5)
+
+    assert calls == [1]
+    assert not cvars.STALE
+    assert cvars.RECONCILE_THREAD is None
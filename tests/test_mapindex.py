@@ -0,0 +1,79 @@
+import io
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+import mapindex
+
+
+def pk3(*names):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as archive:
+        for name in names:
+            archive.writestr(name, b'IBSP')
+    return data.getvalue()
+
+
+BODIES = {
+    '/st1': pk3('maps/st1.bsp', 'levelshots/st1.jpg'),
+    '/other': pk3('maps/something-else.bsp'),
+    '/html': b'<html>Map not found</html>',
+}
+
+
+@pytest.fixture
+def download_url(monkeypatch):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = BODIES.get(self.path)
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Length', str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(mapindex, 'MAP_DOWNLOAD_URL', f"http://127.0.0.1:{server.server_address[1]}/{{}}")
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+def target(name):
+    return os.path.join(config.DF_DIR, f"{name}.pk3")
+
+
+def test_valid_map_is_downloaded(download_url):
+    assert mapindex.predownload('st1')
+    assert mapindex.maps_in_archive(target('st1')) == ['st1']
+
+
+@pytest.mark.parametrize('name', ['other', 'html', 'missing'])
+def test_invalid_downloads_are_discarded(download_url, name):
+    assert not mapindex.predownload(name)
+    assert not os.path.exists(target(name))
+    assert not os.path.exists(target(name) + '.part')
+
+
+def test_no_download_without_url(monkeypatch):
+    monkeypatch.setattr(mapindex, 'MAP_DOWNLOAD_URL', '')
+    assert not mapindex.predownload('st1')
+
+
+@pytest.mark.parametrize('name', ['../st1', '../../etc/evil', '/tmp/st1', 'st1/../../x', '', 'st 1'])
+def test_unsafe_names_are_rejected(download_url, name):
+    BODIES['/' + name] = BODIES['/st1']
+    try:
+        assert not mapindex.predownload(name)
+    finally:
+        del BODIES['/' + name]
+    parent = os.path.dirname(os.path.abspath(config.DF_DIR))
+    assert not os.path.exists(os.path.join(parent, 'st1.pk3.part'))
+    assert not os.path.exists(os.path.join(parent, 'st1.pk3'))
@@ -0,0 +1,144 @@
+import asyncio
+import types
+
+import prober
+import servers
+
+
+STATUS = (prober.STATUS_RESPONSE + b'\n\\sv_hostname\\Test server\\mapname\\st1\n'
+          b'0 0 "^1Bot"\n120 45 "^2Racer"\n0 30 "^7LIVE"\n')
+
+
+class FakeServer(asyncio.DatagramProtocol):
+    """Answers getstatus queries, after ignoring the first `drop` of them"""
+
+    def __init__(self, drop=0):
+        self.drop = drop
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data != prober.GETSTATUS:
+            return
+        self.queries += 1
+        if self.queries > self.drop:
+            self.transport.sendto(STATUS, addr)
+
+
+def run_probe(servers_drop, **kwargs):
+    """Probe one fake server per entry of `servers_drop` (None for a server that never answers)"""
+
+    async def probe_fakes():
+        loop = asyncio.get_running_loop()
+        fakes, addresses = [], []
+        for drop in servers_drop:
+            fake = FakeServer(drop if drop is not None else float('inf'))
+            transport, _ = await loop.create_datagram_endpoint(lambda: fake, local_addr=('127.0.0.1', 0))
+            fakes.append((fake, transport))
+            addresses.append(f"127.0.0.1:{transport.get_extra_info('sockname')[1]}")
+
+        try:
+            results = await prober.probe_servers(addresses, timeout=0.2, **kwargs)
+        finally:
+            for _, transport in fakes:
+                transport.close()
+        return [results[address] for address in addresses], [fake for fake, _ in fakes]
+
+    return asyncio.run(probe_fakes())
+
+
+def test_status_response_is_parsed():
+    (result,), _ = run_probe([0])
+
+    assert result.info['mapname'] == 'st1'
+    assert result.players == [(0, 0, '^1Bot'), (120, 45, '^2Racer'), (0, 30, '^7LIVE')]
+    assert len(result.humans) == 2
+    assert result.count_humans(exclude='live') == 1
+    assert result.rtt >= 0
+
+
+def test_lost_packet_is_retried():
+    (result,), (fake,) = run_probe([1])
+
+    assert result is not None
+    assert fake.queries == 2
+
+
+def test_silent_server_is_none():
+    (answered, silent), (_, fake) = run_probe([0, None], retries=2)
+
+    assert answered is not None
+    assert silent is None
+    assert fake.queries == 3
+
+
+def reset_servers():
+    servers.PROBE_RESULTS.clear()
+    servers.PROBE_MISSES.clear()
+    servers.set_own_player(None, None)
+
+
+def test_server_is_down_after_consecutive_misses():
+    reset_servers()
+    ip = '10.0.0.1:27960'
+    (result,), _ = run_probe([0])
+    servers.update_probe_results({ip: result})
+
+    for miss in range(servers.PROBE_MAX_MISSES - 1):
+        servers.update_probe_results({ip: None})
+        merged = servers.merge_probe_results({ip: 2}, servers.PROBE_RESULTS[ip][1])
+        assert merged[ip] == 2, f"dropped after {miss + 1} misses"
+
+    servers.update_probe_results({ip: None})
+    assert servers.merge_probe_results({ip: 2}, servers.PROBE_RESULTS[ip][1])[ip] == 0
+
+    servers.update_probe_results({ip: result})
+    assert servers.PROBE_MISSES == {}
+
+
+def test_bot_is_not_counted_on_its_server():
+    reset_servers()
+    ip, other = '10.0.0.1:27960', '10.0.0.2:27960'
+    (result,), _ = run_probe([0])
+    servers.update_probe_results({ip: result, other: result})
+    servers.set_own_player('10.0.0.1', '^7Live')
+
+    merged = servers.merge_probe_results({ip: 5, other: 5}, servers.PROBE_RESULTS[ip][1])
+    assert merged == {ip: 1, other: 2}
+
+
+def test_probe_only_lowers_counts():
+    reset_servers()
+    ip, empty = '10.0.0.1:27960', '10.0.0.2:27960'
+    (result,), _ = run_probe([0])
+    servers.update_probe_results({ip: result, empty: result})
+
+    # getstatus lists spectators with a ping too, a server the feed has as empty may only have spectators
+    assert servers.merge_probe_results({ip: 1}, servers.PROBE_RESULTS[ip][1]) == {ip: 1}
+
+
+def test_probe_targets(monkeypatch):
+    data = {
+        'active': {'51.15.0.5:27960': {}, '51.15.0.5:27961': {}, '94.23.0.7:27960': {}, '127.0.0.1:27960': {}},
+        'empty': {'51.15.0.9:27960': {}, '192.168.1.20:27960': {}},
+    }
+    monkeypatch.setattr(servers.FEED, 'snapshot', lambda: types.SimpleNamespace(data=data))
+    monkeypatch.setattr(servers.config, 'get_list', lambda name: ['51.15.0.5', 'au.example', '127.0.0.1',
+                                                                  '192.168.1.20', 'gone.example'])
+    lookups = []
+
+    def gethostbyname_ex(host):
+        lookups.append(host)
+        if host == 'gone.example':
+            raise OSError("Name or service not known")
+        return host, [], ['51.15.0.9'] if host == 'au.example' else [host]
+
+    monkeypatch.setattr(servers.socket, 'gethostbyname_ex', gethostbyname_ex)
+    monkeypatch.setattr(servers, 'RESOLVED_HOSTS', {})
+
+    expected = ['51.15.0.5:27960', '51.15.0.5:27961', '51.15.0.9:27960']
+    assert servers.get_probe_targets() == expected
+    assert servers.get_probe_targets() == expected
+    assert sorted(lookups) == ['127.0.0.1', '192.168.1.20', '51.15.0.5', 'au.example', 'gone.example']
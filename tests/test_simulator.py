@@ -0,0 +1,64 @@
+import os
+import time
+
+import serverstate
+import simulator
+
+
+SPEED = 100  # The basic scenario's 260s take 2.6s
+SECRET = 'simsecret'
+
+
+def read_report(engine):
+    """Have the engine write a report with the bot's inputs in color2 and parse it the way the state loop does"""
+    path = os.path.join(engine.reports_dir, 'serverstate.txt')
+    if os.path.exists(path):
+        os.remove(path)
+    engine.execute("varmath color2 = $chsinfo(152);svinfo_report serverstate.txt")
+    if not os.path.exists(path):
+        return None, None  # Loading
+    server_info, players, _ = serverstate.get_svinfo_report(path)
+    return server_info, players
+
+
+def test_basic_scenario(tmp_path):
+    engine = simulator.FakeEngine(str(tmp_path), simulator.basic_scenario(), SPEED)
+    engine.start('127.0.0.1:27960')
+    engine.execute(f"seta color1 {SECRET}")  # Picked up by the bot's client once the map is loaded
+
+    maps, following, afk = set(), None, set()
+    end = time.time() + 270 / SPEED
+    try:
+        while time.time() < end:
+            server_info, players = read_report(engine)
+            if server_info is None:
+                following = None
+                time.sleep(0.005)
+                continue
+
+            maps.add(server_info['mapname'])
+            assert server_info['ip'] == '127.0.0.1:27960'
+            assert server_info['defrag_gametype'] == '1'
+            assert server_info['sv_maxclients'] == '32'
+
+            bot = next(player for player in players if player.c1 == SECRET)
+            if following is not None and not bot.c2:  # The followed player doesn't press anything
+                afk.add(following)
+
+            # A minimal bot: keep following a spectatable player that isn't AFK
+            spectatable = [player.id for player in players if player is not bot and player.t != '3'
+                           and player.c1 not in ('nospec', 'nospecpm') and player.id not in afk]
+            if following not in spectatable and spectatable:
+                following = spectatable[0]
+                engine.execute(f"follow {following}")
+            time.sleep(0.005)
+    finally:
+        engine.stop()
+
+    assert maps == {'st1', 'st2'}
+    assert os.path.getsize(os.path.join(str(tmp_path), 'qconsole.log')) > 0
+
+    switch = engine.stats()['latencies']['switch']
+    assert switch['count'] >= 2  # Alpha turning nospec, Bravo going AFK
+    assert switch['max'] < 1
+    assert engine.stats()['latencies']['recovery']['count'] == 0
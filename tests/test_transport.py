@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+import transport
+
+
+def test_transports_must_implement_the_engine_calls():
+    class Partial(transport.EngineTransport):
+        def init(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.fixture
+def pipe():
+    """A PipeTransport writing to a pipe nobody drains yet, and a function reading what the client got"""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+    pipe = transport.PipeTransport()
+    pipe.fd = write_fd
+
+    def drain():
+        os.set_blocking(read_fd, False)
+        data = b''
+        try:
+            while True:
+                data += os.read(read_fd, 65536)
+        except BlockingIOError:
+            return data
+
+    yield pipe, drain
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_line_cut_by_a_full_pipe_is_finished_first(pipe):
+    pipe, drain = pipe
+    long_line = 'echo ' + 'x' * 100000  # More than the pipe buffer holds
+
+    with pytest.raises(transport.WindowNotFoundError):
+        pipe.send_line(long_line)
+    received = drain()
+    assert 0 < len(received) < len(long_line)
+
+    pipe.send_line('say hello')
+    assert (received + drain()).decode().split('\n') == [long_line, 'say hello', '']
+
+
+def test_line_is_dropped_while_the_old_one_is_unfinished(pipe):
+    pipe, drain = pipe
+    long_line = 'echo ' + 'x' * 100000
+
+    with pytest.raises(transport.WindowNotFoundError):
+        pipe.send_line(long_line)
+    with pytest.raises(transport.WindowNotFoundError):
+        pipe.send_line('say dropped')  # The pipe is still full
+
+    received = drain()
+    pipe.send_line('say hello')
+    assert (received + drain()).decode().split('\n') == [long_line, 'say hello', '']
+
+
+def test_ahk_transport_is_degraded_without_its_helper(tmp_path):
+    # AutoHotkey only exists on Windows, the helper is the stub the daemon tests use
+    stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'stub_ahk_daemon.py')
+    ahk = object.__new__(transport.AhkTransport)
+    ahk.daemon = transport.ahk_daemon.CommandDaemon(lambda target: [sys.executable, stub, str(target)])
+    assert ahk.degraded  # Never started
+
+    ahk.daemon.start(1234)
+    try:
+        assert not ahk.degraded
+    finally:
+        ahk.daemon.stop()
+    assert ahk.degraded
+
+    assert not transport.PipeTransport().degraded
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import twitch_api
+
+
+class StubTwitch:
+    """Local stand-in for the token endpoint and the Helix users/streams endpoints"""
+
+    def __init__(self):
+        self.token_requests = 0
+        self.helix_requests = []  # (endpoint, logins) of every Helix request
+        self.revoked = set()  # Tokens answered with a 401
+        self.delay = 0
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub.lock:
+                    stub.token_requests += 1
+                    token = f"token{stub.token_requests}"
+                self.reply(200, {'access_token': token, 'expires_in': 3600})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.rsplit('/', 1)[-1]
+                param = 'login' if endpoint == 'users' else 'user_login'
+                logins = parse_qs(url.query).get(param, [])
+
+                if self.headers['Authorization'].split()[-1] in stub.revoked:
+                    self.reply(401, {'message': 'Invalid OAuth token'})
+                    return
+
+                with stub.lock:
+                    stub.helix_requests.append((endpoint, logins))
+                time.sleep(stub.delay)
+                # Every login exists, and is live unless its name starts with 'off'
+                data = [{param: login, 'viewer_count': 5} for login in logins
+                        if endpoint == 'users' or not login.startswith('off')]
+                self.reply(200, {'data': data})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    stub = StubTwitch()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def client(stub):
+    return twitch_api.HelixClient('id', 'secret', token_url=f"{stub.url}/token", helix_url=f"{stub.url}/helix",
+                                  timeout=5)
+
+
+def test_token_is_cached(stub, client):
+    client.get_users(['alice'])
+    client.get_streams(['bob'])
+
+    assert stub.token_requests == 1
+    assert len(stub.helix_requests) == 2
+
+
+def test_rejected_token_is_refreshed_once(stub, client):
+    client.get_users(['alice'])
+    stub.revoked.add('token1')
+
+    assert client.get_users(['bob']) == {'bob': {'login': 'bob', 'viewer_count': 5}}
+    assert stub.token_requests == 2
+    assert client.get_token() == 'token2'
+
+
+def test_logins_are_batched_by_100(stub, client):
+    logins = [f"Player{i}" for i in range(250)]
+
+    users = client.get_users(logins + ['player0'])  # Case-insensitive duplicate
+
+    assert [len(batch) for _, batch in stub.helix_requests] == [100, 100, 50]
+    assert len(users) == 250
+    assert users['player249']['login'] == 'player249'
+
+
+def test_missing_logins_map_to_none(stub, client):
+    assert client.get_streams(['live', 'offline']) == {'live': {'user_login': 'live', 'viewer_count': 5},
+                                                      'offline': None}
+    assert client.get_viewer_count('offline') == 0
+
+
+def test_concurrent_lookups_are_coalesced(stub, client):
+    stub.delay = 0.3
+    client.get_token()
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(client.get_users(['alice']))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)  # All start while the first request is in flight
+    for thread in threads:
+        thread.join()
+
+    assert stub.helix_requests == [('users', ['alice'])]
+    assert len(results) == 5 and all(result['alice']['login'] == 'alice' for result in results)
+
+
+def test_waiting_lookups_get_the_owner_error(stub, client):
+    stub.delay = 0.3
+    client.get_token()
+    stub.revoked.add('token1')
+    stub.server.RequestHandlerClass.do_POST = lambda self: self.reply(500, {})  # The token can't be refreshed
+    errors = []
+
+    def lookup():
+        try:
+            client.get_users(['alice'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookup) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert client._pending == {}
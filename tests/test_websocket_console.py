@@ -0,0 +1,163 @@
+import copy
+import json
+import queue
+import types
+from collections import deque
+
+import pytest
+
+import console
+import serverstate
+import websocket_console
+
+
+def apply_patch(document, patch):
+    """Apply the add/remove/replace operations of a JSON-patch (RFC 6902) the way the VPS does"""
+    document = copy.deepcopy(document)
+    for op in patch:
+        keys = [key.replace('~1', '/').replace('~0', '~') for key in op['path'].split('/')[1:]]
+        parent = document
+        for key in keys[:-1]:
+            parent = parent[key]
+
+        if op['op'] == 'remove':
+            del parent[keys[-1]]
+        elif op['op'] == 'add':
+            assert keys[-1] not in parent
+            parent[keys[-1]] = op['value']
+        else:
+            assert op['op'] == 'replace' and keys[-1] in parent
+            parent[keys[-1]] = op['value']
+    return document
+
+
+def player(id, name, **fields):
+    return {'id': id, 'n': name, 't': '0', 'c1': '', **fields}
+
+
+BASE = {
+    'bot_id': '0',
+    'current_player_id': '1',
+    'mapname': 'st1',
+    'num_players': 2,
+    'players': {'0': player('0', 'bot', t='3'), '1': player('1', 'alpha')},
+    'current_player': player('1', 'alpha'),
+}
+
+
+def updated(document, **changes):
+    document = copy.deepcopy(document)
+    document.update(changes)
+    return document
+
+
+DOCUMENTS = [
+    BASE,
+    # A player joins
+    updated(BASE, num_players=3, players={**BASE['players'], '2': player('2', 'bravo')}),
+    # One of their fields changes
+    updated(BASE, num_players=3, players={**BASE['players'], '2': player('2', 'bravo', c1='nospec')}),
+    # The followed player leaves, nobody is followed for a moment
+    {key: value for key, value in updated(BASE, current_player_id='2', players={
+        '0': BASE['players']['0'], '2': player('2', 'bravo', c1='nospec')}).items() if key != 'current_player'},
+    # Keys that have to be escaped in the patch paths
+    updated(BASE, players={'0': BASE['players']['0'], 'a/b': player('a/b', 'x'), 'c~1': player('c~1', 'y')},
+            current_player=player('a/b', 'x')),
+    updated(BASE, mapname='st2', players={'a/b': player('a/b', 'x', t='3')}, current_player=None),
+]
+
+
+@pytest.mark.parametrize('old, new', list(zip(DOCUMENTS, DOCUMENTS[1:])))
+def test_patch_turns_the_old_document_into_the_new_one(old, new):
+    patch = websocket_console.diff_serverstate(old, new)
+
+    assert apply_patch(old, patch) == new
+    assert json.loads(json.dumps(patch)) == patch
+
+
+def test_keys_are_escaped_in_paths():
+    patch = websocket_console.diff_serverstate(DOCUMENTS[3], DOCUMENTS[4])
+
+    paths = {op['path'] for op in patch if op['op'] == 'add'}
+    assert {'/players/a~1b', '/players/c~01', '/current_player'} <= paths
+
+
+def test_unchanged_document_has_an_empty_patch():
+    assert websocket_console.diff_serverstate(BASE, copy.deepcopy(BASE)) == []
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """Publishes the documents given to it, returns the messages sent to the VPS since the last call"""
+    monkeypatch.setattr(websocket_console, 'SERVERSTATE_SEQ', 0)
+    monkeypatch.setattr(websocket_console, 'LAST_SERVERSTATE', None)
+    monkeypatch.setattr(websocket_console, 'SERVERSTATE_HISTORY', deque(maxlen=3))
+    monkeypatch.setattr(serverstate, 'STATE', types.SimpleNamespace(num_players=2))
+    ws_q = queue.Queue()
+    monkeypatch.setattr(console, 'WS_Q', ws_q)
+    current = {}
+    monkeypatch.setattr(websocket_console, 'serverstate_to_json', lambda: copy.deepcopy(current['document']))
+
+    def publish(document=None):
+        if document is not None:
+            current['document'] = document
+            websocket_console.notify_serverstate_change()
+        messages = []
+        while not ws_q.empty():
+            messages.append(json.loads(ws_q.get()))
+        return messages
+
+    return publish
+
+
+def apply_messages(client, messages):
+    """Update the client's (seq, document) with what it was sent, checking the patches are applied in order"""
+    seq, document = client
+    for message in messages:
+        if message['action'] == 'serverstate':
+            seq, document = message['seq'], message['message']
+        else:
+            assert message['base'] == seq
+            seq, document = message['seq'], apply_patch(document, message['patch'])
+    return seq, document
+
+
+def test_stream_of_patches_follows_the_documents(stream):
+    client = (None, None)
+    for document in DOCUMENTS:
+        client = apply_messages(client, stream(document))
+        assert client[1] == document
+
+    assert client[0] == len(DOCUMENTS)
+
+
+def test_resync_replays_the_missed_patches(stream):
+    client = apply_messages((None, None), stream(DOCUMENTS[0]) + stream(DOCUMENTS[1]))
+    for document in DOCUMENTS[2:5]:  # Lost by the client
+        stream(document)
+
+    websocket_console.resync_serverstate(client[0])
+    messages = stream()
+
+    assert [message['action'] for message in messages] == ['serverstate_patch'] * 3
+    assert apply_messages(client, messages) == (5, DOCUMENTS[4])
+
+
+def test_resync_from_before_the_history_sends_a_snapshot(stream):
+    client = apply_messages((None, None), stream(DOCUMENTS[0]))
+    for document in DOCUMENTS[1:]:  # More patches than the history keeps
+        stream(document)
+
+    websocket_console.resync_serverstate(client[0])
+    messages = stream()
+
+    assert [message['action'] for message in messages] == ['serverstate']
+    assert apply_messages(client, messages) == (len(DOCUMENTS), DOCUMENTS[-1])
+
+
+def test_resync_of_an_up_to_date_client_sends_nothing(stream):
+    client = apply_messages((None, None), stream(DOCUMENTS[0]) + stream(DOCUMENTS[1]))
+
+    websocket_console.resync_serverstate(client[0])
+
+    assert stream() == []